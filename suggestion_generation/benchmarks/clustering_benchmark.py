@@ -0,0 +1,144 @@
+"""Wall-clock and peak-memory comparison of the weakness clustering backends.
+
+Run from the suggestion_generation directory, e.g.:
+
+    python -m benchmarks.clustering_benchmark --sizes 10000 100000 1000000 --backends community_detection exact faiss
+
+Every (backend, size) pair runs in a fresh process on synthetic clustered embeddings (all-mpnet-base-v2 dimension by default).
+Peak memory is the increase of the process' maximum resident set size during clustering. The dense
+sentence-transformers baseline is skipped above --baseline-max-size, since its n x n similarity matrix would not fit.
+"""
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import queue
+import resource
+import time
+
+
+def synthetic_embeddings(n, dim, n_clusters, noise, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    assignments = rng.integers(0, n_clusters, size=n)
+    embeddings = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100000):
+        end = min(start + 100000, n)
+        embeddings[start:end] = centers[assignments[start:end]] + rng.normal(scale=noise, size=(end - start, dim)).astype(np.float32)
+    return embeddings
+
+
+def adjusted_rand_index(labels_a, labels_b):
+    #clusters are given as label arrays, unclustered items carry unique labels
+    _, labels_a = np.unique(labels_a, return_inverse=True)
+    _, labels_b = np.unique(labels_b, return_inverse=True)
+    pairs = labels_a.astype(np.int64) * (labels_b.max() + 1) + labels_b
+    comb2 = lambda x: (x * (x - 1) / 2).sum()
+    sum_cells = comb2(np.unique(pairs, return_counts=True)[1].astype(np.float64))
+    sum_a = comb2(np.bincount(labels_a).astype(np.float64))
+    sum_b = comb2(np.bincount(labels_b).astype(np.float64))
+    expected = sum_a * sum_b / comb2(np.array([len(labels_a)], dtype=np.float64))
+    maximum = (sum_a + sum_b) / 2
+    return 1.0 if maximum == expected else (sum_cells - expected) / (maximum - expected)
+
+
+def communities_to_labels(communities, n):
+    labels = np.arange(n) + len(communities)
+    for idx, community in enumerate(communities):
+        labels[community] = idx
+    return labels
+
+
+def _run(backend, n, args, result_queue):
+    embeddings = synthetic_embeddings(n, args.dim, max(n // args.cluster_size, 1), args.noise, args.seed)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if backend == 'community_detection':
+        import torch
+        from sentence_transformers import util
+        communities = util.community_detection(torch.from_numpy(embeddings), threshold=args.threshold, min_community_size=args.min_size)
+        communities = [list(community) for community in communities]
+    else:
+        from processing_utils import clustering
+        communities = clustering.community_detection(embeddings, threshold=args.threshold, min_community_size=args.min_size, max_neighbours=args.max_neighbours, backend=backend)
+    elapsed = time.perf_counter() - start
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result_queue.put({
+        'backend': backend,
+        'n': n,
+        'seconds': elapsed,
+        'peak_memory_mb': (rss_after - rss_before) / 1024,
+        'n_clusters': len(communities),
+        'labels': communities_to_labels(communities, n).tolist() if n <= args.agreement_max_size else None,
+    })
+
+
+def run_benchmark(backend, n, args):
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=_run, args=(backend, n, args, result_queue))
+    process.start()
+
+    #the result is read before joining, since a large result blocks the child until it is consumed
+    result = None
+    while result is None:
+        try:
+            result = result_queue.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                break
+    process.join()
+    if result is None:
+        return {'backend': backend, 'n': n, 'error': f'exit code {process.exitcode}'}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--backends', nargs='+', default=['community_detection', 'exact', 'faiss'])
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--cluster-size', type=int, default=50, help='average number of weaknesses per synthetic cluster')
+    parser.add_argument('--noise', type=float, default=0.6)
+    parser.add_argument('--threshold', type=float, default=0.75)
+    parser.add_argument('--min-size', type=int, default=1)
+    parser.add_argument('--max-neighbours', type=int, default=100)
+    parser.add_argument('--baseline-max-size', type=int, default=30000)
+    parser.add_argument('--agreement-max-size', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=41)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        size_results = {}
+        for backend in args.backends:
+            if backend == 'community_detection' and n > args.baseline_max_size:
+                print(f'{backend:>20} | n={n:>8} | skipped (dense matrix needs {n * n * 4 / 1024**3:.1f} GB)')
+                continue
+            result = run_benchmark(backend, n, args)
+            size_results[backend] = result
+            if 'error' in result:
+                print(f'{backend:>20} | n={n:>8} | failed ({result["error"]})')
+                continue
+            print(f'{backend:>20} | n={n:>8} | {result["seconds"]:9.2f}s | peak +{result["peak_memory_mb"]:9.1f} MB | {result["n_clusters"]} clusters')
+
+        #agreement of every backend with the dense baseline (or the exact backend)
+        reference = size_results.get('community_detection', size_results.get('exact'))
+        for backend, result in size_results.items():
+            if reference is not None and result is not reference and result.get('labels') is not None and reference.get('labels') is not None:
+                result['ari_vs_' + reference['backend']] = adjusted_rand_index(np.array(reference['labels']), np.array(result['labels']))
+                print(f'{backend:>20} | n={n:>8} | ARI vs {reference["backend"]}: {result["ari_vs_" + reference["backend"]]:.4f}')
+        for result in size_results.values():
+            result.pop('labels', None)
+            results.append(result)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
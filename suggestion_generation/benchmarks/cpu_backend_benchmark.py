@@ -0,0 +1,128 @@
+"""Throughput and quality of the cpu backends of processing_utils.cpu_backend against the fp32 models.
+
+Run from the suggestion_generation directory, e.g.:
+
+    python -m benchmarks.cpu_backend_benchmark --backends fp32 int8 onnx onnx_int8 --threads 8
+
+For every backend, the three models of the SuggestionEngine are loaded on the cpu and run on synthetic airline texts:
+
+- search embedder: documents and queries per second, and recall@k of the top-k documents of every query against
+  the fp32 top-k (the tweet/abstract retrieval of the engine);
+- cluster embedder: texts per second, and the adjusted rand index of the weakness clusters against the fp32 clusters;
+- cross-encoder: query-candidate pairs per second, the overlap of the reranked top-k with the fp32 top-k and the
+  mean Spearman correlation of the scores.
+
+The fp32 backend is always run first as the reference.
+"""
+import argparse
+import json
+import numpy as np
+import time
+from benchmarks import synthetic
+from benchmarks.clustering_benchmark import adjusted_rand_index
+from benchmarks.clustering_benchmark import communities_to_labels
+from config import config_params
+from processing_utils import clustering
+from processing_utils import cpu_backend
+
+
+def spearman(scores_a, scores_b):
+    ranks_a = np.argsort(np.argsort(scores_a))
+    ranks_b = np.argsort(np.argsort(scores_b))
+    if ranks_a.std() == 0 or ranks_b.std() == 0:
+        return 1.0
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    output = fn(*args, **kwargs)
+    return output, time.perf_counter() - start
+
+
+def run_backend(backend, workload, args):
+    result = {'backend': backend, 'threads': args.threads}
+    search_embedder, result['load_seconds'] = timed(cpu_backend.load_sentence_transformer, args.search_model, backend, args.threads, args.onnx_int8_file_name)
+    cluster_embedder = cpu_backend.load_sentence_transformer(args.cluster_model, backend, args.threads, args.onnx_int8_file_name)
+    cross_encoder = cpu_backend.load_cross_encoder(args.cross_encoder_model, backend, args.threads, args.onnx_int8_file_name)
+
+    encode = lambda embedder, texts: clustering.normalize_embeddings(embedder.encode(texts, batch_size=args.batch_size, convert_to_numpy=True, show_progress_bar=False))
+    document_embeddings, seconds = timed(encode, search_embedder, workload['documents'])
+    result['search_documents_per_second'] = len(workload['documents']) / seconds
+    query_embeddings, seconds = timed(encode, search_embedder, workload['queries'])
+    result['search_queries_per_second'] = len(workload['queries']) / seconds
+    result['top_documents'] = np.argsort(-(query_embeddings @ document_embeddings.T), axis=1)[:, :args.k]
+
+    weakness_embeddings, seconds = timed(encode, cluster_embedder, workload['weaknesses'])
+    result['cluster_texts_per_second'] = len(workload['weaknesses']) / seconds
+    communities = clustering.community_detection(weakness_embeddings, threshold=args.cluster_threshold, min_community_size=1)
+    result['cluster_labels'] = communities_to_labels(communities, len(workload['weaknesses']))
+    result['n_clusters'] = len(communities)
+
+    pairs = [[query, candidate[0]] for query, candidates in workload['rerank'] for candidate in candidates]
+    scores, seconds = timed(cross_encoder.predict, pairs, batch_size=args.batch_size, show_progress_bar=False)
+    result['rerank_pairs_per_second'] = len(pairs) / seconds
+    offsets = np.cumsum([0] + [len(candidates) for _, candidates in workload['rerank']])
+    result['rerank_scores'] = [np.asarray(scores[start:end], dtype=np.float32) for start, end in zip(offsets[:-1], offsets[1:])]
+    return result
+
+
+def compare(result, reference, k):
+    #quality of a backend relative to the fp32 reference; the raw outputs are dropped afterwards
+    result['search_recall_at_k'] = float(np.mean([len(set(top) & set(reference_top)) / k for top, reference_top in zip(result['top_documents'], reference['top_documents'])]))
+    result['cluster_ari'] = adjusted_rand_index(reference['cluster_labels'], result['cluster_labels'])
+    result['rerank_top_k_overlap'] = float(np.mean([len(set(np.argsort(-scores)[:k]) & set(np.argsort(-reference_scores)[:k])) / min(k, len(scores)) for scores, reference_scores in zip(result['rerank_scores'], reference['rerank_scores'])]))
+    result['rerank_spearman'] = float(np.mean([spearman(scores, reference_scores) for scores, reference_scores in zip(result['rerank_scores'], reference['rerank_scores'])]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['fp32', 'int8'], choices=cpu_backend.CPU_BACKENDS)
+    parser.add_argument('--threads', type=int, help='intra-op threads, all cores by default')
+    parser.add_argument('--search-model', default=config_params['search_embedding_model'])
+    parser.add_argument('--cluster-model', default=config_params['cluster_embedding_model'])
+    parser.add_argument('--cross-encoder-model', default=f"cross-encoder/{config_params['cross_encoder_model']}")
+    parser.add_argument('--onnx-int8-file-name', default=config_params['cpu_onnx_int8_file_name'])
+    parser.add_argument('--documents', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--weaknesses', type=int, default=2000)
+    parser.add_argument('--rerank-queries', type=int, default=20)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--cluster-threshold', type=float, default=0.65)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=41)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    workload = {
+        'documents': [text for _, text in synthetic.synthetic_abstracts(args.documents, seed=args.seed)],
+        'queries': [text for _, text in synthetic.synthetic_tweets(args.queries, seed=args.seed + 1)],
+        'weaknesses': [text for _, text in synthetic.synthetic_tweets(args.weaknesses, seed=args.seed + 2, duplicate_rate=0.2)],
+        'rerank': [(query, synthetic.synthetic_candidates(seed=args.seed + idx)) for idx, (_, query) in enumerate(synthetic.synthetic_tweets(args.rerank_queries, seed=args.seed + 3))],
+    }
+
+    backends = ['fp32'] + [backend for backend in args.backends if backend != 'fp32']
+    results = []
+    for backend in backends:
+        try:
+            result = run_backend(backend, workload, args)
+        except ImportError as error:
+            print(f'{backend:>10} | skipped ({error})')
+            continue
+        compare(result, results[0] if results != [] else result, args.k)
+        results.append(result)
+        print(f'{backend:>10} | search {result["search_documents_per_second"]:8.1f} docs/s, recall@{args.k} {result["search_recall_at_k"]:.3f} '
+              f'| cluster {result["cluster_texts_per_second"]:8.1f} texts/s, ARI {result["cluster_ari"]:.3f} '
+              f'| rerank {result["rerank_pairs_per_second"]:8.1f} pairs/s, top-{args.k} overlap {result["rerank_top_k_overlap"]:.3f}, spearman {result["rerank_spearman"]:.3f}')
+
+    for result in results:
+        for name in ['top_documents', 'cluster_labels', 'rerank_scores']:
+            result.pop(name)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
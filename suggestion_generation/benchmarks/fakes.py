@@ -0,0 +1,308 @@
+"""Deterministic local stand-ins for the external services and models of the pipeline, used by the offline benchmarks.
+
+- FakeOpenAI: OpenAI-compatible client whose chat completions return schema-valid JSON for the four generation
+  templates after a configurable latency.
+- FakeSearchService: Google Custom Search service returning links to pages of the LocalServices server.
+- LocalServices: HTTP server for robots.txt, web pages, PDFs, the Semantic Scholar paper batch endpoint and the
+  GROBID processFulltextDocument endpoint, with a configurable latency per route.
+- FakeEmbedder, FakeCrossEncoder: hashing bag-of-words models with the parts of the SentenceTransformer and
+  CrossEncoder interfaces used by the pipeline, for runs without model downloads or a GPU.
+
+The in-memory Qdrant is QdrantClient(":memory:") and needs no stand-in.
+"""
+import json
+import numpy as np
+import random
+import re
+import threading
+import time
+import zlib
+from benchmarks import synthetic
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+
+def stable_hash(text):
+    #Python's hash() is salted per process, the benchmarks must be reproducible
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class FakeChatCompletions:
+
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model, messages, response_format=None, temperature=None, **kwargs):
+        self.client._wait()
+        content = json.dumps(self.client.respond(messages))
+        prompt_tokens = sum(len(message["content"]) // 4 for message in messages)
+        completion_tokens = len(content) // 4
+        with self.client._lock:
+            self.client.n_requests += 1
+            self.client.prompt_tokens += prompt_tokens
+            self.client.completion_tokens += completion_tokens
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content), finish_reason="stop")],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens),
+        )
+
+
+class FakeOpenAI:
+    """Answers the generation templates of this project like the OpenAI chat completions API, after latency +- jitter seconds."""
+
+    def __init__(self, latency=0.5, jitter=0.2, packed_omission_rate=0.0, seed=41):
+        self.latency = latency
+        self.jitter = jitter
+        self.packed_omission_rate = packed_omission_rate
+        self.n_requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=FakeChatCompletions(self))
+
+    def _wait(self):
+        with self._lock:
+            delay = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+        time.sleep(max(delay, 0))
+
+    def respond(self, messages):
+        system_prompt = messages[0]["content"]
+        user_prompt = messages[-1]["content"]
+        if '"process_weaknesses"' in system_prompt and "Tweets:\n" in user_prompt:
+            #packed request; packed_omission_rate of the tweets are left out of the answer, like a model that skips some
+            tweets = json.loads(user_prompt.split("Tweets:\n", 1)[-1])
+            with self._lock:
+                answered_ids = [feedback_id for feedback_id in tweets if self._rng.random() >= self.packed_omission_rate]
+            return {"process_weaknesses": {feedback_id: self._weaknesses(tweets[feedback_id]) for feedback_id in answered_ids}}
+        if '"process_weaknesses"' in system_prompt:
+            return {"process_weaknesses": self._weaknesses(user_prompt.split("Tweet: ", 1)[-1])}
+        if '"search_query"' in system_prompt:
+            first_text = user_prompt.split("Texts:\n", 1)[-1].split("\n\n")[0].strip().rstrip(".")
+            return {"search_query": f"How can airlines prevent that {first_text[:1].lower() + first_text[1:]}?"}
+        if '"improvement_suggestions_text"' in system_prompt:
+            context = user_prompt.split("Context Information:\n", 1)[-1].split("\n\nTweet: ")[0]
+            return {"improvement_suggestions_text": " ".join(context.split("\n\n")[:2])}
+        if '"improvement_suggestion"' in system_prompt:
+            context = user_prompt.split("Context Information:\n", 1)[-1].split("\n\nQuestion: ")[0]
+            return {"improvement_suggestion": context.split(". ")[0].strip()}
+        return {}
+
+    def _weaknesses(self, tweet):
+        if any(praise[:15] in tweet for praise in synthetic.PRAISE):
+            return []
+        tweet = re.sub(r"http\S+|#\w+|@\w+", "", tweet)
+        for affix in synthetic.OPENERS + synthetic.CLOSERS + ["RT "]:
+            if affix.strip() != "":
+                tweet = tweet.replace(affix.strip(), "")
+        return [clause.strip(" .!") + "." for clause in tweet.split(" and ") if clause.strip(" .!") != ""]
+
+
+class FakeSearchService:
+    """Stands in for googleapiclient's customsearch service: service.cse().list(q=..., cx=..., num=..., start=...).execute()."""
+
+    def __init__(self, base_url, n_pages=1000, private_share=0.1, latency=0.1):
+        self.base_url = base_url
+        self.n_pages = n_pages
+        self.private_share = private_share
+        self.latency = latency
+
+    def cse(self):
+        return self
+
+    def list(self, q, cx, num=10, start=1):
+        return SimpleNamespace(execute=lambda: self._execute(q, num, start))
+
+    def _execute(self, q, num, start):
+        time.sleep(self.latency)
+        rng = random.Random(stable_hash(q) + start)
+        items = []
+        for _ in range(num):
+            page = rng.randrange(self.n_pages)
+            #robots.txt disallows /private/, so these links exercise the robots check
+            directory = "private" if rng.random() < self.private_share else "pages"
+            items.append({"link": f"{self.base_url}/{directory}/{page}.html"})
+        return {"items": items}
+
+
+class LocalServices:
+    """HTTP server on localhost for robots.txt, pages, PDFs, Semantic Scholar and GROBID.
+
+    Every corpus id whose number is divisible by closed_access_every is returned as closed access. latencies maps
+    the routes 'robots', 'page', 'pdf', 'scholar' and 'grobid' to seconds per request. Use as a context manager.
+    """
+
+    def __init__(self, latencies=None, pdf_size=200000, closed_access_every=4):
+        self.latencies = {'robots': 0.02, 'page': 0.05, 'pdf': 0.1, 'scholar': 0.2, 'grobid': 0.5}
+        self.latencies.update(latencies or {})
+        self.pdf_size = pdf_size
+        self.closed_access_every = closed_access_every
+        self.requests = {route: 0 for route in self.latencies}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def grobid_url(self):
+        return self.base_url
+
+    @property
+    def scholar_url(self):
+        return self.base_url
+
+    def _count(self, route):
+        with self._lock:
+            self.requests[route] += 1
+        time.sleep(self.latencies[route])
+
+    def _paper(self, corpus_id):
+        if corpus_id % self.closed_access_every == 0:
+            return {"corpusId": corpus_id, "title": f"Paper {corpus_id}", "isOpenAccess": False, "openAccessPdf": None, "tldr": None}
+        return {"corpusId": corpus_id, "title": f"Paper {corpus_id}", "isOpenAccess": True, "openAccessPdf": {"url": f"{self.base_url}/papers/{corpus_id}.pdf", "status": "GREEN"}, "tldr": None}
+
+    def _handler_class(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, content_type, body):
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path == "/robots.txt":
+                    services._count("robots")
+                    self._send(200, "text/plain", "User-agent: *\nDisallow: /private/\n")
+                elif path.startswith("/pages/") or path.startswith("/private/"):
+                    services._count("page")
+                    self._send(200, "text/html", synthetic.synthetic_page(random.Random(stable_hash(path))))
+                elif path.startswith("/papers/"):
+                    services._count("pdf")
+                    header = f"%PDF-1.4\n%{path}\n".encode("utf-8")
+                    self._send(200, "application/pdf", header + b"0" * max(services.pdf_size - len(header), 0))
+                else:
+                    self._send(404, "text/plain", "not found")
+
+            def do_POST(self):
+                path = urlsplit(self.path).path
+                body = self._read_body()
+                if path == "/graph/v1/paper/batch":
+                    services._count("scholar")
+                    ids = json.loads(body)["ids"]
+                    self._send(200, "application/json", json.dumps([services._paper(int(paper_id.split(":")[-1])) for paper_id in ids]))
+                elif path == "/api/processFulltextDocument":
+                    services._count("grobid")
+                    #the PDF path is part of the uploaded file, so every paper gets its own deterministic text
+                    match = re.search(rb"%(/papers/\d+\.pdf)", body)
+                    seed = stable_hash(match.group(1).decode("utf-8")) if match else 0
+                    self._send(200, "application/xml", synthetic.synthetic_tei(random.Random(seed)))
+                else:
+                    self._send(404, "text/plain", "not found")
+
+        return Handler
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer with the call, decode and num_special_tokens_to_add interface of a Hugging Face tokenizer.
+
+    Special tokens are counted, not emitted.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._words = []
+        self._lock = threading.Lock()
+
+    def _token_ids(self, text):
+        ids = []
+        with self._lock:
+            for word in text.split():
+                if word not in self._ids:
+                    self._ids[word] = len(self._words)
+                    self._words.append(word)
+                ids.append(self._ids[word])
+        return ids
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2
+
+    def __call__(self, texts, add_special_tokens=True, truncation=False, max_length=256, **kwargs):
+        input_ids = [self._token_ids(text) for text in texts]
+        if truncation == True:
+            input_ids = [ids[:max_length - self.num_special_tokens_to_add()] for ids in input_ids]
+        return {'input_ids': input_ids}
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return " ".join(self._words[token_id] for token_id in token_ids)
+
+
+class FakeEmbedder:
+    """Hashing bag-of-words embedder with the encode interface of a SentenceTransformer. Texts sharing words are similar."""
+
+    def __init__(self, dimension=384, max_seq_length=256):
+        self.dimension = dimension
+        self.max_seq_length = max_seq_length
+        self.tokenizer = FakeTokenizer()
+        self.device = 'cpu'
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def get_max_seq_length(self):
+        return self.max_seq_length
+
+    def _embed(self, text):
+        embedding = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            word_hash = stable_hash(word)
+            embedding[word_hash % self.dimension] += 1.0 if word_hash & 1 << 31 else -1.0
+        return embedding / max(np.linalg.norm(embedding), 1e-12)
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=None, convert_to_numpy=True, convert_to_tensor=False, device=None, normalize_embeddings=False, **kwargs):
+        single_sentence = isinstance(sentences, str)
+        texts = [sentences] if single_sentence else list(sentences)
+        embeddings = np.stack([self._embed(text) for text in texts]) if texts != [] else np.empty((0, self.dimension), dtype=np.float32)
+        if single_sentence:
+            embeddings = embeddings[0]
+        if convert_to_tensor == True:
+            import torch
+            return torch.from_numpy(embeddings)
+        return embeddings
+
+
+class FakeCrossEncoder:
+    """Word-overlap scorer with the predict interface of a CrossEncoder."""
+
+    def predict(self, sentence_pairs, batch_size=32, show_progress_bar=None, **kwargs):
+        scores = []
+        for query, text in sentence_pairs:
+            query_words = set(re.findall(r"\w+", query.lower()))
+            text_words = set(re.findall(r"\w+", text.lower()))
+            scores.append(len(query_words & text_words) / max(len(query_words | text_words), 1))
+        return np.array(scores, dtype=np.float32)
@@ -0,0 +1,217 @@
+"""Offline end-to-end benchmark of vector_db.create_db_collection and the SuggestionEngine stages.
+
+Run from the suggestion_generation directory, e.g.:
+
+    python -m benchmarks.pipeline_benchmark --sizes 100 1000 10000 --llm-latency 0.5
+
+OpenAI, Google Custom Search, Semantic Scholar, GROBID and the crawled websites are replaced by the local stand-ins
+of benchmarks.fakes, Qdrant runs in memory. The embedders and the cross-encoder are hashing fakes unless
+--real-models is given, in which case the configured models are loaded on --device. For every size, the synthetic
+tweets are both the feedback and the tweet knowledge base, and --abstracts-per-tweet abstracts are ingested.
+
+Every stage reports its wall time, its throughput in input items per second and the peak resident memory of the
+process during the stage (sampled every few milliseconds), both absolute and above the level at the stage's start.
+All caches live in a temporary directory and are empty at the start of every size. With --metrics-dir, the per-call
+metrics of processing_utils.metrics are written per size as JSON and in Prometheus text format.
+"""
+import argparse
+import json
+import os
+import pandas as pd
+import resource
+import sys
+import tempfile
+import threading
+import time
+from benchmarks import fakes
+from benchmarks import synthetic
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except OSError:
+        #not Linux: the maximum resident set size is the best available approximation
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PeakMemory:
+    """Samples the resident set size of the process in a background thread while the context is active."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+class StageRecorder:
+
+    def __init__(self, size):
+        self.size = size
+        self.results = []
+
+    def run(self, stage, n_items, fn, *args, **kwargs):
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            output = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+        result = {
+            'size': self.size,
+            'stage': stage,
+            'items': n_items,
+            'seconds': elapsed,
+            'items_per_second': n_items / elapsed if elapsed > 0 else float('inf'),
+            'peak_memory_mb': memory.peak_mb,
+            'peak_memory_increase_mb': memory.peak_mb - memory.start_mb,
+        }
+        self.results.append(result)
+        print(f'{stage:>30} | n={self.size:>7} | {n_items:>8} items | {elapsed:9.2f}s | {result["items_per_second"]:10.1f} items/s | peak {memory.peak_mb:8.1f} MB (+{result["peak_memory_increase_mb"]:.1f})')
+        sys.stdout.flush()
+        return output
+
+
+def configure(workdir, services, args):
+    from config import config_params
+    config_params.update({
+        'semantic_scholar_url': services.scholar_url,
+        'GROBID_URL': services.grobid_url,
+        'paper_cache_path': os.path.join(workdir, 'papers.sqlite'),
+        'robots_cache_path': os.path.join(workdir, 'robots.sqlite'),
+        'llm_cache_enabled': args.llm_cache,
+        'llm_cache_path': os.path.join(workdir, 'llm_completions.sqlite'),
+        'embedding_cache_path': os.path.join(workdir, 'embeddings'),
+        'llm_max_concurrency': args.llm_concurrency,
+        'search_embedding_device': args.device,
+        'cluster_embedding_device': args.device,
+        'cross_encoder_device': args.device,
+        'metrics_enabled': args.metrics_dir is not None,
+        'weakness_pack_size': args.weakness_pack_size,
+        'feedback_dedup_threshold': args.feedback_dedup_threshold,
+        'query_cache_enabled': args.query_cache_threshold is not None,
+        'query_cache_threshold': args.query_cache_threshold if args.query_cache_threshold is not None else config_params['query_cache_threshold'],
+        'adaptive_retrieval': args.adaptive_min_score is not None,
+        'adaptive_retrieval_min_score': args.adaptive_min_score if args.adaptive_min_score is not None else config_params['adaptive_retrieval_min_score'],
+    })
+
+
+def create_engine(services, args):
+    from qdrant_client import QdrantClient
+    from suggestion_engine import SuggestionEngine
+
+    engine = SuggestionEngine()
+    engine.openAI_client = fakes.FakeOpenAI(latency=args.llm_latency, jitter=args.llm_jitter, packed_omission_rate=args.packed_omission_rate)
+    engine.websearch_service = fakes.FakeSearchService(services.base_url, latency=args.search_latency)
+    engine.qdrantdb_client = QdrantClient(":memory:")
+    if args.real_models == False:
+        engine.search_embedder = fakes.FakeEmbedder(dimension=384)
+        engine.cluster_embedder = fakes.FakeEmbedder(dimension=768)
+        engine.cross_encoder = fakes.FakeCrossEncoder()
+    return engine
+
+
+def run_size(n, args):
+    from processing_utils import metrics
+    from processing_utils import vector_db
+
+    recorder = StageRecorder(n)
+    with tempfile.TemporaryDirectory() as workdir, fakes.LocalServices(latencies=args.service_latency) as services:
+        configure(workdir, services, args)
+        engine = create_engine(services, args)
+
+        tweets = synthetic.synthetic_tweets(n, seed=args.seed, duplicate_rate=args.duplicate_rate)
+        abstracts = synthetic.synthetic_abstracts(n * args.abstracts_per_tweet, seed=args.seed)
+        for directory, records, columns in [('tweets', tweets, ['id', 'text']), ('abstracts', abstracts, ['corpusid', 'abstract'])]:
+            os.makedirs(os.path.join(workdir, directory))
+            synthetic.write_jsonl(os.path.join(workdir, directory, f'{directory}.jsonl'), records, columns)
+
+        #models are loaded outside of the measured stages
+        engine.search_embedder, engine.cluster_embedder, engine.cross_encoder
+
+        recorder.run('ingest tweets', len(tweets), vector_db.create_db_collection, os.path.join(workdir, 'tweets'), 'id', 'text', engine.qdrantdb_client, engine.tweet_collection_name, engine.search_embedder, cross_dataset_preprocess=True, streaming=args.streaming_ingest)
+        recorder.run('ingest abstracts', len(abstracts), vector_db.create_db_collection, os.path.join(workdir, 'abstracts'), 'corpusid', 'abstract', engine.qdrantdb_client, engine.abstract_collection_name, engine.search_embedder, cross_dataset_preprocess=True, streaming=args.streaming_ingest)
+
+        feedback = pd.DataFrame(tweets, columns=['id', 'text'])
+        recorder.run('load_feedback', n, engine.load_feedback, feedback, 'id', 'text', True)
+        recorder.run('weaknesses_identification', engine.feedback.shape[0], engine.weaknesses_identification)
+        recorder.run('weaknesses_clustering', engine.weakness_cluster_batch.shape[0], engine.weaknesses_clustering, cluster_min_size=1, cluster_threshold=args.cluster_threshold)
+        n_clusters = len(set(engine.weakness_cluster_batch['cluster'].to_list()) - {-1})
+        recorder.run('cluster_query_generation', n_clusters, engine.cluster_query_generation, cluster_max_examples=10)
+        recorder.run('cluster_suggestion_generation', n_clusters, engine.cluster_suggestion_generation, limit_results_retrieve=args.limit_retrieve, limit_results_rerank=args.limit_rerank)
+        recorder.run('feedback_answer_generation', engine.feedback_weakness_batch.shape[0], engine.feedback_answer_generation)
+
+        llm = engine.openAI_client
+        print(f'{"":>30} | n={n:>7} | {n_clusters} clusters | {llm.n_requests} LLM requests, {llm.prompt_tokens + llm.completion_tokens} tokens | service requests {services.requests}')
+        for result in recorder.results:
+            result['clusters'] = n_clusters
+            result['llm_requests'] = llm.n_requests
+            result['service_requests'] = dict(services.requests)
+        if args.metrics_dir is not None:
+            metrics.write_summary(os.path.join(args.metrics_dir, f'metrics_{n}.json'), os.path.join(args.metrics_dir, f'metrics_{n}.prom'))
+            metrics.reset()
+        engine.retrieval_pool.shutdown()
+        engine.prefetch_pool.shutdown()
+    return recorder.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--abstracts-per-tweet', type=int, default=1)
+    parser.add_argument('--duplicate-rate', type=float, default=0.2)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='seconds per completion of the OpenAI stub')
+    parser.add_argument('--llm-jitter', type=float, default=0.2)
+    parser.add_argument('--llm-concurrency', type=int, default=16)
+    parser.add_argument('--weakness-pack-size', type=int, default=1)
+    parser.add_argument('--feedback-dedup-threshold', type=float, help='share one weakness identification among near-duplicate tweets above this estimated Jaccard similarity')
+    parser.add_argument('--packed-omission-rate', type=float, default=0.0, help='share of the tweets the OpenAI stub leaves out of packed answers')
+    parser.add_argument('--query-cache-threshold', type=float, help='reuse the reranked context and suggestion of search queries above this cosine similarity (empty at the start of every size)')
+    parser.add_argument('--adaptive-min-score', type=float, help='retrieve the paper full texts and websites only while too few reranked results reach this cross-encoder score')
+    parser.add_argument('--llm-cache', action='store_true', help='enable the completion cache (empty at the start of every size)')
+    parser.add_argument('--search-latency', type=float, default=0.1, help='seconds per Custom Search request')
+    parser.add_argument('--service-latency', type=json.loads, default={}, help='JSON object overriding the latency of the routes robots, page, pdf, scholar and grobid')
+    parser.add_argument('--real-models', action='store_true', help='load the configured models instead of the hashing fakes')
+    parser.add_argument('--device', default='auto')
+    parser.add_argument('--streaming-ingest', action='store_true')
+    parser.add_argument('--cluster-threshold', type=float, default=0.65)
+    parser.add_argument('--limit-retrieve', type=int, default=10)
+    parser.add_argument('--limit-rerank', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=41)
+    parser.add_argument('--metrics-dir', help='record the metrics of processing_utils.metrics and write them per size to this directory')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    try:
+        from langchain.document_loaders import WebBaseLoader
+    except ImportError:
+        print('langchain is not installed, web retrieval contributes no documents')
+
+    results = []
+    for n in args.sizes:
+        results.extend(run_size(n, args))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Scaling of the suggestion postprocessing: the original nested loops against processing_utils.postprocessing.attach_suggestions.
+
+Run from the suggestion_generation directory, e.g.:
+
+    python -m benchmarks.postprocessing_benchmark --sizes 1000 10000 100000 1000000
+
+Every feedback has 0-3 weaknesses and there is one cluster per ~20 weaknesses. The nested-loop baseline is skipped
+above --baseline-max-size. A constant time per feedback row across sizes means linear scaling.
+"""
+import argparse
+import numpy as np
+import pandas as pd
+import time
+from processing_utils import postprocessing
+
+
+def baseline_postprocessing(feedback_weakness_batch, weakness_cluster_batch, cluster_queries_batch):
+    #the implementation of SuggestionEngine._suggestions_postprocessing before attach_suggestions
+    weakness_cluster_batch = weakness_cluster_batch.values.tolist()
+    cluster_queries_batch = cluster_queries_batch.values.tolist()
+
+    for idx, weakness_cluster_i in enumerate(weakness_cluster_batch):
+        weakness_cluster_batch[idx].append([])
+        for cluster_query_i in cluster_queries_batch:
+            if weakness_cluster_i[2] == cluster_query_i[0]:
+                weakness_cluster_batch[idx][3] = cluster_query_i[2]
+
+    feedback_weakness_batch = feedback_weakness_batch.values.tolist()
+    for idx, feedback_weakness_i in enumerate(feedback_weakness_batch):
+        feedback_weakness_batch[idx].append([])
+        suggestions_i = []
+        for weakness_cluster_i in weakness_cluster_batch:
+            if feedback_weakness_i[0] == weakness_cluster_i[0]:
+                suggestions_i.append(weakness_cluster_i[3])
+        feedback_weakness_batch[idx][3] = list(set(suggestions_i))
+
+    feedback_weakness_batch = pd.DataFrame(feedback_weakness_batch, columns=['feedback_id', 'feedback_text', 'weaknesses', 'suggestions'])
+    weakness_cluster_batch = pd.DataFrame(weakness_cluster_batch, columns=['feedback_id', 'weakness', 'cluster', 'suggestions'])
+    return feedback_weakness_batch, weakness_cluster_batch
+
+
+def synthetic_batches(n_feedback, seed=41):
+    rng = np.random.default_rng(seed)
+    n_weaknesses_per_feedback = rng.integers(0, 4, size=n_feedback)
+    feedback_ids = np.arange(n_feedback)
+    weakness_feedback_ids = np.repeat(feedback_ids, n_weaknesses_per_feedback)
+    n_weaknesses = len(weakness_feedback_ids)
+    n_clusters = max(n_weaknesses // 20, 1)
+    weakness_clusters = rng.integers(-1, n_clusters, size=n_weaknesses)
+
+    feedback_weakness_batch = pd.DataFrame({
+        'feedback_id': feedback_ids,
+        'feedback_text': [f'feedback {idx}' for idx in feedback_ids],
+        'weaknesses': [[f'weakness {idx}.{j}' for j in range(n)] for idx, n in zip(feedback_ids, n_weaknesses_per_feedback)],
+    })
+    weakness_cluster_batch = pd.DataFrame({
+        'feedback_id': weakness_feedback_ids,
+        'weakness': [f'weakness {idx}' for idx in range(n_weaknesses)],
+        'cluster': weakness_clusters,
+    })
+    clusters = list(range(-1, n_clusters))
+    cluster_queries_batch = pd.DataFrame({
+        'cluster': clusters,
+        'search_query': [f'query {cluster_i}' for cluster_i in clusters],
+        'suggestions': [f'suggestion {cluster_i}' for cluster_i in clusters],
+        'reranked': [[] for _ in clusters],
+    })
+    return feedback_weakness_batch, weakness_cluster_batch, cluster_queries_batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--baseline-max-size', type=int, default=2000)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        batches = synthetic_batches(n)
+        implementations = [('attach_suggestions', postprocessing.attach_suggestions)]
+        if n <= args.baseline_max_size:
+            implementations.append(('nested loops', baseline_postprocessing))
+
+        results = {}
+        for name, implementation in implementations:
+            start = time.perf_counter()
+            results[name] = implementation(*batches)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>20} | n={n:>8} | {elapsed:9.3f}s | {elapsed / n * 1e6:8.2f} us/feedback')
+
+        if len(results) == 2:
+            #the baseline returns the suggestions of a feedback in set order
+            same = all(sorted(a) == sorted(b) for a, b in zip(results['attach_suggestions'][0]['suggestions'], results['nested loops'][0]['suggestions']))
+            same = same and results['attach_suggestions'][1]['suggestions'].to_list() == results['nested loops'][1]['suggestions'].to_list()
+            print(f'{"":>20} | n={n:>8} | same output: {same}')
+
+
+if __name__ == '__main__':
+    main()
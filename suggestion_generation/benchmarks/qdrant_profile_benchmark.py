@@ -0,0 +1,141 @@
+"""Recall@k against search latency of the Qdrant collection profiles of config_params["collection_profiles"].
+
+Run from the suggestion_generation directory against a local Qdrant server, e.g.:
+
+    docker run -p 6333:6333 -p 6334:6334 qdrant/qdrant
+    python -m benchmarks.qdrant_profile_benchmark --sizes 100000 1000000 --profiles default scalar binary
+
+For every size, synthetic clustered embeddings (all-MiniLM-L6-v2 dimension by default) are uploaded to a fresh
+collection per profile with vector_db.recreate_db, indexed like vector_db.create_db_collection does, and searched
+with one request per query using vector_db.search_params. Recall@k is the share of the exact top-k (brute force in
+numpy) that a profile returns. The RAM column estimates the resident vectors, quantized vectors and HNSW links;
+Qdrant's page cache for on-disk data comes on top. With --location :memory: the benchmark runs in the in-process
+client, which ignores HNSW and quantization settings (useful to check the setup only).
+"""
+import argparse
+import json
+import numpy as np
+import time
+from benchmarks import fakes
+from benchmarks.clustering_benchmark import synthetic_embeddings
+from config import config_params
+from processing_utils import clustering
+from processing_utils import vector_db
+
+
+def exact_top_k(corpus, queries, k, block_size=100000):
+    scores = np.empty((len(queries), 0), dtype=np.float32)
+    idxs = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(corpus), block_size):
+        block_scores = queries @ corpus[start:start+block_size].T
+        scores = np.concatenate([scores, block_scores], axis=1)
+        idxs = np.concatenate([idxs, np.broadcast_to(np.arange(start, start + block_scores.shape[1]), block_scores.shape)], axis=1)
+        top = np.argsort(-scores, axis=1)[:, :k]
+        scores, idxs = np.take_along_axis(scores, top, axis=1), np.take_along_axis(idxs, top, axis=1)
+    return idxs
+
+
+def estimated_ram_mb(n, dim, profile):
+    vectors = 0 if profile['on_disk'] else n * dim * 4
+    quantized = 0
+    if profile['quantization'] is not None and (profile['quantization_always_ram'] or not profile['on_disk']):
+        quantized = n * dim if profile['quantization'] == 'scalar' else n * dim / 8
+    #level 0 of the graph has 2 * m links of 4 bytes per point
+    links = 0 if profile['hnsw_on_disk'] else n * 2 * (profile['hnsw_m'] or 16) * 4
+    return (vectors + quantized + links) / 1024**2
+
+
+def wait_for_index(client, collection_name, timeout):
+    start = time.time()
+    while time.time() - start < timeout:
+        info = client.get_collection(collection_name)
+        if str(info.status).lower().endswith('green'):
+            return time.time() - start
+        time.sleep(1)
+    print(f'{collection_name} not indexed after {timeout}s, measuring anyway')
+    return time.time() - start
+
+
+def run_profile(client, name, profile, corpus, queries, truth, args):
+    from qdrant_client import models
+    collection_name = f'profile_benchmark_{name}'
+    vector_db.recreate_db(client, collection_name, fakes.FakeEmbedder(dimension=corpus.shape[1]), profile)
+
+    start = time.time()
+    client.upload_collection(collection_name=collection_name, ids=list(range(len(corpus))), vectors=corpus, payload=None, batch_size=1024)
+    upload_seconds = time.time() - start
+    client.update_collection(collection_name=collection_name, optimizer_config=models.OptimizersConfigDiff(indexing_threshold=20000))
+    index_seconds = wait_for_index(client, collection_name, args.index_timeout)
+
+    params = vector_db.search_params(profile)
+    for query in queries[:10]:
+        client.search(collection_name=collection_name, query_vector=query.tolist(), limit=args.k, search_params=params)
+
+    latencies = []
+    recalls = []
+    for query, query_truth in zip(queries, truth):
+        start = time.perf_counter()
+        results = client.search(collection_name=collection_name, query_vector=query.tolist(), limit=args.k, search_params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(result.id for result in results) & set(query_truth.tolist())) / args.k)
+
+    if args.keep_collections == False:
+        client.delete_collection(collection_name)
+    return {
+        'profile': name,
+        'n': len(corpus),
+        'recall_at_k': float(np.mean(recalls)),
+        'latency_ms_p50': float(np.percentile(latencies, 50)),
+        'latency_ms_p95': float(np.percentile(latencies, 95)),
+        'upload_seconds': upload_seconds,
+        'index_seconds': index_seconds,
+        'estimated_ram_mb': estimated_ram_mb(len(corpus), corpus.shape[1], profile),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000])
+    parser.add_argument('--profiles', nargs='+', default=list(config_params['collection_profiles']))
+    parser.add_argument('--host', default=config_params['qdrant_host'])
+    parser.add_argument('--grpc-port', type=int, default=config_params['qdrant_grpc_port'])
+    parser.add_argument('--location', help="e.g. ':memory:' for the in-process client instead of the server")
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--cluster-size', type=int, default=50, help='average number of points per synthetic cluster')
+    parser.add_argument('--noise', type=float, default=0.6)
+    parser.add_argument('--index-timeout', type=int, default=3600)
+    parser.add_argument('--keep-collections', action='store_true')
+    parser.add_argument('--seed', type=int, default=41)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient
+    if args.location is not None:
+        client = QdrantClient(location=args.location)
+    else:
+        client = QdrantClient(host=args.host, grpc_port=args.grpc_port, prefer_grpc=True, timeout=600)
+
+    results = []
+    for n in args.sizes:
+        corpus = clustering.normalize_embeddings(synthetic_embeddings(n, args.dim, max(n // args.cluster_size, 1), args.noise, args.seed))
+        rng = np.random.default_rng(args.seed + 1)
+        queries = corpus[rng.integers(0, n, size=args.queries)] + rng.normal(scale=0.5 / np.sqrt(args.dim), size=(args.queries, args.dim)).astype(np.float32)
+        queries = clustering.normalize_embeddings(queries)
+        truth = exact_top_k(corpus, queries, args.k)
+
+        for name in args.profiles:
+            profile = vector_db.collection_profile(config_params['collection_profiles'][name])
+            result = run_profile(client, name, profile, corpus, queries, truth, args)
+            results.append(result)
+            print(f'{name:>20} | n={n:>8} | recall@{args.k} {result["recall_at_k"]:.3f} | p50 {result["latency_ms_p50"]:7.2f} ms | p95 {result["latency_ms_p95"]:7.2f} ms '
+                  f'| upload {result["upload_seconds"]:7.1f}s, index {result["index_seconds"]:7.1f}s | RAM ~{result["estimated_ram_mb"]:8.1f} MB')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Per-query latency of cross-encoder reranking: the original argsort implementation against processing_utils.reranking.Reranker.
+
+Run from the suggestion_generation directory, e.g.:
+
+    python -m benchmarks.rerank_benchmark --queries 50 --device cpu
+
+The candidate sets mimic SuggestionEngine._retrieve: short tweets, long paper chunks, web chunks and duplicates.
+The overlap column is the share of the baseline's top-k that the variant returns as well.
+"""
+import argparse
+import numpy as np
+import random
+import time
+from benchmarks import synthetic
+from processing_utils import reranking
+
+
+def baseline_rerank(cross_encoder, query, query_results, limit_results_rerank):
+    #the implementation of SuggestionEngine._rerank before the Reranker
+    similarity_scores = cross_encoder.predict([[query, query_result[0]] for query_result in query_results], show_progress_bar=False)
+    return [query_results[idx] for idx in reversed(np.argsort(similarity_scores))][0:limit_results_rerank]
+
+
+def measure(name, rerank_fn, workload, baseline_results, limit):
+    latencies = []
+    overlaps = []
+    for (query, candidates), baseline_top in zip(workload, baseline_results):
+        start = time.perf_counter()
+        top = rerank_fn(query, candidates, limit)
+        latencies.append((time.perf_counter() - start) * 1000)
+        baseline_texts = set(result[0] for result in baseline_top)
+        overlaps.append(len(baseline_texts & set(result[0] for result in top)) / max(len(baseline_texts), 1))
+    latencies = np.array(latencies)
+    print(f'{name:>28} | mean {latencies.mean():8.1f} ms | p50 {np.percentile(latencies, 50):8.1f} ms | p95 {np.percentile(latencies, 95):8.1f} ms | overlap {np.mean(overlaps):.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--prefilter-limit', type=int, default=30)
+    parser.add_argument('--cross-encoder', default='cross-encoder/ms-marco-MiniLM-L-6-v2')
+    parser.add_argument('--search-embedder', default='all-MiniLM-L6-v2')
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.cross_encoder import CrossEncoder
+
+    cross_encoder = CrossEncoder(args.cross_encoder, device=args.device)
+    search_embedder = SentenceTransformer(args.search_embedder, device=args.device)
+
+    rng = random.Random(41)
+    workload = []
+    for idx in range(args.queries):
+        query = f'How can airlines {rng.choice(["reduce lost baggage", "shorten delays", "speed up refunds", "improve rebooking", "handle damaged suitcases"])}?'
+        workload.append((query, synthetic.synthetic_candidates(seed=idx)))
+
+    #warm-up, so that model loading and first-call overhead are not measured
+    baseline_rerank(cross_encoder, workload[0][0], workload[0][1], args.limit)
+    baseline_results = [baseline_rerank(cross_encoder, query, candidates, args.limit) for query, candidates in workload]
+
+    measure('baseline', lambda query, candidates, limit: baseline_rerank(cross_encoder, query, candidates, limit), workload, baseline_results, args.limit)
+
+    reranker = reranking.Reranker(cross_encoder, batch_size=args.batch_size, cache_size=0)
+    measure('dedupe + length batching', reranker.rerank, workload, baseline_results, args.limit)
+
+    reranker = reranking.Reranker(cross_encoder, batch_size=args.batch_size)
+    measure('score cache (cold)', reranker.rerank, workload, baseline_results, args.limit)
+    measure('score cache (warm)', reranker.rerank, workload, baseline_results, args.limit)
+
+    reranker = reranking.Reranker(cross_encoder, batch_size=args.batch_size, prefilter_embedder=search_embedder, prefilter_limit=args.prefilter_limit, cache_size=0)
+    measure(f'bi-encoder prefilter ({args.prefilter_limit})', reranker.rerank, workload, baseline_results, args.limit)
+
+    if args.device.startswith('cuda'):
+        cross_encoder.model.half()
+        reranker = reranking.Reranker(cross_encoder, batch_size=args.batch_size, cache_size=0)
+        measure('fp16', reranker.rerank, workload, baseline_results, args.limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Deterministic synthetic airline texts for the benchmarks."""
+import random
+
+
+COMPLAINTS = [
+    "my flight was delayed by {hours} hours",
+    "you lost my bag on the way to {city}",
+    "my suitcase arrived completely damaged",
+    "I was rebooked on a different flight without being asked",
+    "the gate agent in {city} was rude to us",
+    "I waited {minutes} minutes on hold with customer service",
+    "my refund still has not arrived after {weeks} weeks",
+    "the app crashed during check-in",
+    "the plane sat on the tarmac in {city} for {hours} hours",
+    "my connecting flight left before we landed",
+    "the wifi on board did not work at all",
+    "there was no vegetarian meal although I ordered one",
+    "my seat was given away to someone else",
+    "the baggage claim in {city} took over an hour",
+    "nobody told us why the flight was cancelled",
+]
+
+OPENERS = ["", "Seriously, ", "Unbelievable. ", "Hey, ", "Once again ", "Thanks for nothing, ", "Wow. "]
+CLOSERS = ["", " Never again.", " #fail", " Fix this!", " Really disappointed.", " What a joke.", " Please help."]
+PRAISE = ["I had a wonderful flight!", "Great crew on my flight to {city} today.", "Smooth boarding and friendly staff, thank you!"]
+CITIES = ["Miami", "Boston", "Denver", "Chicago", "Dallas", "Seattle", "Atlanta", "Newark", "Houston", "Phoenix"]
+
+SUGGESTION_SENTENCES = [
+    "Airlines can reduce mishandled baggage by tracking bags with RFID tags at every transfer point.",
+    "Proactive delay notifications through the app reduce the number of calls to customer service.",
+    "Automated rebooking should offer passengers a choice of alternative flights before confirming.",
+    "Staff training on de-escalation improves the perceived service quality at the gate.",
+    "Refund processing times drop when eligibility checks are automated.",
+    "Minimum connection times should be adjusted to the historical delay distribution of each route.",
+    "Self-service kiosks for damaged baggage claims shorten the queues at the baggage office.",
+    "Transparent communication of the reason for a cancellation increases passenger satisfaction.",
+]
+
+
+def _fill(template, rng):
+    return template.format(hours=rng.randint(1, 9), minutes=rng.choice([30, 45, 90, 120]), weeks=rng.randint(2, 12), city=rng.choice(CITIES))
+
+
+def synthetic_tweet(rng, max_complaints=2):
+    if rng.random() < 0.15:
+        return _fill(rng.choice(PRAISE), rng)
+    complaints = [_fill(rng.choice(COMPLAINTS), rng) for _ in range(rng.randint(1, max_complaints))]
+    text = " and ".join(complaints)
+    return rng.choice(OPENERS) + text[0].upper() + text[1:] + "." + rng.choice(CLOSERS)
+
+
+def synthetic_tweets(n, seed=41, duplicate_rate=0.0):
+    """Returns n (id, text) tuples. A duplicate_rate share of the tweets repeats an earlier tweet with trivial changes (retweets, copy-paste)."""
+    rng = random.Random(seed)
+    tweets = []
+    for idx in range(n):
+        if tweets != [] and rng.random() < duplicate_rate:
+            text = rng.choice(tweets)[1]
+            text = rng.choice(["RT ", "", "@airline "]) + text + rng.choice(["", " !!", " http://t.co/" + str(rng.randint(0, 10**6))])
+        else:
+            text = synthetic_tweet(rng)
+        tweets.append((1000000 + idx, text))
+    return tweets
+
+
+def synthetic_document(rng, n_sentences):
+    sentences = [rng.choice(SUGGESTION_SENTENCES) for _ in range(n_sentences)]
+    return " ".join(sentences)
+
+
+def synthetic_candidates(n_tweets=10, n_paper_chunks=40, n_web_chunks=20, duplicate_rate=0.2, seed=41):
+    """Returns retrieval results in the [text, source, source type] format of SuggestionEngine._retrieve."""
+    rng = random.Random(seed)
+    candidates = [[synthetic_tweet(rng), idx, 'tweet_id'] for idx in range(n_tweets)]
+    candidates += [[synthetic_document(rng, rng.randint(8, 14)), 2000 + idx // 8, 'corpus_id'] for idx in range(n_paper_chunks)]
+    candidates += [[synthetic_document(rng, rng.randint(2, 10)), f'https://example.org/{idx // 4}', 'web_link'] for idx in range(n_web_chunks)]
+    for _ in range(int(len(candidates) * duplicate_rate)):
+        candidates.append(list(rng.choice(candidates)))
+    rng.shuffle(candidates)
+    return candidates
+
+
+def synthetic_abstracts(n, seed=41, first_corpus_id=2000):
+    """Returns n (corpus id, abstract) tuples."""
+    rng = random.Random(seed)
+    return [(first_corpus_id + idx, synthetic_document(rng, rng.randint(3, 8))) for idx in range(n)]
+
+
+def synthetic_page(rng, n_paragraphs=6):
+    paragraphs = "".join(f"<p>{synthetic_document(rng, rng.randint(3, 8))}</p>" for _ in range(n_paragraphs))
+    return f"<html><head><title>Airline operations</title></head><body><h1>Improving airline operations</h1>{paragraphs}</body></html>"
+
+
+def synthetic_tei(rng, n_paragraphs=12):
+    """Returns a GROBID TEI document with an abstract and a body."""
+    abstract = synthetic_document(rng, 5)
+    paragraphs = "".join(f"<p>{synthetic_document(rng, rng.randint(4, 10))}</p>" for _ in range(n_paragraphs))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><fileDesc><titleStmt><title level="a" type="main">Airline operations</title></titleStmt></fileDesc>'
+        '<encodingDesc><appInfo><application version="0.8.0" ident="GROBID" when="2024-01-01T00:00+0000"><label>GROBID</label></application></appInfo></encodingDesc>'
+        f'<profileDesc><abstract><div><p>{abstract}</p></div></abstract></profileDesc></teiHeader>'
+        f'<text><body><div><head>Findings</head>{paragraphs}</div></body></text></TEI>'
+    )
+
+
+def write_jsonl(path, records, columns):
+    """Writes records (tuples in the order of columns) as a jsonl resource file for vector_db.create_db_collection."""
+    import json
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(dict(zip(columns, record))) + "\n")
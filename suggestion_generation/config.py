@@ -6,12 +6,65 @@ config_params={
 
     'limit_results_retrieve': 10,
     'limit_results_rerank': 10,
+    'split_overlap_tokens': 0, #tokens shared by consecutive chunks of retrieved papers and websites
+
+    'streaming_micro_batch_size': 200,
+
+    'retrieval_max_workers': 12,
+    'retrieval_timeout_tweets': 30,
+    'retrieval_timeout_abstracts': 30, #abstracts without their papers' full texts (adaptive retrieval)
+    'retrieval_timeout_papers': 180,
+    'retrieval_timeout_web': 90,
+    'adaptive_retrieval': False, #rerank the tweets and abstracts first and load paper full texts, then websites, only while too few results are relevant
+    'adaptive_retrieval_min_score': 0.0, #cross-encoder score from which a reranked result counts as relevant
+    'adaptive_retrieval_min_results': None, #relevant reranked results that end the escalation, None: limit_results_rerank
+
+    'clustering_backend': 'exact', #'community_detection' (sentence-transformers, dense n x n), 'exact' or 'faiss'
+    'clustering_max_neighbours': 100,
+    'incremental_clustering': False, #assign weaknesses to the clusters (and suggestions) stored by previous runs
+    'cluster_collection': 'cluster_collection',
 
     'search_embedding_model': 'all-MiniLM-L6-v2',
     'cluster_embedding_model': 'all-mpnet-base-v2',
     'cross_encoder_model': 'ms-marco-MiniLM-L-6-v2',
     'generative_model': 'gpt-4-0125-preview',
+
+    'batch_max_requests': 50000, #requests per batch input file (OpenAI limit: 50,000)
+    'batch_max_file_mb': 200, #size of a batch input file (OpenAI limit: 200 MB)
+    'weakness_pack_size': 1, #tweets per weakness identification request, 1 sends one request per tweet
+    'weakness_pack_max_tokens': 2000, #estimated tokens of the tweets in one packed request
+    'feedback_dedup_threshold': None, #e.g. 0.8: near-duplicate feedback (estimated Jaccard similarity of the text without links and handles) shares one weakness identification, None identifies every feedback
+
+    #'cpu', 'cuda' (or e.g. 'cuda:1') or 'auto' (cuda if available)
+    'search_embedding_device': 'auto',
+    'cluster_embedding_device': 'auto',
+    'cross_encoder_device': 'auto',
+
+    'cross_encoder_fp16': False, #only on GPU
+    #models on the cpu: 'fp32', 'int8' (dynamic int8 quantization), 'onnx' or 'onnx_int8' (ONNX Runtime, requires optimum[onnxruntime])
+    'cpu_backend': 'fp32',
+    'cpu_threads': None, #intra-op threads of torch / ONNX Runtime, None uses all cores
+    'cpu_onnx_int8_file_name': 'onnx/model_qint8_avx512_vnni.onnx', #quantized ONNX file of the model repositories used by 'onnx_int8'
+    'rerank_batch_size': 32,
+    'rerank_prefilter_limit': 0, #if > 0, only the most similar candidates according to the search embedder are cross-encoded
+    'rerank_cache_size': 100000,
+    'query_cache_enabled': False, #reuse the reranked context and suggestion of earlier, near-identical search queries
+    'query_cache_collection': 'query_cache_collection',
+    'query_cache_threshold': 0.95, #cosine similarity of the search embeddings
+    'query_cache_ttl': 604800, #seconds, None never expires
+
+    'embedding_cache_enabled': False, #store the bi-encoder embeddings of texts under embedding_cache_path, one file per model
+    'embedding_cache_path': 'cache/embeddings',
+    'embedding_cache_max_entries': 2000000,
     
+    'llm_max_concurrency': 16,
+    'llm_requests_per_minute': 500,
+    'llm_tokens_per_minute': 300000,
+    'llm_max_retries': 6,
+    'llm_cache_enabled': False, #answer repeated requests (temperature 0) from llm_cache_path instead of the API
+    'llm_cache_path': 'cache/llm_completions.sqlite',
+    'llm_cache_max_size_mb': 1024,
+
     'openai_api_key': '',
     'scholar_x_api_key': '',
     'GOOGLE_CSE_ID': '',
@@ -19,6 +72,27 @@ config_params={
 
     'qdrant_host': "localhost",
     'qdrant_grpc_port': 6334,
+    #settings of the tweet and abstract collections (see vector_db.DEFAULT_COLLECTION_PROFILE), compare them with benchmarks.qdrant_profile_benchmark
+    'collection_profile': 'default',
+    'collection_profiles': {
+        'default': {}, #float32 vectors on disk, default HNSW
+        'ram': {'on_disk': False},
+        'scalar': {'quantization': 'scalar', 'oversampling': 2.0}, #int8 vectors in RAM, candidates rescored with the vectors on disk
+        'binary': {'quantization': 'binary', 'oversampling': 3.0}, #1-bit vectors in RAM, best for larger dimensions
+        'scalar_high_recall': {'quantization': 'scalar', 'oversampling': 3.0, 'hnsw_m': 32, 'hnsw_ef_construct': 200, 'hnsw_ef': 256},
+        'scalar_low_memory': {'quantization': 'scalar', 'oversampling': 2.0, 'hnsw_on_disk': True},
+    },
 
+    'semantic_scholar_url': 'https://api.semanticscholar.org',
     'GROBID_URL': 'http://localhost:8070',
+    'paper_cache_path': 'cache/papers.sqlite',
+    'paper_unavailable_ttl': 604800, #seconds until papers found unavailable are requested again, None never
+    'paper_max_workers': 8,
+    'robots_cache_ttl': 86400,
+    'robots_failure_ttl': 300, #seconds a host whose robots.txt could not be loaded is skipped, not persisted
+    'robots_cache_path': 'cache/robots.sqlite',
+
+    'metrics_enabled': False,
+    'metrics_path': 'metrics/run_metrics.json',
+    'metrics_prometheus_path': None, #e.g. 'metrics/run_metrics.prom'
 }
\ No newline at end of file
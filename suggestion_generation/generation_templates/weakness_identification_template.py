@@ -2,7 +2,7 @@ import json
 import pandas as pd
 from processing_utils import resource_preprocessing
 from pydantic import Field, BaseModel
-from typing import List
+from typing import Dict, List
 
 
 def get_user_prompt_template():
@@ -29,10 +29,7 @@ JSON Schema:
     return system_prompt
 
 
-def get_system_few_shot_prompts():
-
-    user_prompt_template = get_user_prompt_template()
-    system_prompt = get_system_prompt()
+def get_few_shot_examples():
 
     few_shot_feedback = [
         '''First, I was rebooked on a different flight and now I received my suitcase completely damaged.''',
@@ -51,6 +48,16 @@ def get_system_few_shot_prompts():
         {"process_weaknesses": []}
     ]
 
+    return few_shot_feedback, few_shot_weaknesses
+
+
+def get_system_few_shot_prompts():
+
+    user_prompt_template = get_user_prompt_template()
+    system_prompt = get_system_prompt()
+
+    few_shot_feedback, few_shot_weaknesses = get_few_shot_examples()
+
     few_shot_user_prompts = [user_prompt_template.format(prompt_feedback = feedback_i) for feedback_i in few_shot_feedback]
     few_shot_assistant_prompts = [json.dumps(weakness_i) for weakness_i in few_shot_weaknesses]
 
@@ -61,3 +68,54 @@ def get_system_few_shot_prompts():
             system_few_shot_prompts.append({"role": "assistant", "content": few_shot_assistant_prompt_i})
 
     return system_few_shot_prompts
+
+
+#Packed prompts: several Tweets per request, keyed by their feedback_id
+
+def format_packed_feedback(feedback_ids, feedback_texts):
+    return json.dumps({str(feedback_id): feedback_text for feedback_id, feedback_text in zip(feedback_ids, feedback_texts)}, ensure_ascii=False, indent=1)
+
+
+def get_packed_user_prompt_template():
+    user_prompt_template = '''Identify each process weakness mentioned in each of the following Tweets. The Tweets are given as a JSON object that maps the id of each Tweet to its text. Answer for every id.
+    
+Tweets:
+{prompt_feedback}'''
+    
+    return user_prompt_template
+
+
+def get_packed_system_prompt():
+    class Packed_Process_Weakness_Identification(BaseModel):
+        process_weaknesses: Dict[str, List[str]] = Field(description="For the id of each Tweet, a list of all the process weaknesses mentioned in the Tweet")
+    main_model_schema = Packed_Process_Weakness_Identification.model_json_schema()
+    json_schema_weaknesses = json.dumps(main_model_schema)
+
+    system_prompt_template = '''As an assistant dedicated to supporting airline operations, your task is to identify process weaknesses mentioned in Tweets. You are given several Tweets at once and answer for each of them separately. You do not make up any process weaknesses. Your answer must adhere to the following JSON Schema.
+
+JSON Schema:
+{json_schema_weaknesses}'''
+
+    system_prompt = system_prompt_template.format(json_schema_weaknesses = json_schema_weaknesses)
+
+    return system_prompt
+
+
+def get_packed_system_few_shot_prompts():
+
+    user_prompt_template = get_packed_user_prompt_template()
+    system_prompt = get_packed_system_prompt()
+
+    #the few-shot examples of the single-Tweet prompts as one packed example
+    few_shot_feedback, few_shot_weaknesses = get_few_shot_examples()
+    few_shot_ids = [str(idx) for idx in range(1, len(few_shot_feedback)+1)]
+
+    few_shot_user_prompt = user_prompt_template.format(prompt_feedback = format_packed_feedback(few_shot_ids, few_shot_feedback))
+    few_shot_assistant_prompt = json.dumps({"process_weaknesses": {id_i: weakness_i["process_weaknesses"] for id_i, weakness_i in zip(few_shot_ids, few_shot_weaknesses)}})
+
+    system_few_shot_prompts=[]
+    system_few_shot_prompts.append({"role": "system", "content": system_prompt})
+    system_few_shot_prompts.append({"role": "user", "content": few_shot_user_prompt})
+    system_few_shot_prompts.append({"role": "assistant", "content": few_shot_assistant_prompt})
+
+    return system_few_shot_prompts
@@ -0,0 +1,157 @@
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHAT_COMPLETIONS_URL = '/v1/chat/completions'
+#limits of one OpenAI batch input file
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 200 * 1024**2
+
+
+class MissingResult(Exception):
+    """Stands in for the response of a batch request without a successful result."""
+
+
+def request_line(custom_id, body, url=CHAT_COMPLETIONS_URL):
+    """One line of an OpenAI batch input file."""
+    return {'custom_id': custom_id, 'method': 'POST', 'url': url, 'body': body}
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip() != '']
+
+
+def write_jsonl(path, lines):
+    if os.path.dirname(path) != '':
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + '\n')
+    os.replace(path + '.tmp', path)
+
+
+def shard_path(path, shard_idx):
+    #requests.jsonl -> requests-00000.jsonl
+    root, extension = os.path.splitext(path)
+    return f'{root}-{shard_idx:05d}{extension or ".jsonl"}'
+
+
+def write_jsonl_shards(path, lines, max_lines=MAX_REQUESTS_PER_FILE, max_bytes=MAX_BYTES_PER_FILE):
+    """Writes lines to numbered files next to path (see shard_path) of at most max_lines lines and max_bytes bytes each.
+
+    Returns the paths of the files, none if there are no lines. A single line larger than max_bytes gets a file of its own.
+    """
+    shards = [[]]
+    shard_bytes = 0
+    for line in lines:
+        line_bytes = len(json.dumps(line, ensure_ascii=False).encode('utf-8')) + 1
+        if shards[-1] != [] and (len(shards[-1]) >= max_lines or shard_bytes + line_bytes > max_bytes):
+            shards.append([])
+            shard_bytes = 0
+        shards[-1].append(line)
+        shard_bytes += line_bytes
+
+    paths = []
+    for shard_idx, shard_lines in enumerate(shard for shard in shards if shard != []):
+        paths.append(shard_path(path, shard_idx))
+        write_jsonl(paths[-1], shard_lines)
+    return paths
+
+
+def _result_content(result_line):
+    #the completion of a successful line, None for failed lines (error files, non-200 responses, empty bodies)
+    response = result_line.get('response')
+    if result_line.get('error') is not None or response is None or response.get('status_code') != 200:
+        return None
+    try:
+        return response['body']['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def _result_error(result_line):
+    if result_line.get('error') is not None:
+        return result_line['error'].get('message', str(result_line['error']))
+    response = result_line.get('response') or {}
+    error = (response.get('body') or {}).get('error')
+    if error is not None:
+        return error.get('message', str(error))
+    return f"status code {response.get('status_code')}"
+
+
+def read_results(result_paths):
+    """Reads batch output and error files (in any order, e.g., of the original job and of resubmissions).
+
+    Returns the completion content per custom_id and the last error of every custom_id without a successful result.
+    A successful result is never replaced by a failed one.
+    """
+    contents = {}
+    errors = {}
+    for result_path in result_paths:
+        for result_line in read_jsonl(result_path):
+            custom_id = result_line.get('custom_id')
+            content = _result_content(result_line)
+            if content is not None:
+                contents[custom_id] = content
+                errors.pop(custom_id, None)
+            elif custom_id not in contents:
+                errors[custom_id] = _result_error(result_line)
+    return contents, errors
+
+
+class LocalBatchRunner:
+    """File-based stand-in for the OpenAI batch API: answers a batch input file with a chat completions client.
+
+    Successful lines go to output_path, failed lines to error_path, both in the format of the batch API.
+    failure_rate makes a share of the lines fail without sending them, to exercise partial results and resubmission.
+    """
+
+    def __init__(self, client, max_concurrency=8, failure_rate=0.0, seed=41):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _answer(self, idx, request):
+        result_line = {'id': f'batch_req_{idx}', 'custom_id': request['custom_id'], 'response': None, 'error': None}
+        with self._lock:
+            fail = self._rng.random() < self.failure_rate
+        if fail:
+            result_line['response'] = {'status_code': 500, 'request_id': f'req_{idx}', 'body': {'error': {'message': 'simulated failure', 'type': 'server_error'}}}
+            return result_line
+        try:
+            response = self.client.chat.completions.create(**request['body'])
+        except Exception as error:
+            result_line['error'] = {'code': type(error).__name__, 'message': str(error)}
+            return result_line
+
+        usage = getattr(response, 'usage', None)
+        result_line['response'] = {
+            'status_code': 200,
+            'request_id': f'req_{idx}',
+            'body': {
+                'object': 'chat.completion',
+                'model': request['body'].get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': response.choices[0].message.content}, 'finish_reason': getattr(response.choices[0], 'finish_reason', 'stop')}],
+                'usage': {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens, 'total_tokens': usage.total_tokens} if usage is not None else None,
+            },
+        }
+        return result_line
+
+    def run(self, input_path, output_path, error_path=None):
+        """Processes input_path and returns the number of successful and failed lines."""
+        requests = read_jsonl(input_path)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="batch") as pool:
+            result_lines = list(pool.map(lambda item: self._answer(*item), enumerate(requests)))
+
+        succeeded = [result_line for result_line in result_lines if _result_content(result_line) is not None]
+        failed = [result_line for result_line in result_lines if _result_content(result_line) is None]
+        write_jsonl(output_path, succeeded)
+        if error_path is not None:
+            write_jsonl(error_path, failed)
+        return len(succeeded), len(failed)
@@ -0,0 +1,87 @@
+import numpy as np
+from processing_utils import metrics
+
+
+def ensure_cluster_collection(qdrantdb_client, collection_name, dimension):
+    from qdrant_client import models
+
+    #cluster centroids are few and searched for every new weakness, so they are kept in RAM
+    if not qdrantdb_client.collection_exists(collection_name):
+        qdrantdb_client.create_collection(
+            collection_name=collection_name,
+            vectors_config=models.VectorParams(size=dimension, distance=models.Distance.COSINE, on_disk=False),
+        )
+
+
+def next_cluster_id(qdrantdb_client, collection_name):
+    #clusters whose generation failed are not stored, so the next id is derived from the largest stored id
+    next_id = 0
+    offset = None
+    while True:
+        points, offset = qdrantdb_client.scroll(collection_name=collection_name, limit=10000, offset=offset, with_payload=False, with_vectors=False)
+        for point in points:
+            next_id = max(next_id, int(point.id) + 1)
+        if offset is None:
+            return next_id
+
+
+def assign_to_clusters(qdrantdb_client, collection_name, embeddings, threshold, search_batch_size=64):
+    """Assigns every embedding to its most similar stored cluster with a cosine similarity >= threshold.
+
+    Returns the cluster id per embedding (-1 if no stored cluster is similar enough) and the stored clusters that
+    received weaknesses as {cluster id: {'centroid', 'payload'}}.
+    """
+    cluster_ids = np.full(len(embeddings), -1, dtype=np.int64)
+    if len(embeddings) == 0:
+        return cluster_ids, {}
+
+    from qdrant_client import models
+    search_requests = [models.SearchRequest(vector=vector.tolist(), limit=1, score_threshold=threshold) for vector in embeddings]
+    for batch_i in range(0, len(search_requests), search_batch_size):
+        with metrics.timer('external_call_seconds', service='qdrant_search_batch'):
+            search_results = qdrantdb_client.search_batch(collection_name=collection_name, requests=search_requests[batch_i:batch_i+search_batch_size])
+        for idx, search_result in enumerate(search_results):
+            if search_result != []:
+                cluster_ids[batch_i+idx] = int(search_result[0].id)
+
+    assigned_ids = sorted(set(cluster_ids.tolist()) - {-1})
+    stored_clusters = {}
+    if assigned_ids != []:
+        for point in qdrantdb_client.retrieve(collection_name=collection_name, ids=assigned_ids, with_payload=True, with_vectors=True):
+            stored_clusters[int(point.id)] = {'centroid': np.asarray(point.vector, dtype=np.float32), 'payload': point.payload}
+    return cluster_ids, stored_clusters
+
+
+def stored_member_sum(stored_cluster):
+    #clusters stored before the member sum was kept only have their normalized centroid, the best available estimate
+    if 'member_sum' in stored_cluster['payload']:
+        return np.asarray(stored_cluster['payload']['member_sum'], dtype=np.float64)
+    return stored_cluster['centroid'].astype(np.float64) * stored_cluster['payload']['size']
+
+
+def update_centroid(member_sum, new_embeddings):
+    """Adds the new member embeddings to a cluster's unnormalized member sum.
+
+    Returns the new sum, which is stored in the payload, and the normalized centroid (the direction of the members'
+    mean), which is the searched vector.
+    """
+    member_sum = np.asarray(member_sum, dtype=np.float64) + np.sum(new_embeddings, axis=0, dtype=np.float64)
+    return member_sum, (member_sum / max(np.linalg.norm(member_sum), 1e-12)).astype(np.float32)
+
+
+def save_clusters(qdrantdb_client, collection_name, clusters):
+    """Upserts clusters given as dicts with 'cluster', 'centroid' and the payload fields 'size', 'member_sum', 'search_query', 'suggestions' and 'reranked'."""
+    if clusters == []:
+        return
+    from qdrant_client import models
+    qdrantdb_client.upsert(
+        collection_name=collection_name,
+        points=[
+            models.PointStruct(
+                id=int(cluster_i['cluster']),
+                vector=np.asarray(cluster_i['centroid'], dtype=np.float32).tolist(),
+                payload={'size': int(cluster_i['size']), 'member_sum': np.asarray(cluster_i['member_sum'], dtype=np.float64).tolist(), 'search_query': cluster_i['search_query'], 'suggestions': cluster_i['suggestions'], 'reranked': cluster_i['reranked']},
+            )
+            for cluster_i in clusters
+        ],
+    )
@@ -0,0 +1,118 @@
+import numpy as np
+
+
+def normalize_embeddings(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def _top_k_per_row(rows, columns, sims, k):
+    #keeps the k most similar (row, column) pairs of every row
+    order = np.lexsort((-sims, rows))
+    rows, columns, sims = rows[order], columns[order], sims[order]
+    row_starts = np.searchsorted(rows, rows, side='left')
+    keep = (np.arange(len(rows)) - row_starts) < k
+    return rows[keep], columns[keep], sims[keep]
+
+
+def exact_neighbours(embeddings, k, threshold, row_block_size=1024, column_block_size=32768):
+    """Exact top-k cosine neighbours above threshold of every embedding, plus the number of all neighbours above threshold.
+
+    The similarity matrix is computed in row_block_size x column_block_size tiles, so memory stays bounded independent
+    of the corpus size. Missing neighbours are padded with index -1 and similarity -inf.
+    """
+    n = len(embeddings)
+    neighbour_idxs = np.full((n, k), -1, dtype=np.int64)
+    neighbour_sims = np.full((n, k), -np.inf, dtype=np.float32)
+    counts = np.zeros(n, dtype=np.int64)
+
+    for row_start in range(0, n, row_block_size):
+        rows = embeddings[row_start:row_start+row_block_size]
+        pair_rows, pair_columns, pair_sims = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.float32)]
+        n_pairs = 0
+
+        for column_start in range(0, n, column_block_size):
+            sims = rows @ embeddings[column_start:column_start+column_block_size].T
+            tile_rows, tile_columns = np.nonzero(sims >= threshold)
+            counts[row_start:row_start+len(rows)] += np.bincount(tile_rows, minlength=len(rows))
+            pair_rows.append(tile_rows)
+            pair_columns.append(tile_columns + column_start)
+            pair_sims.append(sims[tile_rows, tile_columns])
+            n_pairs += len(tile_rows)
+
+            #dense blocks are trimmed to the top-k per row as they grow
+            if n_pairs > 4 * k * len(rows):
+                trimmed = _top_k_per_row(np.concatenate(pair_rows), np.concatenate(pair_columns), np.concatenate(pair_sims), k)
+                pair_rows, pair_columns, pair_sims = [trimmed[0]], [trimmed[1]], [trimmed[2]]
+                n_pairs = len(trimmed[0])
+
+        block_rows, block_columns, block_sims = _top_k_per_row(np.concatenate(pair_rows), np.concatenate(pair_columns), np.concatenate(pair_sims), k)
+        ranks = np.arange(len(block_rows)) - np.searchsorted(block_rows, block_rows, side='left')
+        neighbour_idxs[row_start + block_rows, ranks] = block_columns
+        neighbour_sims[row_start + block_rows, ranks] = block_sims
+
+    return neighbour_idxs, neighbour_sims, counts
+
+
+def faiss_neighbours(embeddings, k, threshold, hnsw_m=32, ef_search=None):
+    """Approximate top-k cosine neighbours from a CPU HNSW index (requires faiss-cpu). Counts are capped at k."""
+    import faiss
+
+    index = faiss.IndexHNSWFlat(embeddings.shape[1], hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efSearch = max(ef_search or 2 * k, k)
+    index.add(embeddings)
+    neighbour_sims, neighbour_idxs = index.search(embeddings, k)
+
+    #faiss pads missing neighbours with -1
+    neighbour_sims[neighbour_idxs < 0] = -np.inf
+    counts = (neighbour_sims >= threshold).sum(axis=1)
+    return neighbour_idxs.astype(np.int64), neighbour_sims, counts
+
+
+def community_detection(embeddings, threshold=0.75, min_community_size=10, max_neighbours=100, backend='exact', row_block_size=1024, column_block_size=32768):
+    """Threshold-based community detection with the semantics of sentence_transformers.util.community_detection.
+
+    Every embedding with at least min_community_size neighbours (itself included) with a cosine similarity >= threshold
+    is the center of a candidate community. Candidates are taken greedily from the largest to the smallest, members that
+    already belong to a community are removed, and a candidate is kept if it still has min_community_size members.
+    The communities are returned as lists of indexes, sorted by size.
+
+    Instead of the dense n x n similarity matrix, only the top max_neighbours neighbours of each embedding are kept.
+    The full similarity row is only computed for centers with more neighbours above the threshold than that.
+    backend is 'exact' (tiled brute force, exact community sizes) or 'faiss' (approximate HNSW neighbours).
+    """
+    embeddings = normalize_embeddings(embeddings)
+    n = len(embeddings)
+    if n == 0:
+        return []
+    k = min(max(max_neighbours, min_community_size), n)
+
+    if backend == 'exact':
+        neighbour_idxs, neighbour_sims, counts = exact_neighbours(embeddings, k, threshold, row_block_size, column_block_size)
+    elif backend == 'faiss':
+        neighbour_idxs, neighbour_sims, counts = faiss_neighbours(embeddings, k, threshold)
+    else:
+        raise ValueError(f'Unknown clustering backend: {backend}')
+
+    extracted = np.zeros(n, dtype=bool)
+    communities = []
+
+    for center in np.argsort(-counts, kind='stable'):
+        if counts[center] < min_community_size:
+            break
+
+        if counts[center] >= k and neighbour_sims[center, -1] >= threshold:
+            #the neighbour list is truncated, so the members are taken from the full similarity row
+            sims = np.concatenate([embeddings[start:start+column_block_size] @ embeddings[center] for start in range(0, n, column_block_size)])
+            members = np.flatnonzero((sims >= threshold) & ~extracted)
+        else:
+            members = neighbour_idxs[center][neighbour_sims[center] >= threshold]
+            members = members[~extracted[members]]
+
+        if len(members) >= min_community_size:
+            extracted[members] = True
+            communities.append(members.tolist())
+
+    communities = sorted(communities, key=lambda community: len(community), reverse=True)
+    return communities
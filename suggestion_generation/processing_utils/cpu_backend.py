@@ -0,0 +1,70 @@
+#backends of the models that run on the cpu:
+#'fp32' (unchanged model), 'int8' (dynamic int8 quantization of the linear layers),
+#'onnx' and 'onnx_int8' (ONNX Runtime through sentence-transformers, requires optimum[onnxruntime])
+CPU_BACKENDS = ('fp32', 'int8', 'onnx', 'onnx_int8')
+
+
+def _check_backend(backend):
+    if backend not in CPU_BACKENDS:
+        raise ValueError(f"Unknown cpu backend {backend}, use one of {', '.join(CPU_BACKENDS)}")
+
+
+def set_num_threads(num_threads):
+    """Sets the number of intra-op threads of torch; None keeps the default of one thread per core."""
+    if num_threads is not None:
+        import torch
+        torch.set_num_threads(num_threads)
+
+
+def quantize_dynamic(model):
+    """Replaces the linear layers of a torch model by dynamically quantized int8 layers, in place.
+
+    Weights are stored in int8 and activations are quantized per batch, which speeds up the matrix multiplications
+    that dominate transformer inference on cpus with AVX2/AVX-512 VNNI.
+    """
+    import torch
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _onnx_model_kwargs(backend, num_threads, onnx_int8_file_name):
+    import onnxruntime
+    session_options = onnxruntime.SessionOptions()
+    if num_threads is not None:
+        session_options.intra_op_num_threads = num_threads
+    model_kwargs = {'provider': 'CPUExecutionProvider', 'session_options': session_options}
+    if backend == 'onnx_int8':
+        model_kwargs['file_name'] = onnx_int8_file_name
+    return model_kwargs
+
+
+def load_sentence_transformer(model_name, backend='fp32', num_threads=None, onnx_int8_file_name=None):
+    """Loads a SentenceTransformer on the cpu with the given backend."""
+    from sentence_transformers import SentenceTransformer
+    _check_backend(backend)
+    set_num_threads(num_threads)
+    if backend in ('onnx', 'onnx_int8'):
+        return SentenceTransformer(model_name, device='cpu', backend='onnx', model_kwargs=_onnx_model_kwargs(backend, num_threads, onnx_int8_file_name))
+
+    embedder = SentenceTransformer(model_name, device='cpu')
+    if backend == 'int8':
+        quantize_dynamic(embedder)
+    return embedder
+
+
+def load_cross_encoder(model_name, backend='fp32', num_threads=None, onnx_int8_file_name=None):
+    """Loads a CrossEncoder on the cpu with the given backend."""
+    from sentence_transformers.cross_encoder import CrossEncoder
+    _check_backend(backend)
+    set_num_threads(num_threads)
+    if backend in ('onnx', 'onnx_int8'):
+        return CrossEncoder(model_name, device='cpu', backend='onnx', model_kwargs=_onnx_model_kwargs(backend, num_threads, onnx_int8_file_name))
+
+    cross_encoder = CrossEncoder(model_name, device='cpu')
+    if backend == 'int8':
+        quantize_dynamic(cross_encoder.model)
+    return cross_encoder
+
+
+def cache_name(model_name, backend):
+    #quantized models produce slightly different embeddings, so they get their own embedding cache
+    return model_name if backend == 'fp32' else f'{model_name}-{backend}'
@@ -0,0 +1,99 @@
+import numpy as np
+import re
+
+
+def normalize_text(text):
+    #case, punctuation, whitespace and a leading retweet marker do not distinguish copies of a tweet
+    text = re.sub(r'[^\w\s]', ' ', text.lower())
+    text = re.sub(r'^\s*rt\b', ' ', text)
+    return ' '.join(text.split())
+
+
+def shingle_hashes(texts, k=5):
+    """64-bit FNV-1a hashes of the byte k-grams of the normalized texts, concatenated, and the offset of every text's first k-gram.
+
+    Texts shorter than k bytes are padded to one k-gram. k-grams repeated within a text are kept, they do not change
+    its MinHash.
+    """
+    encoded = [normalize_text(text).encode('utf-8').ljust(k, b'\0') for text in texts]
+    lengths = np.array([len(encoded_i) for encoded_i in encoded], dtype=np.int64)
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+
+    n_grams = lengths - k + 1
+    offsets = np.cumsum(n_grams) - n_grams
+    positions = np.repeat(np.cumsum(lengths) - lengths - offsets, n_grams) + np.arange(n_grams.sum())
+
+    hashes = np.full(len(positions), 14695981039346656037, dtype=np.uint64)
+    for j in range(k):
+        hashes ^= data[positions + j]
+        hashes *= np.uint64(1099511628211)
+    return hashes, offsets
+
+
+def minhash_signatures(texts, num_perm=128, k=5, seed=41, chunk_size=256):
+    """MinHash signatures (len(texts) x num_perm) of the byte k-gram sets of the normalized texts.
+
+    Texts are processed chunk_size at a time with a few vectorized operations per chunk; small chunks keep the
+    permuted k-grams in the CPU cache.
+    """
+    #multiply-shift hashing: (a*x + b) mod 2^64 (numpy wraps around), upper 32 bits, with odd a
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 2**63, size=num_perm, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.randint(0, 2**63, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for start in range(0, len(texts), chunk_size):
+        hashes, offsets = shingle_hashes(texts[start:start+chunk_size], k)
+        permuted = a[:, None] * hashes[None, :]
+        permuted += b[:, None]
+        permuted >>= np.uint64(32)
+        signatures[start:start+chunk_size] = np.minimum.reduceat(permuted, offsets, axis=1).T
+    return signatures
+
+
+def lsh_bands(num_perm, threshold):
+    """Number of bands and rows per band whose LSH threshold (1/bands)^(1/rows) is the highest one not above threshold."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        lsh_threshold = (1 / bands) ** (1 / rows)
+        if lsh_threshold <= threshold and (best is None or lsh_threshold > best[0]):
+            best = (lsh_threshold, bands, rows)
+    return (best[1], best[2]) if best is not None else (num_perm, 1)
+
+
+def _find(parents, idx):
+    while parents[idx] != idx:
+        parents[idx] = parents[parents[idx]]
+        idx = parents[idx]
+    return idx
+
+
+def near_duplicate_groups(texts, threshold=0.8, num_perm=128, k=5, seed=41):
+    """Groups texts whose estimated Jaccard similarity of byte k-grams (see normalize_text) is at least threshold.
+
+    Returns, for every text, the index of its group's representative (the group's first text), so texts without
+    near duplicates are their own representative. Candidate pairs come from locality-sensitive hashing of the
+    MinHash signatures; every candidate is verified against its bucket's first text before groups are merged.
+    """
+    n = len(texts)
+    parents = np.arange(n)
+    if n < 2:
+        return parents
+
+    signatures = minhash_signatures(texts, num_perm, k, seed)
+    bands, rows = lsh_bands(num_perm, threshold)
+    for band in range(bands):
+        band_signatures = np.ascontiguousarray(signatures[:, band*rows:(band+1)*rows])
+        _, bucket_first, buckets = np.unique(band_signatures.view(np.dtype((np.void, band_signatures.dtype.itemsize * rows))).ravel(), return_index=True, return_inverse=True)
+        leaders = bucket_first[buckets.ravel()]
+        candidates = np.flatnonzero(leaders != np.arange(n))
+        if len(candidates) == 0:
+            continue
+        similarities = (signatures[candidates] == signatures[leaders[candidates]]).mean(axis=1)
+        for idx, leader in zip(candidates[similarities >= threshold], leaders[candidates[similarities >= threshold]]):
+            root_idx, root_leader = _find(parents, idx), _find(parents, leader)
+            if root_idx != root_leader:
+                parents[max(root_idx, root_leader)] = min(root_idx, root_leader)
+
+    return np.array([_find(parents, idx) for idx in range(n)])
@@ -0,0 +1,166 @@
+import hashlib
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+from processing_utils import metrics
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent embedding store of one model, keyed by text hash.
+
+    Embeddings are kept in a memory-mapped float16 matrix of max_entries rows; a SQLite index maps text hashes to rows.
+    When the matrix is full, the least recently used rows are reused.
+    """
+
+    def __init__(self, path, model_name, dimension, max_entries=1000000):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        file_prefix = os.path.join(path, model_name.replace('/', '__'))
+        matrix_path = file_prefix + '.f16'
+
+        self._connection = sqlite3.connect(file_prefix + '.index.sqlite', check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, row INTEGER UNIQUE, last_access REAL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        stored_dimension = self._connection.execute("SELECT value FROM meta WHERE name = 'dimension'").fetchone()
+        if stored_dimension is not None and int(stored_dimension[0]) != dimension:
+            #a different model was stored under the same name; its embeddings are useless
+            self._connection.execute("DELETE FROM entries")
+        self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('dimension', ?)", (str(dimension),))
+        #rows beyond a reduced max_entries are dropped
+        self._connection.execute("DELETE FROM entries WHERE row >= ?", (max_entries,))
+        self._connection.commit()
+
+        #create or resize the matrix file to max_entries rows
+        with open(matrix_path, 'ab') as f:
+            f.truncate(max_entries * dimension * np.dtype(np.float16).itemsize)
+        self.matrix = np.memmap(matrix_path, dtype=np.float16, mode='r+', shape=(max_entries, dimension))
+
+        used_rows = set(row for (row,) in self._connection.execute("SELECT row FROM entries"))
+        self._next_row = max(used_rows) + 1 if used_rows else 0
+        self._free_rows = [row for row in range(self._next_row) if row not in used_rows]
+
+    def _lookup(self, keys):
+        rows = {}
+        for batch_i in range(0, len(keys), 900):
+            batch_keys = keys[batch_i:batch_i+900]
+            query = "SELECT key, row FROM entries WHERE key IN (%s)" % ",".join("?" * len(batch_keys))
+            rows.update(self._connection.execute(query, batch_keys).fetchall())
+        return rows
+
+    def _allocate_rows(self, n):
+        rows = []
+        while len(rows) < n and self._free_rows:
+            rows.append(self._free_rows.pop())
+        while len(rows) < n and self._next_row < self.max_entries:
+            rows.append(self._next_row)
+            self._next_row += 1
+        if len(rows) < n:
+            #evict the least recently used entries
+            evicted = self._connection.execute("SELECT key, row FROM entries ORDER BY last_access LIMIT ?", (n - len(rows),)).fetchall()
+            self._connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+            rows.extend(row for _, row in evicted)
+            self.evictions += len(evicted)
+        return rows
+
+    def encode(self, embedder, texts, **encode_kwargs):
+        """Returns float32 embeddings for texts. Cached texts are read from the store; the misses are encoded in one batch."""
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if len(texts) == 0:
+            return embeddings
+
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            cached_rows = self._lookup(unique_keys)
+            now = time.time()
+            self._connection.executemany("UPDATE entries SET last_access = ? WHERE key = ?", [(now, key) for key in cached_rows])
+            for idx, key in enumerate(keys):
+                if key in cached_rows:
+                    embeddings[idx] = self.matrix[cached_rows[key]]
+            n_hits = sum(1 for key in keys if key in cached_rows)
+            self.hits += n_hits
+            self.misses += len(keys) - n_hits
+            metrics.cache_access('embeddings', True, n_hits)
+            metrics.cache_access('embeddings', False, len(keys) - n_hits)
+            self._connection.commit()
+
+        missing_keys = [key for key in unique_keys if key not in cached_rows]
+        if missing_keys == []:
+            return embeddings
+
+        key_texts = dict(zip(keys, texts))
+        encoded = np.asarray(embedder.encode([key_texts[key] for key in missing_keys], convert_to_numpy=True, **encode_kwargs), dtype=np.float32)
+        encoded_by_key = dict(zip(missing_keys, encoded))
+        for idx, key in enumerate(keys):
+            if key in encoded_by_key:
+                embeddings[idx] = encoded_by_key[key]
+
+        with self._lock:
+            #another thread may have stored some of the keys meanwhile
+            stored_rows = self._lookup(missing_keys)
+            missing_keys = [key for key in missing_keys if key not in stored_rows]
+            if len(missing_keys) > self.max_entries:
+                missing_keys = missing_keys[:self.max_entries]
+            rows = self._allocate_rows(len(missing_keys))
+            for key, row in zip(missing_keys, rows):
+                self.matrix[row] = encoded_by_key[key].astype(np.float16)
+            now = time.time()
+            self._connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", [(key, row, now) for key, row in zip(missing_keys, rows)])
+            self._connection.commit()
+            self.matrix.flush()
+        return embeddings
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'model': self.model_name,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests > 0 else 0.0,
+            'evictions': self.evictions,
+            'entries': self._next_row - len(self._free_rows),
+        }
+
+
+class CachedEmbedder:
+    """Wraps a SentenceTransformer so that encode() goes through an EmbeddingCache. All other attributes are those of the model.
+
+    The cache assumes the encode options used in this project (no normalize_embeddings, prompts or output_value).
+    """
+
+    def __init__(self, embedder, cache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
+
+    def encode(self, sentences, convert_to_tensor=False, convert_to_numpy=True, device=None, **encode_kwargs):
+        single_sentence = isinstance(sentences, str)
+        texts = [sentences] if single_sentence else list(sentences)
+        if device is not None:
+            encode_kwargs['device'] = device
+
+        embeddings = self.cache.encode(self.embedder, texts, **encode_kwargs)
+        if single_sentence:
+            embeddings = embeddings[0]
+
+        if convert_to_tensor == True:
+            import torch
+            return torch.from_numpy(embeddings).to(device if device is not None else self.embedder.device)
+        return embeddings
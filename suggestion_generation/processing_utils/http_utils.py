@@ -0,0 +1,151 @@
+import os
+import requests
+import sqlite3
+import threading
+import time
+from processing_utils import metrics
+from protego import Protego
+from requests.adapters import HTTPAdapter
+from urllib import parse
+from urllib.parse import urlsplit
+
+
+#the same user agent is sent with every request and matched against the robots.txt rules
+USER_AGENT = 'ProcessImprovementSuggestions/1.0 (+https://github.com/ProcessImprovementSuggestions/Process-Improvement-Suggestion-Generation)'
+DEFAULT_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,application/pdf;q=0.8,*/*;q=0.7',
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_maxsize=32):
+    """Returns the process-wide keep-alive session used for robots.txt, PDF, GROBID, Semantic Scholar and web traffic."""
+    global _session
+    with _session_lock:
+        if _session == None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _session = session
+    return _session
+
+
+#robots.txt content that allows or disallows everything, as urllib.robotparser treats 4xx responses
+ALLOW_ALL = ''
+DISALLOW_ALL = 'User-agent: *\nDisallow: /'
+
+
+class RobotsCache:
+    """Caches parsed robots.txt files per scheme+netloc for ttl seconds, in memory and optionally in a SQLite file.
+
+    A robots.txt that cannot be loaded (network error or 5xx) is remembered in memory for failure_ttl seconds only, and
+    can_fetch returns None for its host meanwhile.
+    """
+
+    def __init__(self, ttl=86400, path=None, timeout=5, failure_ttl=300):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.path = path
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._parsers = {}
+        self._lock = threading.Lock()
+        self._host_locks = {}
+        self._connection = None
+
+        if path != None:
+            if os.path.dirname(path) != '':
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS robots (base_url TEXT PRIMARY KEY, content TEXT, fetched_at REAL)")
+            self._connection.commit()
+
+    def _load(self, base_url):
+        if self._connection == None:
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT content, fetched_at FROM robots WHERE base_url = ?", (base_url,)).fetchone()
+        #rows without content were stored for failed fetches by earlier versions
+        if row == None or row[0] == None or time.time() - row[1] >= self.ttl:
+            return None
+        return row[1] + self.ttl, Protego.parse(row[0])
+
+    def _store(self, base_url, content, fetched_at):
+        if self._connection == None:
+            return
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO robots VALUES (?, ?, ?)", (base_url, content, fetched_at))
+            self._connection.commit()
+
+    def _fetch(self, base_url):
+        #returns (expires_at, parser); a failed fetch has no parser and is not stored
+        try:
+            with metrics.timer('external_call_seconds', service='robots'):
+                r = get_session().get(parse.urljoin(base_url, 'robots.txt'), timeout=self.timeout)
+            if r.status_code in (401, 403):
+                content = DISALLOW_ALL
+            elif 400 <= r.status_code < 500:
+                content = ALLOW_ALL
+            else:
+                r.raise_for_status()
+                content = r.text
+            parser = Protego.parse(content)
+        except:
+            metrics.failure('robots')
+            return time.time() + self.failure_ttl, None
+        fetched_at = time.time()
+        self._store(base_url, content, fetched_at)
+        return fetched_at + self.ttl, parser
+
+    def _get_parser(self, base_url):
+        with self._lock:
+            host_lock = self._host_locks.setdefault(base_url, threading.Lock())
+
+        #concurrent requests for the same host wait for a single fetch
+        with host_lock:
+            entry = self._parsers.get(base_url)
+            if entry == None or time.time() >= entry[0]:
+                entry = self._load(base_url)
+                if entry == None:
+                    self.misses += 1
+                    metrics.cache_access('robots', False)
+                    entry = self._fetch(base_url)
+                else:
+                    self.hits += 1
+                    metrics.cache_access('robots', True)
+                self._parsers[base_url] = entry
+            else:
+                self.hits += 1
+                metrics.cache_access('robots', True)
+        return entry[1]
+
+    def can_fetch(self, full_url):
+        """Whether robots.txt allows USER_AGENT to fetch full_url, None if the robots.txt of its host cannot be loaded."""
+        url_parts = urlsplit(full_url)
+        base_url = url_parts.scheme + "://" + url_parts.netloc
+        parser = self._get_parser(base_url)
+        if parser == None:
+            return None
+        try:
+            return parser.can_fetch(full_url, USER_AGENT)
+        except:
+            return False
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / requests if requests > 0 else 0.0}
+
+
+robots_cache = RobotsCache()
+
+
+def configure_robots_cache(ttl, path=None, failure_ttl=300):
+    global robots_cache
+    robots_cache = RobotsCache(ttl=ttl, path=path, failure_ttl=failure_ttl)
+    return robots_cache
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def completion_key(model, messages, response_format):
+    request = {"model": model, "messages": messages, "response_format": response_format}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Persistent SQLite cache of chat completion contents, keyed by a hash of the request.
+
+    A disabled cache does not create or open its file.
+    """
+
+    def __init__(self, path, max_size_bytes=1024**3, enabled=True):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._size = 0
+        if not enabled:
+            return
+
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, content TEXT, size INTEGER, last_access REAL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+        self._connection.commit()
+        self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def get(self, key):
+        """Returns the cached content for key or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT content FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, content):
+        if not self.enabled:
+            return
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            previous = self._connection.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            if previous is not None:
+                self._size -= previous[0]
+            self._connection.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)", (key, content, size, time.time()))
+            self._size += size
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        #drop least recently used entries until the cache fits into max_size_bytes again
+        while self._size > self.max_size_bytes:
+            rows = self._connection.execute("SELECT key, size FROM completions ORDER BY last_access LIMIT 100").fetchall()
+            if rows == []:
+                break
+            for key, size in rows:
+                self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+                if self._size <= self.max_size_bytes:
+                    break
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests > 0 else 0.0,
+            'evictions': self.evictions,
+            'size_bytes': self._size,
+        }
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._connection.execute("DELETE FROM completions")
+            self._connection.commit()
+            self._size = 0
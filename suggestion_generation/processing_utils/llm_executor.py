@@ -0,0 +1,131 @@
+import openai
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from processing_utils import metrics
+
+
+def estimate_tokens(messages):
+    #rough estimate (~4 characters per token) used to reserve tokens-per-minute budget before a request is sent
+    return sum(len(message["content"]) // 4 + 4 for message in messages)
+
+
+def is_retryable(error):
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        return False
+    return status_code in (408, 409, 429) or status_code >= 500
+
+
+def retry_after(error):
+    #seconds the provider asked us to wait, if it told us
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Sliding one-minute window over the requests and tokens sent to the provider."""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._reservations = deque()
+        self._used_tokens = 0
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        while self._reservations and now - self._reservations[0][0] >= self.window:
+            self._used_tokens -= self._reservations.popleft()[1]
+
+    def acquire(self, tokens):
+        """Blocks until the request fits into the budget and returns its reservation."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._purge(now)
+                requests_ok = self.requests_per_minute is None or len(self._reservations) < self.requests_per_minute
+                #a single request larger than the whole budget is let through once the window is empty
+                tokens_ok = self.tokens_per_minute is None or not self._reservations or self._used_tokens + tokens <= self.tokens_per_minute
+                if requests_ok and tokens_ok:
+                    reservation = [now, tokens]
+                    self._reservations.append(reservation)
+                    self._used_tokens += tokens
+                    return reservation
+                wait = self.window - (now - self._reservations[0][0])
+            time.sleep(max(wait, 0.01))
+
+    def reconcile(self, reservation, tokens):
+        """Replaces the estimated token count of a reservation by the tokens actually used."""
+        with self._lock:
+            if reservation in self._reservations:
+                self._used_tokens += tokens - reservation[1]
+            reservation[1] = tokens
+
+
+class LLMExecutor:
+    """Dispatches LLM requests concurrently within the concurrency, requests-per-minute and tokens-per-minute limits of the provider."""
+
+    def __init__(self, max_concurrency=8, requests_per_minute=None, tokens_per_minute=None, max_retries=6, backoff_base=1.0, backoff_max=60.0, completion_tokens_estimate=300):
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.completion_tokens_estimate = completion_tokens_estimate
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+
+    def _backoff_delay(self, attempt, error):
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+            delay = delay * (0.5 + random.random() / 2)
+        return delay
+
+    def call(self, request_fn, messages):
+        """Sends a single request, waiting for rate-limit budget and retrying on 429/5xx and connection errors."""
+        estimated_tokens = estimate_tokens(messages) + self.completion_tokens_estimate
+        attempt = 0
+        while True:
+            reservation = self.rate_limiter.acquire(estimated_tokens)
+            try:
+                with metrics.timer('external_call_seconds', service='llm'):
+                    response = request_fn()
+            except Exception as error:
+                if attempt >= self.max_retries or not is_retryable(error):
+                    metrics.failure('llm')
+                    raise
+                metrics.increment('llm_retries_total')
+                time.sleep(self._backoff_delay(attempt, error))
+                attempt += 1
+                continue
+
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                self.rate_limiter.reconcile(reservation, usage.total_tokens)
+                metrics.increment('llm_tokens_total', usage.prompt_tokens, kind='prompt')
+                metrics.increment('llm_tokens_total', usage.completion_tokens, kind='completion')
+            return response
+
+    def map(self, fn, items):
+        """Applies fn to all items concurrently and returns the results in input order.
+
+        A failed item yields the raised exception instead of a result. fn must not call map itself.
+        """
+        futures = [self._pool.submit(fn, item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as error:
+                results.append(error)
+        return results
@@ -0,0 +1,229 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+
+#upper bounds (seconds) of the latency histogram buckets, from cache lookups to slow GROBID calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        #upper bound of the bucket that contains the quantile, capped by the largest observation
+        rank = q * self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count > 0 else 0.0,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, identified by a name and a set of labels."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, labels=()):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        with self._lock:
+            key = (name, labels)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def summary(self):
+        with self._lock:
+            summary = {'started_at': self.started_at, 'duration_seconds': time.time() - self.started_at, 'counters': {}, 'histograms': {}}
+            for (name, labels), value in sorted(self.counters.items()):
+                summary['counters'].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                summary['histograms'].setdefault(name, []).append({'labels': dict(labels), **histogram.summary()})
+        return summary
+
+    def prometheus_text(self, prefix='suggestion_'):
+        lines = []
+        with self._lock:
+            counter_names = sorted(set(name for name, _ in self.counters))
+            for name in counter_names:
+                lines.append(f'# TYPE {prefix}{name} counter')
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f'{prefix}{name}{_format_labels(labels)} {value}')
+            histogram_names = sorted(set(name for name, _ in self.histograms))
+            for name in histogram_names:
+                lines.append(f'# TYPE {prefix}{name} histogram')
+                for (histogram_name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets + ('+Inf',), histogram.bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f'{prefix}{name}_bucket{_format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                    lines.append(f'{prefix}{name}_sum{_format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{prefix}{name}_count{_format_labels(labels)} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if labels == ():
+        return ''
+    escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class _Timer:
+
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        registry.observe(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class _NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+#metrics are off unless enabled; every recording function then returns after a single check
+enabled = False
+registry = MetricsRegistry()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Discards all recorded metrics, e.g., at the start of a run."""
+    global registry
+    registry = MetricsRegistry()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    if enabled:
+        registry.increment(name, value, _labels(labels))
+
+
+def observe(name, value, **labels):
+    if enabled:
+        registry.observe(name, value, _labels(labels))
+
+
+def timer(name, **labels):
+    """Context manager recording the duration of its block (also if it raises) in the histogram name."""
+    if enabled:
+        return _Timer(name, _labels(labels))
+    return _NULL_TIMER
+
+
+def timed(name, **labels):
+    """Decorator version of timer."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Timer(name, _labels(labels)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def failure(category):
+    """Counts a handled failure, e.g., in an except block that falls back to an empty result."""
+    if enabled:
+        registry.increment('failures_total', 1, (('category', category),))
+
+
+def cache_access(cache, hit, n=1):
+    if enabled:
+        registry.increment('cache_requests_total', n, (('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+
+def summary():
+    return registry.summary()
+
+
+def prometheus_text():
+    return registry.prometheus_text()
+
+
+def _write(path, content):
+    if os.path.dirname(path) != '':
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+
+
+def write_summary(path, prometheus_path=None):
+    """Writes the JSON summary of the run and, optionally, the metrics in Prometheus text format (e.g., for the textfile collector of the node exporter)."""
+    _write(path, json.dumps(summary(), indent=2))
+    if prometheus_path is not None:
+        _write(prometheus_path, prometheus_text())
@@ -0,0 +1,50 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class PaperCache:
+    """Persistent SQLite cache of GROBID-parsed papers, keyed by Semantic Scholar corpusId.
+
+    Papers that are known to be unavailable (not open access, disallowed by robots.txt or without parsable text) are recorded as well, so that they are not requested again for unavailable_ttl seconds (None: never again).
+    """
+
+    def __init__(self, path, unavailable_ttl=None):
+        self.path = path
+        self.unavailable_ttl = unavailable_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS papers (corpus_id TEXT PRIMARY KEY, available INTEGER, abstract TEXT, body TEXT, created_at REAL)")
+        self._connection.commit()
+
+    def get(self, corpus_id):
+        """Returns {'available', 'abstract', 'body'} for a known paper or None."""
+        with self._lock:
+            row = self._connection.execute("SELECT available, abstract, body, created_at FROM papers WHERE corpus_id = ?", (str(corpus_id),)).fetchone()
+        expired = row is not None and row[0] == 0 and self.unavailable_ttl is not None and time.time() - row[3] >= self.unavailable_ttl
+        if row is None or expired:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {'available': row[0] == 1, 'abstract': row[1], 'body': row[2]}
+
+    def put_parsed(self, corpus_id, abstract, body):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO papers VALUES (?, 1, ?, ?, ?)", (str(corpus_id), abstract, body, time.time()))
+            self._connection.commit()
+
+    def put_unavailable(self, corpus_id):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO papers VALUES (?, 0, NULL, NULL, ?)", (str(corpus_id), time.time()))
+            self._connection.commit()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / requests if requests > 0 else 0.0}
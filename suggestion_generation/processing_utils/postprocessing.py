@@ -0,0 +1,21 @@
+from collections import defaultdict
+
+
+def attach_suggestions(feedback_weakness_batch, weakness_cluster_batch, cluster_queries_batch):
+    """Adds the 'suggestions' column to the weakness and feedback batches using hash lookups instead of nested loops.
+
+    Each weakness gets the suggestions of its cluster ([] if the cluster has none). Each feedback gets the distinct suggestions of its weaknesses, in order of first occurrence.
+    """
+    weakness_cluster_batch = weakness_cluster_batch.copy()
+    feedback_weakness_batch = feedback_weakness_batch.copy()
+
+    cluster_suggestions = dict(zip(cluster_queries_batch['cluster'].to_list(), cluster_queries_batch['suggestions'].to_list()))
+    weakness_cluster_batch['suggestions'] = [cluster_suggestions.get(cluster_i, []) for cluster_i in weakness_cluster_batch['cluster'].to_list()]
+
+    feedback_suggestions = defaultdict(dict)
+    for feedback_id, suggestions_i in zip(weakness_cluster_batch['feedback_id'].to_list(), weakness_cluster_batch['suggestions'].to_list()):
+        if isinstance(suggestions_i, str):
+            feedback_suggestions[feedback_id][suggestions_i] = None
+    feedback_weakness_batch['suggestions'] = [list(feedback_suggestions[feedback_id]) if feedback_id in feedback_suggestions else [] for feedback_id in feedback_weakness_batch['feedback_id'].to_list()]
+
+    return feedback_weakness_batch, weakness_cluster_batch
@@ -0,0 +1,118 @@
+import numpy as np
+import threading
+import time
+import uuid
+from processing_utils import metrics
+
+
+QUERY_ID_NAMESPACE = uuid.UUID('0b7c4f0e-2a61-4d7e-9a3f-5c2e8d1b6a94')
+
+
+class SemanticQueryCache:
+    """Reranked context and suggestion of earlier search queries, found by the cosine similarity of the query embeddings.
+
+    Entries are points of a Qdrant collection, so they persist across runs and engines: the vector is the query
+    embedding, the payload holds the query, its reranked results, its suggestion and its creation time. A lookup
+    returns the most similar entry with a cosine similarity >= threshold that is at most ttl seconds old (None: never
+    expires). Storing the same query again overwrites its entry.
+    """
+
+    def __init__(self, qdrantdb_client, collection_name, dimension, threshold=0.95, ttl=None):
+        self.qdrantdb_client = qdrantdb_client
+        self.collection_name = collection_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        from qdrant_client import models
+        #queries are few compared to the knowledge base, so they are kept in RAM
+        if not qdrantdb_client.collection_exists(collection_name):
+            qdrantdb_client.create_collection(
+                collection_name=collection_name,
+                vectors_config=models.VectorParams(size=dimension, distance=models.Distance.COSINE, on_disk=False),
+            )
+            qdrantdb_client.create_payload_index(collection_name=collection_name, field_name='created_at', field_schema=models.PayloadSchemaType.FLOAT)
+
+    def _fresh_filter(self):
+        from qdrant_client import models
+        if self.ttl is None:
+            return None
+        return models.Filter(must=[models.FieldCondition(key='created_at', range=models.Range(gte=time.time() - self.ttl))])
+
+    def lookup(self, query_vectors, search_batch_size=64):
+        """Returns, per query vector, the payload of the most similar fresh entry above the threshold or None."""
+        from qdrant_client import models
+        query_filter = self._fresh_filter()
+        search_requests = [models.SearchRequest(vector=np.asarray(vector, dtype=np.float32).tolist(), limit=1, score_threshold=self.threshold, filter=query_filter, with_payload=True) for vector in query_vectors]
+
+        payloads = []
+        for batch_i in range(0, len(search_requests), search_batch_size):
+            with metrics.timer('external_call_seconds', service='qdrant_search_batch'):
+                search_results = self.qdrantdb_client.search_batch(collection_name=self.collection_name, requests=search_requests[batch_i:batch_i+search_batch_size])
+            payloads.extend(search_result[0].payload if search_result != [] else None for search_result in search_results)
+
+        n_hits = sum(payload is not None for payload in payloads)
+        with self._lock:
+            self.hits += n_hits
+            self.misses += len(payloads) - n_hits
+        metrics.cache_access('semantic_queries', True, n_hits)
+        metrics.cache_access('semantic_queries', False, len(payloads) - n_hits)
+        return payloads
+
+    def put(self, queries, query_vectors, reranked, suggestions):
+        if len(queries) == 0:
+            return
+        from qdrant_client import models
+        created_at = time.time()
+        self.qdrantdb_client.upsert(
+            collection_name=self.collection_name,
+            points=[
+                models.PointStruct(
+                    id=str(uuid.uuid5(QUERY_ID_NAMESPACE, query)),
+                    vector=np.asarray(vector, dtype=np.float32).tolist(),
+                    payload={'search_query': query, 'reranked': reranked_i, 'suggestions': suggestion_i, 'created_at': created_at},
+                )
+                for query, vector, reranked_i, suggestion_i in zip(queries, query_vectors, reranked, suggestions)
+            ],
+        )
+
+    def purge_expired(self):
+        """Deletes the entries older than the ttl."""
+        from qdrant_client import models
+        if self.ttl is None:
+            return
+        self.qdrantdb_client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(filter=models.Filter(must=[models.FieldCondition(key='created_at', range=models.Range(lt=time.time() - self.ttl))])),
+        )
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests > 0 else 0.0,
+        }
+
+
+def follow_similar(query_vectors, threshold):
+    """For every query, the index of the most similar earlier leading query with a cosine similarity >= threshold.
+
+    Queries without such a query lead themselves (their own index). Followers can reuse the results of their leader
+    within a run, before these are in the cache.
+    """
+    query_vectors = np.asarray(query_vectors, dtype=np.float32)
+    query_vectors = query_vectors / np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+    leaders = np.arange(len(query_vectors))
+    leader_idxs = []
+    for idx, vector in enumerate(query_vectors):
+        if leader_idxs != []:
+            similarities = query_vectors[leader_idxs] @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= threshold:
+                leaders[idx] = leader_idxs[best]
+                continue
+        leader_idxs.append(idx)
+    return leaders
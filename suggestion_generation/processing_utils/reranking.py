@@ -0,0 +1,96 @@
+import hashlib
+import numpy as np
+import threading
+from collections import OrderedDict
+from processing_utils import metrics
+
+
+def content_key(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def top_k_indexes(scores, k):
+    #indexes of the k highest scores in decreasing order, without sorting all scores
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k-1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class Reranker:
+    """Reranks retrieved documents for a query with a cross-encoder.
+
+    Identical texts are scored once, pairs are scored in batches of similar length, and scores are kept in an LRU cache
+    of (query, text) pairs. Optionally, only the prefilter_limit candidates most similar to the query according to a
+    bi-encoder are passed to the cross-encoder.
+    """
+
+    def __init__(self, cross_encoder, batch_size=32, prefilter_embedder=None, prefilter_limit=None, cache_size=100000):
+        self.cross_encoder = cross_encoder
+        self.batch_size = batch_size
+        self.prefilter_embedder = prefilter_embedder
+        self.prefilter_limit = prefilter_limit
+        self.cache_size = cache_size
+        self._score_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prefilter(self, query, texts):
+        query_embedding = np.asarray(self.prefilter_embedder.encode(query), dtype=np.float32)
+        text_embeddings = np.asarray(self.prefilter_embedder.encode(texts), dtype=np.float32)
+        sims = text_embeddings @ query_embedding / np.maximum(np.linalg.norm(text_embeddings, axis=1) * np.linalg.norm(query_embedding), 1e-12)
+        return np.sort(top_k_indexes(sims, self.prefilter_limit))
+
+    def _scores(self, query, texts, keys):
+        scores = np.empty(len(texts), dtype=np.float32)
+        missing = []
+        with self._lock:
+            for idx, key in enumerate(keys):
+                score = self._score_cache.get((query, key))
+                if score is None:
+                    missing.append(idx)
+                else:
+                    self._score_cache.move_to_end((query, key))
+                    scores[idx] = score
+
+        metrics.cache_access('rerank_scores', True, len(texts) - len(missing))
+        metrics.cache_access('rerank_scores', False, len(missing))
+        if missing != []:
+            #sorting by length keeps the padding within each batch small
+            missing = sorted(missing, key=lambda idx: len(texts[idx]))
+            with metrics.timer('encode_seconds', model='cross_encoder'):
+                missing_scores = self.cross_encoder.predict([[query, texts[idx]] for idx in missing], batch_size=self.batch_size, show_progress_bar=False)
+            with self._lock:
+                for idx, score in zip(missing, missing_scores):
+                    scores[idx] = score
+                    self._score_cache[(query, keys[idx])] = float(score)
+                while len(self._score_cache) > self.cache_size:
+                    self._score_cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query, query_results, limit_results_rerank):
+        """Returns the limit_results_rerank query results (lists starting with the text) with the highest cross-encoder scores."""
+        return self.rerank_with_scores(query, query_results, limit_results_rerank)[0]
+
+    @metrics.timed('rerank_seconds')
+    def rerank_with_scores(self, query, query_results, limit_results_rerank):
+        """Like rerank, and also returns the cross-encoder scores of the returned results in decreasing order."""
+        #identical texts from different sources are scored (and returned) once
+        first_occurrences = {}
+        for idx, query_result in enumerate(query_results):
+            first_occurrences.setdefault(content_key(query_result[0]), idx)
+        keys = list(first_occurrences.keys())
+        candidates = list(first_occurrences.values())
+
+        if self.prefilter_embedder is not None and self.prefilter_limit and len(candidates) > self.prefilter_limit:
+            selected = self._prefilter(query, [query_results[idx][0] for idx in candidates])
+            keys = [keys[idx] for idx in selected]
+            candidates = [candidates[idx] for idx in selected]
+
+        scores = self._scores(query, [query_results[idx][0] for idx in candidates], keys)
+        top = top_k_indexes(scores, limit_results_rerank)
+        return [query_results[candidates[idx]] for idx in top], scores[top].tolist()
+
+    def clear_cache(self):
+        with self._lock:
+            self._score_cache.clear()
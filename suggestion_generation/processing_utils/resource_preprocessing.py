@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -30,14 +31,76 @@ def cross_dataset_preprocessing(corpus_data, text_column, source_column):
     return corpus_data
 
 
-def create_split_documents(texts, metadata, embedder):
-    split_documents = []
+class SplitDocument(dict):
+    """Chunk of a text with its 'token_ids' and 'metadata'; 'page_content' is decoded from the token ids on first access.
+
+    Only item access (document['page_content']) decodes, get() and iteration see page_content once it was accessed.
+    """
+
+    def __init__(self, token_ids, metadata, tokenizer):
+        super().__init__(token_ids=token_ids, metadata=metadata)
+        self.tokenizer = tokenizer
+
+    def __missing__(self, key):
+        if key != 'page_content':
+            raise KeyError(key)
+        self['page_content'] = self.tokenizer.decode(self['token_ids'], skip_special_tokens=True)
+        return self['page_content']
 
-    inputs = embedder.tokenizer(texts, truncation=True, padding=True, return_overflowing_tokens=True, max_length=embedder.get_max_seq_length(), return_tensors='pt')
-    decoded_inputs = embedder.tokenizer.batch_decode(inputs['input_ids'], skip_special_tokens=True)
 
-    for content_i, meta_i in zip(decoded_inputs, inputs["overflow_to_sample_mapping"]):
-        split_documents.append({'page_content': content_i, 'metadata': metadata[meta_i]})
-    
-    del inputs
+def create_split_documents(texts, metadata, embedder, overlap=0, window=None, tokenize_batch_size=1000):
+    """Splits every text into token windows of at most window tokens, consecutive windows sharing overlap tokens.
+
+    window defaults to the embedder's maximum sequence length without special tokens, so every window is embedded
+    completely. Texts are tokenized tokenize_batch_size at a time and without padding, so memory grows with the number
+    of tokens rather than with the number of texts times the longest text. Returns one SplitDocument per window.
+    """
+    tokenizer = embedder.tokenizer
+    if window is None:
+        window = embedder.get_max_seq_length() - tokenizer.num_special_tokens_to_add()
+    if not 0 <= overlap < window:
+        raise ValueError(f'overlap must be at least 0 and smaller than the window of {window} tokens')
+    stride = window - overlap
+
+    split_documents = []
+    for batch_start in range(0, len(texts), tokenize_batch_size):
+        input_ids = tokenizer(texts[batch_start:batch_start+tokenize_batch_size], add_special_tokens=False, truncation=False, verbose=False)['input_ids']
+        for token_ids, meta_i in zip(input_ids, metadata[batch_start:batch_start+tokenize_batch_size]):
+            #the last window ends with the text, empty texts keep one empty window
+            for start in range(0, max(len(token_ids) - overlap, 1), stride):
+                split_documents.append(SplitDocument(token_ids[start:start+window], meta_i, tokenizer))
     return split_documents
+
+
+def _special_tokens(tokenizer):
+    #the special token ids around a single sequence, read off the tokenizer's own output for a sample text
+    with_special = tokenizer(['a'], add_special_tokens=True)['input_ids'][0]
+    without_special = tokenizer(['a'], add_special_tokens=False)['input_ids'][0]
+    for start in range(len(with_special) - len(without_special) + 1):
+        if with_special[start:start+len(without_special)] == without_special:
+            return with_special[:start], with_special[start+len(without_special):]
+    raise ValueError('cannot locate the sequence between the special tokens')
+
+
+def encode_split_documents(documents, embedder, batch_size=256):
+    """Embeds split documents as a numpy array.
+
+    SentenceTransformer models run directly on the token windows, in batches of similar length, instead of decoding
+    and re-tokenizing them; this bypasses the embedding cache, which is keyed by text. Other embedders encode the
+    decoded texts.
+    """
+    if not hasattr(embedder, 'forward') or not all(isinstance(document_i, SplitDocument) for document_i in documents):
+        return embedder.encode([document_i['page_content'] for document_i in documents], batch_size=batch_size, convert_to_numpy=True)
+
+    import torch
+    tokenizer = embedder.tokenizer
+    prefix, suffix = _special_tokens(tokenizer)
+    embeddings = np.empty((len(documents), embedder.get_sentence_embedding_dimension()), dtype=np.float32)
+    order = np.argsort([-len(document_i['token_ids']) for document_i in documents], kind='stable')
+    with torch.inference_mode():
+        for batch_start in range(0, len(order), batch_size):
+            batch_idxs = order[batch_start:batch_start+batch_size]
+            features = tokenizer.pad({'input_ids': [prefix + documents[idx]['token_ids'] + suffix for idx in batch_idxs]}, return_tensors='pt')
+            features = {name: tensor.to(embedder.device) for name, tensor in features.items()}
+            embeddings[batch_idxs] = embedder.forward(features)['sentence_embedding'].float().cpu().numpy()
+    return embeddings
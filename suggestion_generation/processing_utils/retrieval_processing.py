@@ -1,49 +1,46 @@
-import grobid_tei_xml
 import numpy as np
-import requests
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
-from langchain.document_loaders import WebBaseLoader
+from processing_utils import http_utils
+from processing_utils import metrics
 from processing_utils import resource_preprocessing
 from processing_utils import vector_db
-from protego import Protego
-from urllib import parse
-from urllib.parse import urlsplit
 
 
-def get_tweet_documents(query, qdrantdb_client, tweet_collection_name, embedder, limit_results):
-    tweet_search_results = vector_db.search_kb(query, qdrantdb_client, tweet_collection_name, embedder, limit_results)
-    return [[tweet_search_result['page_content'], tweet_search_result['source'], 'tweet_id'] for tweet_search_result in tweet_search_results]
+def get_tweet_documents(query, qdrantdb_client, tweet_collection_name, embedder, limit_results, search_results=None, profile=None):
+    #search_results can be passed in when the query was already searched in a batch (see vector_db.search_kb_batch)
+    if search_results is None:
+        search_results = vector_db.search_kb(query, qdrantdb_client, tweet_collection_name, embedder, limit_results, profile)
+    return [[tweet_search_result['page_content'], tweet_search_result['source'], 'tweet_id'] for tweet_search_result in search_results]
 
 
 def crawl_allowed(full_url):
-    #check whether robots.txt allows us to crawl website
-    url_parts = urlsplit(full_url)
-    base_url = url_parts.scheme + "://" + url_parts.netloc
-    try:
-        r = requests.get(parse.urljoin(base_url, 'robots.txt'), timeout=5)
-        rp = Protego.parse(r.text)
-        is_allowed = rp.can_fetch(full_url, "*")
-    except:
-        is_allowed = False
-    return is_allowed
+    #check whether robots.txt allows us to crawl website; None if robots.txt could not be loaded
+    return http_utils.robots_cache.can_fetch(full_url)
 
 
 #Semantic_scholar
-def request_papers(ids, fields, x_api_key):
+SEMANTIC_SCHOLAR_URL = 'https://api.semanticscholar.org'
+
+
+def request_papers(ids, fields, x_api_key, api_url=SEMANTIC_SCHOLAR_URL):
     if len(ids) > 500:
         requested_papers = False
         print("Too many ids")
     else:
         try:
-            response = requests.post(
-                'https://api.semanticscholar.org/graph/v1/paper/batch',
-                params = {'fields': fields},
-                headers = {'x-api-key': x_api_key},
-                json = {"ids": ids}
-            )
+            with metrics.timer('external_call_seconds', service='semantic_scholar'):
+                response = http_utils.get_session().post(
+                    '%s/graph/v1/paper/batch' % api_url,
+                    params = {'fields': fields},
+                    headers = {'x-api-key': x_api_key},
+                    json = {"ids": ids}
+                )
             response.raise_for_status()
             requested_papers = response.json()
         except:
+            metrics.failure('semantic_scholar')
             requested_papers = False
         
     return requested_papers
@@ -54,57 +51,118 @@ def format_context(context):
     return context
 
 
-def get_paper_documents(query, qdrantdb_client, tldr_collection_name, embedder, url_setting, x_api_key, limit_results):
-    tldr_search_results = vector_db.search_kb(query, qdrantdb_client, tldr_collection_name, embedder, limit_results)
-    tldr_search_results = [[tldr_search_result['page_content'], tldr_search_result['source'], 'corpus_id'] for tldr_search_result in tldr_search_results]
+class PaperUnavailable(Exception):
+    """Raised when a paper cannot be used, independent of transient network errors."""
+
+
+class RobotsUnreachable(Exception):
+    """Raised when the robots.txt of a paper's host cannot be loaded; a transient error."""
+
+
+def parse_paper(paper_url, url_setting):
+    #download the PDF and parse it with GROBID
+    import grobid_tei_xml
+
+    allowed = crawl_allowed(paper_url)
+    if allowed is None:
+        raise RobotsUnreachable(paper_url)
+    if allowed != True:
+        raise PaperUnavailable(paper_url)
+    session = http_utils.get_session()
+    #failed downloads and GROBID errors are transient, only an empty parse makes a paper unavailable
+    with metrics.timer('external_call_seconds', service='pdf_fetch'):
+        pdf_resp = session.get(paper_url, allow_redirects=True, timeout=60)
+    pdf_resp.raise_for_status()
+    with metrics.timer('external_call_seconds', service='grobid'):
+        xml = session.post(url_setting, files={'input': pdf_resp.content}, timeout=120)
+    xml.raise_for_status()
+    doc = grobid_tei_xml.parse_document_xml(xml.text)
+    if ((doc.body == None) and (doc.abstract == None)):
+        raise PaperUnavailable(paper_url)
+    return doc.abstract, doc.body
+
+
+def paper_text(abstract, body):
+    if ((body != None) and (abstract != None)):
+        return format_context([abstract, body])
+    elif (body != None):
+        return body
+    return abstract
+
+
+def get_abstract_documents(query, qdrantdb_client, tldr_collection_name, embedder, limit_results, search_results=None, profile=None):
+    #the abstracts as stored in the knowledge base, without loading the full texts of their papers
+    if search_results is None:
+        search_results = vector_db.search_kb(query, qdrantdb_client, tldr_collection_name, embedder, limit_results, profile)
+    return [[tldr_search_result['page_content'], tldr_search_result['source'], 'corpus_id'] for tldr_search_result in search_results]
+
+
+def get_paper_documents(query, qdrantdb_client, tldr_collection_name, embedder, url_setting, x_api_key, limit_results, paper_cache=None, max_workers=8, search_results=None, scholar_url=SEMANTIC_SCHOLAR_URL, split_overlap=0, profile=None):
+    tldr_search_results = get_abstract_documents(query, qdrantdb_client, tldr_collection_name, embedder, limit_results, search_results, profile)
+
+    #results that belong to the same paper are patched together
+    results_by_corpus_id = defaultdict(list)
+    for i, tldr_search_result_i in enumerate(tldr_search_results):
+        results_by_corpus_id[str(tldr_search_result_i[1])].append(i)
+
+    def patch_results(corpus_id, text):
+        for i in results_by_corpus_id[str(corpus_id)]:
+            tldr_search_results[i][0] = text
+
+    #Papers that were parsed (or found unavailable) before are taken from the cache
+    uncached_corpus_ids = []
+    for corpus_id in results_by_corpus_id:
+        cached_paper = paper_cache.get(corpus_id) if paper_cache != None else None
+        metrics.cache_access('papers', cached_paper != None)
+        if cached_paper == None:
+            uncached_corpus_ids.append(corpus_id)
+        elif cached_paper['available'] == True:
+            patch_results(corpus_id, paper_text(cached_paper['abstract'], cached_paper['body']))
 
     #Loading and parsing PDFs
     n_a_papers = []
     fields = 'tldr,openAccessPdf,title,corpusId,isOpenAccess'
+    request_paper_ids = [f'CorpusId:{corpus_id}' for corpus_id in uncached_corpus_ids]
 
-    paper_sources = [tldr_search_result[1] for tldr_search_result in tldr_search_results]
-    request_paper_ids = [f'CorpusId:{str(source_id)}' for source_id in paper_sources]
-
-    requested_papers = request_papers(request_paper_ids, fields, x_api_key)
+    requested_papers = request_papers(request_paper_ids, fields, x_api_key, scholar_url) if request_paper_ids != [] else False
 
     if requested_papers != False:
-        for paper_i in requested_papers:
-            if paper_i == None:
+        paper_futures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for paper_i in requested_papers:
+                if paper_i == None:
+                    continue
+                if ((paper_i["isOpenAccess"] == True) and (paper_i["openAccessPdf"] != None)):
+                    paper_futures[paper_i["corpusId"]] = pool.submit(parse_paper, paper_i["openAccessPdf"]["url"], url_setting)
+                else:
+                    n_a_papers.append(paper_i["corpusId"])
+                    if paper_cache != None:
+                        paper_cache.put_unavailable(paper_i["corpusId"])
+
+        for corpus_id, paper_future in paper_futures.items():
+            try:
+                abstract, body = paper_future.result()
+            except PaperUnavailable:
+                metrics.failure('paper_unavailable')
+                n_a_papers.append(corpus_id)
+                if paper_cache != None:
+                    paper_cache.put_unavailable(corpus_id)
                 continue
-            if ((paper_i["isOpenAccess"] == True) and (paper_i["openAccessPdf"] != None)):
-                try:
-                    paper_url = paper_i["openAccessPdf"]["url"]
-                    if (crawl_allowed(paper_url) == True):
-                        pdf_resp = requests.get(paper_url, allow_redirects=True)
-                        xml = requests.post(url_setting, files={'input': pdf_resp.content})
-                        doc = grobid_tei_xml.parse_document_xml(xml.text)
-                        #print(f'Open Access Paper: {paper_url}')
-                        if ((doc.body != None) and (doc.abstract != None)):
-                            for i, tldr_search_result_i in enumerate(tldr_search_results):
-                                if str(tldr_search_result_i[1]) == str(paper_i["corpusId"]):
-                                    tldr_search_results[i][0] = format_context([doc.abstract, doc.body])
-                        elif ((doc.body != None)):
-                            for i, tldr_search_result_i in enumerate(tldr_search_results):
-                                if str(tldr_search_result_i[1]) == str(paper_i["corpusId"]):
-                                    tldr_search_results[i][0] = doc.body
-                        elif ((doc.abstract != None)):
-                            for i, tldr_search_result_i in enumerate(tldr_search_results):
-                                if str(tldr_search_result_i[1]) == str(paper_i["corpusId"]):
-                                    tldr_search_results[i][0] = doc.abstract                                    
-                        else:
-                            n_a_papers.append(paper_i["corpusId"])
-                    else:
-                        n_a_papers.append(paper_i["corpusId"])
-                except:
-                    n_a_papers.append(paper_i["corpusId"])                
-            else:
-                n_a_papers.append(paper_i["corpusId"])
+            except:
+                #transient failures are not cached
+                metrics.failure('paper_parse')
+                n_a_papers.append(corpus_id)
+                continue
+            if paper_cache != None:
+                paper_cache.put_parsed(corpus_id, abstract, body)
+            patch_results(corpus_id, paper_text(abstract, body))
 
 
     #Generate suggestions
     text_results = [tldr_search_result[0] for tldr_search_result in tldr_search_results]
     metadata_results = [{'source': tldr_search_result[1]} for tldr_search_result in tldr_search_results]
-    splits = resource_preprocessing.create_split_documents(text_results, metadata_results, embedder)
+    with metrics.timer('split_seconds', source='papers'):
+        splits = resource_preprocessing.create_split_documents(text_results, metadata_results, embedder, overlap=split_overlap)
     splits = [[split['page_content'], split['metadata']['source'], 'corpus_id'] for split in splits]
 
     return splits
@@ -117,12 +175,13 @@ def search_web(query, service, GOOGLE_CSE_ID, limit_results):
     query = f"{query} -filetype:pdf"
 
     for start_i in range(1,limit_results+1,10):
-        res = service.cse().list(
-            q=query,
-            cx=GOOGLE_CSE_ID,
-            num=min(10, limit_results-start_i+1), #Valid values are integers between 1 and 10, inclusive.
-            start=start_i
-        ).execute()
+        with metrics.timer('external_call_seconds', service='web_search'):
+            res = service.cse().list(
+                q=query,
+                cx=GOOGLE_CSE_ID,
+                num=min(10, limit_results-start_i+1), #Valid values are integers between 1 and 10, inclusive.
+                start=start_i
+            ).execute()
         responses.extend(res['items'])
 
     for result in responses:
@@ -131,7 +190,10 @@ def search_web(query, service, GOOGLE_CSE_ID, limit_results):
     return links
 
 
-def get_web_documents(query, service, GOOGLE_CSE_ID, embedder, limit_results):
+def get_web_documents(query, service, GOOGLE_CSE_ID, embedder, limit_results, split_overlap=0):
+    #langchain takes seconds to import, so it is only imported when websites are loaded
+    from langchain.document_loaders import WebBaseLoader
+
     web_results = search_web(query, service, GOOGLE_CSE_ID, limit_results)
 
     n_a_websites = []
@@ -147,14 +209,18 @@ def get_web_documents(query, service, GOOGLE_CSE_ID, embedder, limit_results):
     for allowed_web_result_i in allowed_web_results:
         try:
             loader = WebBaseLoader(allowed_web_result_i, requests_kwargs={'timeout':5})
-            docs.append(loader.load()[0])
+            loader.session = http_utils.get_session()
+            with metrics.timer('external_call_seconds', service='web_load'):
+                docs.append(loader.load()[0])
         except:
+            metrics.failure('web_load')
             n_a_websites.append(allowed_web_result_i)
 
     #Embed websites
     web_texts = [web_document.page_content for web_document in docs]
     web_metadata = [web_document.metadata for web_document in docs]
-    web_documents = resource_preprocessing.create_split_documents(web_texts, web_metadata, embedder)
+    with metrics.timer('split_seconds', source='web'):
+        web_documents = resource_preprocessing.create_split_documents(web_texts, web_metadata, embedder, overlap=split_overlap)
 
     return [[web_document['page_content'], web_document['metadata']['source'], 'web_link'] for web_document in web_documents]
 
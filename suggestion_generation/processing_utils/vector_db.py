@@ -1,100 +1,414 @@
+import json
 import os
+import numpy as np
 import pandas as pd
+import queue
+import threading
 import time
+import uuid
+from collections import defaultdict
+from processing_utils import metrics
 from processing_utils import resource_preprocessing
-from qdrant_client import models
 
 
-def recreate_db(qdrantdb_client, collection_name, embedder):
+#settings of the tweet and abstract collections; profiles (config_params["collection_profiles"]) override some of them
+DEFAULT_COLLECTION_PROFILE = {
+    'on_disk': True, #original vectors in memory-mapped files instead of RAM
+    'hnsw_m': None, #edges per node, None keeps the Qdrant default (16)
+    'hnsw_ef_construct': None, #neighbours considered while building the index, None keeps the Qdrant default (100)
+    'hnsw_on_disk': None, #HNSW graph in memory-mapped files
+    'hnsw_ef': None, #neighbours considered while searching, None uses ef_construct
+    'quantization': None, #None, 'scalar' (int8, 4x smaller vectors) or 'binary' (1 bit per dimension, 32x smaller)
+    'quantization_always_ram': True, #keep the quantized vectors in RAM, also if the original ones are on disk
+    'rescore': True, #rescore the candidates found with quantized vectors with the original vectors
+    'oversampling': None, #with quantization, fetch oversampling * limit candidates before rescoring
+    'exact': False, #brute-force search, e.g. as the recall reference
+}
+
+
+def collection_profile(profile=None):
+    """Returns the full settings of a collection profile (a dict with a subset of the keys of DEFAULT_COLLECTION_PROFILE)."""
+    profile = dict(profile or {})
+    unknown_keys = set(profile) - set(DEFAULT_COLLECTION_PROFILE)
+    if unknown_keys != set():
+        raise ValueError(f"Unknown collection profile settings: {', '.join(sorted(unknown_keys))}")
+    if profile.get('quantization') not in (None, 'scalar', 'binary'):
+        raise ValueError(f"Unknown quantization {profile['quantization']}, use None, 'scalar' or 'binary'")
+    return {**DEFAULT_COLLECTION_PROFILE, **profile}
+
+
+def _quantization_config(profile):
+    from qdrant_client import models
+    if profile['quantization'] == 'scalar':
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=profile['quantization_always_ram']))
+    if profile['quantization'] == 'binary':
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=profile['quantization_always_ram']))
+    return None
+
+
+def search_params(profile=None):
+    """Search parameters of a collection profile, None if it searches with the Qdrant defaults."""
+    from qdrant_client import models
+    profile = collection_profile(profile)
+    quantization = models.QuantizationSearchParams(rescore=profile['rescore'], oversampling=profile['oversampling']) if profile['quantization'] is not None else None
+    if profile['hnsw_ef'] is None and quantization is None and profile['exact'] == False:
+        return None
+    return models.SearchParams(hnsw_ef=profile['hnsw_ef'], exact=profile['exact'], quantization=quantization)
+
+
+def recreate_db(qdrantdb_client, collection_name, embedder, profile=None):
+    #qdrant_client is imported where it is used, so that importing this module stays cheap
+    from qdrant_client import models
+    profile = collection_profile(profile)
+    hnsw_settings = {'m': profile['hnsw_m'], 'ef_construct': profile['hnsw_ef_construct'], 'on_disk': profile['hnsw_on_disk']}
+
     #recreate collection
     qdrantdb_client.recreate_collection(
         collection_name=collection_name,
         vectors_config=models.VectorParams(
             size=embedder.get_sentence_embedding_dimension(),  # Vector size is defined by used model
             distance=models.Distance.COSINE,
-            on_disk=True,
+            on_disk=profile['on_disk'],
         ),
+        hnsw_config=models.HnswConfigDiff(**hnsw_settings) if any(value is not None for value in hnsw_settings.values()) else None,
+        quantization_config=_quantization_config(profile),
         optimizers_config=models.OptimizersConfigDiff(
             indexing_threshold=0,
         ),
     )
 
-def create_db_collection(path_resources, source_column, text_column, qdrantdb_client, collection_name, embedder, cross_dataset_preprocess):
-    print(f'Create {collection_name}')
-    recreate_db(qdrantdb_client, collection_name, embedder)
 
-    upload_batch_size = 100000
-    uploaded_sources = set()
-    len_chunks = 0
-
-    for resource_file in os.scandir(path_resources):
-        if resource_file.name.endswith('.jsonl') == True:
-            print(f'Loading file: {resource_file.name}')
-            corpus_data = pd.read_json(resource_file.path, lines=True)
-        elif resource_file.name.endswith('.pkl') == True:
-            print(f'Loading file: {resource_file.name}')
-            corpus_data = pd.read_pickle(resource_file.path)
+def ensure_db(qdrantdb_client, collection_name, embedder, profile=None):
+    #create the collection only if it does not exist yet
+    if not qdrantdb_client.collection_exists(collection_name):
+        recreate_db(qdrantdb_client, collection_name, embedder, profile)
+
+
+POINT_ID_NAMESPACE = uuid.UUID('6f1d8a52-3c4e-4b8a-9a57-2d0c61f0e9b3')
+
+
+def point_id(source, chunk_idx):
+    #deterministic point id, so that re-uploading a source overwrites its points instead of duplicating them
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f'{source}:{chunk_idx}'))
+
+
+def existing_sources(qdrantdb_client, collection_name, sources, lookup_batch_size=1000):
+    """Returns the subset of sources whose first chunk is already stored in the collection.
+
+    _upload_batch writes the first chunks of a batch after all other chunks, so a stored first chunk means that all
+    chunks of the source were stored, even if an earlier upload was interrupted.
+    """
+    ids = {point_id(source_i, 0): source_i for source_i in sources}
+    id_list = list(ids.keys())
+    found = set()
+    for batch_i in range(0, len(id_list), lookup_batch_size):
+        points = qdrantdb_client.retrieve(collection_name=collection_name, ids=id_list[batch_i:batch_i+lookup_batch_size], with_payload=False, with_vectors=False)
+        found.update(ids[str(point.id)] for point in points)
+    return found
+
+
+def file_signature(path):
+    #size and modification time; a file that was rewritten or appended to gets a new signature
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class IngestCheckpoint:
+    """Records, per resource file, how many batches were uploaded, so that an interrupted ingest can resume.
+
+    Entries of files whose signature (see file_signature) changed since they were recorded are dropped. The
+    checkpoint is removed when the ingest completes.
+    """
+
+    def __init__(self, path, collection_name, batch_size, file_signatures=None):
+        self.path = path
+        self.file_signatures = file_signatures if file_signatures is not None else {}
+        self.state = {'collection_name': collection_name, 'batch_size': batch_size, 'files': {}}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state['collection_name'] == collection_name and state['batch_size'] == batch_size:
+                self.state['files'] = {
+                    file_name: entry for file_name, entry in state['files'].items()
+                    if isinstance(entry, dict) and entry['signature'] == self.file_signatures.get(file_name)
+                }
+            else:
+                print(f'Ignoring checkpoint {path}: it belongs to a different collection or batch size')
+
+    def is_done(self, file_name, batch_idx):
+        return file_name in self.state['files'] and batch_idx < self.state['files'][file_name]['batches']
+
+    def mark_done(self, file_name, batch_idx):
+        n_batches = self.state['files'][file_name]['batches'] if file_name in self.state['files'] else 0
+        self.state['files'][file_name] = {'signature': self.file_signatures.get(file_name), 'batches': max(n_batches, batch_idx + 1)}
+        if self.path is None:
+            return
+        #write to a temporary file first so that an interruption never leaves a corrupt checkpoint
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def complete(self):
+        #a finished ingest leaves nothing to resume
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _read_resource_file(resource_file, read_chunk_size):
+    #yields the file as DataFrames of at most read_chunk_size rows (jsonl only), or as a whole
+    if resource_file.name.endswith('.jsonl') == True:
+        print(f'Loading file: {resource_file.name}')
+        if read_chunk_size is None:
+            yield pd.read_json(resource_file.path, lines=True)
         else:
-            print("Must be jsonl or pkl file")
+            with pd.read_json(resource_file.path, lines=True, chunksize=read_chunk_size) as reader:
+                for corpus_data in reader:
+                    yield corpus_data
+    elif resource_file.name.endswith('.pkl') == True:
+        print(f'Loading file: {resource_file.name}')
+        yield pd.read_pickle(resource_file.path)
+    else:
+        print("Must be jsonl or pkl file")
 
-        if cross_dataset_preprocess == True:
-            corpus_data = resource_preprocessing.cross_dataset_preprocessing(corpus_data, text_column, source_column)
 
-        corpus_texts_raw = corpus_data[text_column].tolist()
-        corpus_sources_raw = corpus_data[source_column].tolist()
+def _iter_resource_batches(path_resources, source_column, text_column, cross_dataset_preprocess, batch_size, read_chunk_size, uploaded_sources):
+    """Yields (file name, batch index, texts, sources) batches of at most batch_size deduplicated texts."""
+    for resource_file in sorted(os.scandir(path_resources), key=lambda entry: entry.name):
+        batch_idx = 0
+        corpus_texts = []
+        corpus_sources = []
 
-        corpus_texts=[]
-        corpus_sources=[]
+        for corpus_data in _read_resource_file(resource_file, read_chunk_size):
+            if cross_dataset_preprocess == True:
+                corpus_data = resource_preprocessing.cross_dataset_preprocessing(corpus_data, text_column, source_column)
 
-        #Check for duplicates
-        for text_i, source_i in zip(corpus_texts_raw, corpus_sources_raw):
-            if source_i not in uploaded_sources:
-                uploaded_sources.add(source_i)
-                corpus_sources.append(source_i)
-                corpus_texts.append(text_i)
+            #Check for duplicates
+            for text_i, source_i in zip(corpus_data[text_column].tolist(), corpus_data[source_column].tolist()):
+                if source_i not in uploaded_sources:
+                    uploaded_sources.add(source_i)
+                    corpus_sources.append({'source': source_i})
+                    corpus_texts.append(text_i)
 
-        corpus_sources = [{'source': source_i} for source_i in corpus_sources]
-    
-        start = time.time()
-        for batch_i in range(0, len(corpus_texts), upload_batch_size):
-            documents = resource_preprocessing.create_split_documents(corpus_texts[batch_i:batch_i+upload_batch_size], corpus_sources[batch_i:batch_i+upload_batch_size], embedder)
-            documents_texts = [document_i['page_content'] for document_i in documents]
-            documents_metadata = [{'source': document_i['metadata']['source'], 'page_content': document_i['page_content']} for document_i in documents]
-            len_chunks+=len(documents_texts)
+            while len(corpus_texts) >= batch_size:
+                yield resource_file.name, batch_idx, corpus_texts[:batch_size], corpus_sources[:batch_size]
+                corpus_texts = corpus_texts[batch_size:]
+                corpus_sources = corpus_sources[batch_size:]
+                batch_idx += 1
 
-            documents_texts_embeddings = embedder.encode(documents_texts, batch_size=256, device='cuda', convert_to_tensor=True)
-            documents_texts_embeddings = documents_texts_embeddings.cpu().numpy()
+        if len(corpus_texts) > 0:
+            yield resource_file.name, batch_idx, corpus_texts, corpus_sources
 
-            qdrantdb_client.upload_collection(
-                collection_name=collection_name,
-                ids=None,
-                payload=documents_metadata,
-                vectors=documents_texts_embeddings
-            )
 
-        end = time.time()
-        print("Finished | Time required: ", end - start)
+def _skip_existing_sources(batches, qdrantdb_client, collection_name):
+    for file_name, batch_idx, corpus_texts, corpus_sources in batches:
+        stored_sources = existing_sources(qdrantdb_client, collection_name, [source_i['source'] for source_i in corpus_sources])
+        new_idxs = [idx for idx, source_i in enumerate(corpus_sources) if source_i['source'] not in stored_sources]
+        yield file_name, batch_idx, [corpus_texts[idx] for idx in new_idxs], [corpus_sources[idx] for idx in new_idxs]
+
+
+@metrics.timed('ingest_step_seconds', step='split')
+def _split_batch(batch, embedder, split_overlap):
+    file_name, batch_idx, corpus_texts, corpus_sources = batch
+    documents = resource_preprocessing.create_split_documents(corpus_texts, corpus_sources, embedder, overlap=split_overlap) if corpus_texts != [] else []
+
+    #number the chunks of each source
+    chunk_counts = defaultdict(int)
+    for document_i in documents:
+        document_i['chunk_idx'] = chunk_counts[document_i['metadata']['source']]
+        chunk_counts[document_i['metadata']['source']] += 1
+
+    return {'file_name': file_name, 'batch_idx': batch_idx, 'n_texts': len(corpus_texts), 'documents': documents}
 
+
+@metrics.timed('encode_seconds', model='search_embedder', purpose='ingest')
+def _encode_batch(split_batch, embedder):
+    if split_batch['documents'] == []:
+        split_batch['embeddings'] = None
+        return split_batch
+    #the embedder encodes on the device it was loaded on; page_content is only decoded for the payload
+    split_batch['embeddings'] = resource_preprocessing.encode_split_documents(split_batch['documents'], embedder, batch_size=256)
+    return split_batch
+
+
+@metrics.timed('ingest_step_seconds', step='upload')
+def _upload_batch(encoded_batch, qdrantdb_client, collection_name):
+    if encoded_batch['documents'] == []:
+        return
+    #first chunks last: existing_sources treats a source with a stored first chunk as complete
+    order = sorted(range(len(encoded_batch['documents'])), key=lambda idx: encoded_batch['documents'][idx]['chunk_idx'] == 0)
+    documents = [encoded_batch['documents'][idx] for idx in order]
+    documents_metadata = [{'source': document_i['metadata']['source'], 'page_content': document_i['page_content']} for document_i in documents]
+    qdrantdb_client.upload_collection(
+        collection_name=collection_name,
+        ids=[point_id(document_i['metadata']['source'], document_i['chunk_idx']) for document_i in documents],
+        payload=documents_metadata,
+        vectors=np.asarray(encoded_batch['embeddings'])[order],
+        parallel=1,
+    )
+
+
+def _pipeline_stage(fn, input_iter, output_queue, errors, drain_input):
+    #Runs fn on every input in a background thread and hands the results over through a bounded queue, ending with None.
+    #After an error in any stage the remaining inputs are skipped. Queue inputs are drained so that their producer never blocks.
+    def run():
+        try:
+            for item in input_iter:
+                if errors != []:
+                    if drain_input == True:
+                        continue
+                    break
+                output_queue.put(fn(item))
+        except BaseException as error:
+            errors.append(error)
+            if drain_input == True:
+                for _ in input_iter:
+                    pass
+        finally:
+            output_queue.put(None)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _iter_queue(input_queue):
+    while True:
+        item = input_queue.get()
+        if item is None:
+            return
+        yield item
+
+
+class IngestStats:
+    def __init__(self):
+        self.start = time.time()
+        self.n_texts = 0
+        self.n_chunks = 0
+
+    def add(self, n_texts, n_chunks):
+        self.n_texts += n_texts
+        self.n_chunks += n_chunks
+
+    def report(self, prefix):
+        elapsed = max(time.time() - self.start, 1e-9)
+        print(f'{prefix} | Time required: {elapsed:.1f}s | {self.n_texts / elapsed:.1f} texts/s | {self.n_chunks / elapsed:.1f} chunks/s')
+
+
+@metrics.timed('stage_seconds', stage='create_db_collection')
+def create_db_collection(path_resources, source_column, text_column, qdrantdb_client, collection_name, embedder, cross_dataset_preprocess, streaming=False, batch_size=100000, read_chunk_size=50000, max_queued_batches=2, incremental=False, checkpoint_path=None, split_overlap=0, profile=None):
+    """Embeds the texts of all .jsonl/.pkl files in path_resources and uploads them to a new collection.
+
+    With streaming=True, .jsonl files are read in chunks of read_chunk_size rows, and splitting, encoding and uploading
+    run as overlapping stages connected by queues of at most max_queued_batches batches. Peak memory is then bounded by
+    roughly read_chunk_size rows plus (2 * max_queued_batches + 3) batches of batch_size texts.
+
+    With incremental=True, the collection is kept (or created if missing), sources that are already stored are skipped
+    and only new ones are upserted. Progress is checkpointed per file and batch in checkpoint_path, so that an
+    interrupted ingest resumes after the last uploaded batch, unless the file changed meanwhile. The checkpoint is
+    removed once the ingest completes.
+
+    Texts longer than the embedder's maximum sequence length are split into chunks that share split_overlap tokens.
+    A new collection is created with the settings of profile (see collection_profile).
+    """
+    file_signatures = {resource_file.name: file_signature(resource_file.path) for resource_file in os.scandir(path_resources)}
+    checkpoint = IngestCheckpoint(checkpoint_path if incremental == True else None, collection_name, batch_size, file_signatures)
+    if incremental == True:
+        print(f'Update {collection_name}')
+        ensure_db(qdrantdb_client, collection_name, embedder, profile)
+    else:
+        print(f'Create {collection_name}')
+        recreate_db(qdrantdb_client, collection_name, embedder, profile)
+
+    uploaded_sources = set()
+    stats = IngestStats()
+
+    batches = _iter_resource_batches(path_resources, source_column, text_column, cross_dataset_preprocess, batch_size, read_chunk_size if streaming == True else None, uploaded_sources)
+    batches = (batch for batch in batches if not checkpoint.is_done(batch[0], batch[1]))
+    if incremental == True:
+        batches = _skip_existing_sources(batches, qdrantdb_client, collection_name)
+
+    if streaming == True:
+        errors = []
+        split_queue = queue.Queue(maxsize=max_queued_batches)
+        upload_queue = queue.Queue(maxsize=max_queued_batches)
+
+        def upload(encoded_batch):
+            _upload_batch(encoded_batch, qdrantdb_client, collection_name)
+            checkpoint.mark_done(encoded_batch['file_name'], encoded_batch['batch_idx'])
+            stats.add(encoded_batch['n_texts'], len(encoded_batch['documents']))
+            stats.report(f"{encoded_batch['file_name']} batch {encoded_batch['batch_idx']}")
+
+        #tokenization/splitting and upload run in background threads while the GPU encodes in this thread
+        split_thread = _pipeline_stage(lambda batch: _split_batch(batch, embedder, split_overlap), batches, split_queue, errors, drain_input=False)
+        upload_thread = _pipeline_stage(upload, _iter_queue(upload_queue), queue.Queue(), errors, drain_input=True)
+        try:
+            for split_batch in _iter_queue(split_queue):
+                if errors != []:
+                    continue
+                try:
+                    upload_queue.put(_encode_batch(split_batch, embedder))
+                except BaseException as error:
+                    errors.append(error)
+        finally:
+            upload_queue.put(None)
+            upload_thread.join()
+            split_thread.join()
+        if errors != []:
+            raise errors[0]
+    else:
+        for batch in batches:
+            encoded_batch = _encode_batch(_split_batch(batch, embedder, split_overlap), embedder)
+            _upload_batch(encoded_batch, qdrantdb_client, collection_name)
+            checkpoint.mark_done(encoded_batch['file_name'], encoded_batch['batch_idx'])
+            stats.add(encoded_batch['n_texts'], len(encoded_batch['documents']))
+            stats.report(f"{encoded_batch['file_name']} batch {encoded_batch['batch_idx']}")
+
+    from qdrant_client import models
     qdrantdb_client.update_collection(
         collection_name=collection_name,
         optimizer_config=models.OptimizersConfigDiff(indexing_threshold=20000),
         )
 
+    stats.report('Finished')
+    checkpoint.complete()
     print(f'{collection_name} uploaded')
-    print(f'Length texts and chunks: {len(uploaded_sources)} | {len_chunks}')
+    print(f'Length texts and chunks: {len(uploaded_sources)} | {stats.n_chunks}')
 
 
 ###
 
-def search_kb(query, qdrantdb_client, collection_name, embedder, limit_results):
+def search_kb(query, qdrantdb_client, collection_name, embedder, limit_results, profile=None):
     vector = embedder.encode(query).tolist()
 
-    search_results = qdrantdb_client.search(
-        collection_name=collection_name,
-        query_vector=vector,
-        limit=limit_results,
-    )
+    with metrics.timer('external_call_seconds', service='qdrant_search'):
+        search_results = qdrantdb_client.search(
+            collection_name=collection_name,
+            query_vector=vector,
+            limit=limit_results,
+            search_params=search_params(profile),
+        )
 
     search_results = [search_result.payload for search_result in search_results]
     
-    return search_results
\ No newline at end of file
+    return search_results
+
+
+def search_kb_batch(queries, qdrantdb_client, collection_name, embedder, limit_results, query_vectors=None, search_batch_size=64, profile=None):
+    """Searches the collection for several queries at once and returns the payloads per query, in the format of search_kb."""
+    if len(queries) == 0:
+        return []
+    if query_vectors is None:
+        query_vectors = embedder.encode(queries)
+
+    from qdrant_client import models
+    params = search_params(profile)
+    search_requests = [models.SearchRequest(vector=vector.tolist(), limit=limit_results, with_payload=True, params=params) for vector in query_vectors]
+
+    search_results = []
+    for batch_i in range(0, len(search_requests), search_batch_size):
+        with metrics.timer('external_call_seconds', service='qdrant_search_batch'):
+            search_results.extend(qdrantdb_client.search_batch(
+                collection_name=collection_name,
+                requests=search_requests[batch_i:batch_i+search_batch_size],
+            ))
+
+    return [[search_result.payload for search_result in query_results] for query_results in search_results]
@@ -0,0 +1,96 @@
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from config import config_params
+from processing_utils import resource_preprocessing
+
+
+class StreamingSuggestionRunner:
+    """Runs the suggestion pipeline of a SuggestionEngine over a stream of feedback records in micro-batches.
+
+    Records are mappings (e.g., dicts or DataFrame rows) with a source and a text column. Each micro-batch passes
+    through all stages of the engine before the next one is clustered, so memory is bounded by the micro-batch size
+    instead of the length of the stream. The weaknesses of the next micro-batch are identified while the current one
+    is clustered and its suggestions are generated.
+
+    run() yields one dict per feedback with 'feedback_id', 'feedback_text', 'weaknesses', 'suggestions' and 'answer'.
+    Feedback without weaknesses is yielded directly after identification, all other feedback as soon as the
+    suggestions of its micro-batch are generated. Clusters only span one micro-batch unless the engine clusters
+    incrementally (config 'incremental_clustering'), which assigns weaknesses to the clusters of earlier micro-batches.
+    """
+
+    def __init__(self, engine, source_column, text_column, micro_batch_size=None, cross_dataset_preprocess=True, cluster_min_size=1, cluster_threshold=0.65, cluster_max_examples=10, limit_results_retrieve=None, limit_results_rerank=None):
+        self.engine = engine
+        self.source_column = source_column
+        self.text_column = text_column
+        self.micro_batch_size = micro_batch_size if micro_batch_size is not None else config_params["streaming_micro_batch_size"]
+        self.cross_dataset_preprocess = cross_dataset_preprocess
+        self.cluster_min_size = cluster_min_size
+        self.cluster_threshold = cluster_threshold
+        self.cluster_max_examples = cluster_max_examples
+        self.limit_results_retrieve = limit_results_retrieve if limit_results_retrieve is not None else config_params["limit_results_retrieve"]
+        self.limit_results_rerank = limit_results_rerank if limit_results_rerank is not None else config_params["limit_results_rerank"]
+
+    def _feedback_batches(self, records):
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == self.micro_batch_size:
+                yield self._to_feedback(batch)
+                batch = []
+        if batch != []:
+            yield self._to_feedback(batch)
+
+    def _to_feedback(self, records):
+        feedback = pd.DataFrame({'feedback_id': [record[self.source_column] for record in records], 'feedback_text': [record[self.text_column] for record in records]})
+        if self.cross_dataset_preprocess == True:
+            feedback = resource_preprocessing.cross_dataset_preprocessing(feedback, 'feedback_text', 'feedback_id')
+        return feedback
+
+    def _identify_next(self, feedback_batches):
+        #runs in the identification thread, which also waits for the stream to fill the next micro-batch
+        feedback = next(feedback_batches, None)
+        if feedback is None:
+            return None
+        return feedback, self.engine._identify_weaknesses(feedback)
+
+    def _identified_batches(self, feedback_batches):
+        #at most one micro-batch is identified ahead of the one being processed
+        identification_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="identification")
+        try:
+            next_identified = identification_pool.submit(self._identify_next, feedback_batches)
+            while True:
+                identified = next_identified.result()
+                if identified is None:
+                    return
+                next_identified = identification_pool.submit(self._identify_next, feedback_batches)
+                yield identified
+        finally:
+            #a consumer that stops early must not wait for the stream to deliver another micro-batch
+            identification_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _emit(self, feedback_weakness_batch):
+        for feedback_id, feedback_text, weaknesses, suggestions, answer in feedback_weakness_batch[['feedback_id', 'feedback_text', 'weaknesses', 'suggestions', 'answer']].values.tolist():
+            yield {'feedback_id': feedback_id, 'feedback_text': feedback_text, 'weaknesses': weaknesses, 'suggestions': suggestions, 'answer': answer}
+
+    def _generate(self, feedback, feedback_weakness_batch, weakness_cluster_batch):
+        engine = self.engine
+        engine.feedback = feedback
+        engine.feedback_weakness_batch = feedback_weakness_batch.reset_index(drop=True)
+        engine.weakness_cluster_batch = weakness_cluster_batch
+        engine.weaknesses_clustering(cluster_min_size=self.cluster_min_size, cluster_threshold=self.cluster_threshold)
+        engine.cluster_query_generation(cluster_max_examples=self.cluster_max_examples)
+        engine.cluster_suggestion_generation(limit_results_retrieve=self.limit_results_retrieve, limit_results_rerank=self.limit_results_rerank)
+        return engine.feedback_answer_generation()
+
+    def run(self, records):
+        """Processes an iterable of feedback records and yields the answer of every feedback."""
+        for feedback, (feedback_weakness_batch, weakness_cluster_batch) in self._identified_batches(self._feedback_batches(iter(records))):
+            has_weaknesses = feedback_weakness_batch['weaknesses'].map(len) > 0
+
+            without_weaknesses = feedback_weakness_batch[~has_weaknesses].copy()
+            without_weaknesses['suggestions'] = [[] for _ in range(without_weaknesses.shape[0])]
+            without_weaknesses['answer'] = 'N/A'
+            yield from self._emit(without_weaknesses)
+
+            if weakness_cluster_batch.shape[0] > 0:
+                yield from self._emit(self._generate(feedback, feedback_weakness_batch[has_weaknesses], weakness_cluster_batch))
@@ -2,46 +2,252 @@ import json
 import numpy as np
 import os
 import pandas as pd
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from config import config_params
 from generation_templates import answer_generation_template
 from generation_templates import query_generation_template
 from generation_templates import suggestion_identification_template
 from generation_templates import weakness_identification_template
-from googleapiclient.discovery import build
 from itertools import chain
 from openai import OpenAI
+from processing_utils import batch_jobs
+from processing_utils import cluster_store
+from processing_utils import clustering
+from processing_utils import cpu_backend
+from processing_utils import deduplication
+from processing_utils import embedding_cache
+from processing_utils import http_utils
+from processing_utils import llm_cache
+from processing_utils import llm_executor
+from processing_utils import metrics
+from processing_utils import paper_cache
+from processing_utils import postprocessing
+from processing_utils import query_cache
+from processing_utils import reranking
 from processing_utils import resource_preprocessing
 from processing_utils import retrieval_processing
-from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer
-from sentence_transformers import util
-from sentence_transformers.cross_encoder import CrossEncoder
+from processing_utils import vector_db
 
 
 
+def resolve_device(device):
+    """Maps the 'auto' device setting to 'cuda' if a GPU is available and to 'cpu' otherwise."""
+    if device != 'auto':
+        return device
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+#stages whose LLM requests can be deferred to batch jobs
+BATCH_STAGES = ('weaknesses_identification', 'cluster_query_generation', 'feedback_answer_generation')
+#retrieval tiers in order of cost, with their sources; the paper full texts replace the abstracts
+RETRIEVAL_TIERS = (('local', ('tweets', 'abstracts')), ('papers', ('papers',)), ('web', ('web',)))
+
+
+class _LazyComponent:
+    """Engine attribute that is created by the engine's _create_<name> method on first access.
+
+    Creation is guarded by a per-attribute lock, so concurrent stages (e.g., the retrieval threads) create it once.
+    Assigning the attribute replaces the instance, e.g., to inject a preloaded model or a test client.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, engine, owner=None):
+        if engine is None:
+            return self
+        component = engine._components.get(self.name)
+        if component is None:
+            with engine._component_lock(self.name):
+                component = engine._components.get(self.name)
+                if component is None:
+                    component = getattr(engine, f'_create_{self.name}')()
+                    engine._components[self.name] = component
+        return component
+
+    def __set__(self, engine, component):
+        with engine._component_lock(self.name):
+            engine._components[self.name] = component
+
+
 class SuggestionEngine:
-    """Identifies process weaknesses described in texts (e.g., tweets) and generates improvement suggestions using knowledge resources."""
+    """Identifies process weaknesses described in texts (e.g., tweets) and generates improvement suggestions using knowledge resources.
+
+    Models and clients are created on first use, so that stages which do not need them (e.g., weakness identification
+    or ingestion) neither load them nor import their libraries.
+    """
+
+    search_embedder = _LazyComponent()
+    cluster_embedder = _LazyComponent()
+    cross_encoder = _LazyComponent()
+    websearch_service = _LazyComponent()
+    openAI_client = _LazyComponent()
+    qdrantdb_client = _LazyComponent()
+    reranker = _LazyComponent()
+    query_cache = _LazyComponent()
 
     def __init__(self):
-        self.search_embedder = SentenceTransformer(config_params["search_embedding_model"], device="cuda")
-        self.cluster_embedder = SentenceTransformer(config_params["cluster_embedding_model"], device="cuda")
-        self.cross_encoder = CrossEncoder(f"cross-encoder/{config_params['cross_encoder_model']}", device="cuda")
+        self._components = {}
+        self._component_locks = {}
+        self._component_locks_lock = threading.Lock()
+
+        if config_params["metrics_enabled"] == True:
+            metrics.enable()
 
         self.GOOGLE_CSE_ID = config_params["GOOGLE_CSE_ID"]
         self.GOOGLE_API_KEY = config_params["GOOGLE_API_KEY"]
-        self.websearch_service = build("customsearch", "v1", developerKey=self.GOOGLE_API_KEY)
 
         self.generative_model = config_params["generative_model"]
+        self.weakness_pack_size = config_params["weakness_pack_size"]
+        self.weakness_pack_max_tokens = config_params["weakness_pack_max_tokens"]
+        self.feedback_dedup_threshold = config_params["feedback_dedup_threshold"]
+        self.batch_max_requests = config_params["batch_max_requests"]
+        self.batch_max_bytes = int(config_params["batch_max_file_mb"] * 1024**2)
         os.environ["OPENAI_API_KEY"] = config_params["openai_api_key"]
-        self.openAI_client = OpenAI()
+        self.llm_executor = llm_executor.LLMExecutor(
+            max_concurrency=config_params["llm_max_concurrency"],
+            requests_per_minute=config_params["llm_requests_per_minute"],
+            tokens_per_minute=config_params["llm_tokens_per_minute"],
+            max_retries=config_params["llm_max_retries"],
+        )
+        self.completion_cache = llm_cache.CompletionCache(
+            config_params["llm_cache_path"],
+            max_size_bytes=config_params["llm_cache_max_size_mb"] * 1024**2,
+            enabled=config_params["llm_cache_enabled"],
+        )
 
         self.grobid_url_setting = '%s/api/processFulltextDocument' % config_params["GROBID_URL"]
+        self.paper_cache = paper_cache.PaperCache(config_params["paper_cache_path"], config_params["paper_unavailable_ttl"])
+        self.paper_max_workers = config_params["paper_max_workers"]
+        self.robots_cache = http_utils.configure_robots_cache(config_params["robots_cache_ttl"], config_params["robots_cache_path"], config_params["robots_failure_ttl"])
 
         self.scholar_x_api_key = config_params["scholar_x_api_key"]
-        self.qdrantdb_client = QdrantClient(host=config_params["qdrant_host"], grpc_port=config_params["qdrant_grpc_port"], prefer_grpc=True)
+        self.scholar_url = config_params["semantic_scholar_url"]
+        self.split_overlap = config_params["split_overlap_tokens"]
+        self.adaptive_retrieval = config_params["adaptive_retrieval"]
+        self.adaptive_retrieval_min_score = config_params["adaptive_retrieval_min_score"]
+        self.adaptive_retrieval_min_results = config_params["adaptive_retrieval_min_results"]
+
+        self.clustering_backend = config_params["clustering_backend"]
+        self.clustering_max_neighbours = config_params["clustering_max_neighbours"]
+        self.incremental_clustering = config_params["incremental_clustering"]
+        self.cluster_collection_name = config_params["cluster_collection"]
+        self.known_clusters = {}
 
         self.abstract_collection_name = config_params["abstract_collection"]
         self.tweet_collection_name = config_params["tweet_collection"]
+        self.query_cache_enabled = config_params["query_cache_enabled"]
+        self.query_cache_threshold = config_params["query_cache_threshold"]
+        self.collection_profile = vector_db.collection_profile(config_params["collection_profiles"][config_params["collection_profile"]])
+
+        #a source that times out keeps its worker busy until it returns, so the pool holds more than one query's worth of workers
+        self.retrieval_pool = ThreadPoolExecutor(max_workers=config_params["retrieval_max_workers"], thread_name_prefix="retrieval")
+        self.prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self.retrieval_timeouts = {
+            'tweets': config_params["retrieval_timeout_tweets"],
+            'abstracts': config_params["retrieval_timeout_abstracts"],
+            'papers': config_params["retrieval_timeout_papers"],
+            'web': config_params["retrieval_timeout_web"],
+        }
+
+
+    def _component_lock(self, name):
+        with self._component_locks_lock:
+            return self._component_locks.setdefault(name, threading.Lock())
+
+
+    def _create_embedder(self, model_name, device):
+        device = resolve_device(device)
+        backend = config_params["cpu_backend"] if device == 'cpu' else 'fp32'
+        if device == 'cpu':
+            embedder = cpu_backend.load_sentence_transformer(model_name, backend, config_params["cpu_threads"], config_params["cpu_onnx_int8_file_name"])
+        else:
+            from sentence_transformers import SentenceTransformer
+            embedder = SentenceTransformer(model_name, device=device)
+        #the same weaknesses and queries are encoded again in every run, so their embeddings are cached on disk
+        if config_params["embedding_cache_enabled"] == True:
+            embedder = self._cached_embedder(embedder, cpu_backend.cache_name(model_name, backend))
+        return embedder
+
+
+    def _create_search_embedder(self):
+        return self._create_embedder(config_params["search_embedding_model"], config_params["search_embedding_device"])
+
+
+    def _create_cluster_embedder(self):
+        return self._create_embedder(config_params["cluster_embedding_model"], config_params["cluster_embedding_device"])
+
+
+    def _create_cross_encoder(self):
+        device = resolve_device(config_params["cross_encoder_device"])
+        model_name = f"cross-encoder/{config_params['cross_encoder_model']}"
+        if device == 'cpu':
+            return cpu_backend.load_cross_encoder(model_name, config_params["cpu_backend"], config_params["cpu_threads"], config_params["cpu_onnx_int8_file_name"])
+        from sentence_transformers.cross_encoder import CrossEncoder
+        cross_encoder = CrossEncoder(model_name, device=device)
+        if config_params["cross_encoder_fp16"] == True and device.startswith('cuda'):
+            cross_encoder.model.half()
+        return cross_encoder
+
+
+    def _create_websearch_service(self):
+        from googleapiclient.discovery import build
+        return build("customsearch", "v1", developerKey=self.GOOGLE_API_KEY)
+
+
+    def _create_openAI_client(self):
+        #retries are handled by the executor so that they count against the rate limits
+        return OpenAI(max_retries=0)
+
+
+    def _create_qdrantdb_client(self):
+        from qdrant_client import QdrantClient
+        return QdrantClient(host=config_params["qdrant_host"], grpc_port=config_params["qdrant_grpc_port"], prefer_grpc=True)
+
+
+    def _create_reranker(self):
+        return reranking.Reranker(
+            self.cross_encoder,
+            batch_size=config_params["rerank_batch_size"],
+            prefilter_embedder=self.search_embedder if config_params["rerank_prefilter_limit"] else None,
+            prefilter_limit=config_params["rerank_prefilter_limit"],
+            cache_size=config_params["rerank_cache_size"],
+        )
+
+
+    def _create_query_cache(self):
+        return query_cache.SemanticQueryCache(self.qdrantdb_client, config_params["query_cache_collection"], self.search_embedder.get_sentence_embedding_dimension(), self.query_cache_threshold, config_params["query_cache_ttl"])
+
+
+    def _cached_embedder(self, embedder, model_name):
+        cache = embedding_cache.EmbeddingCache(config_params["embedding_cache_path"], model_name, embedder.get_sentence_embedding_dimension(), max_entries=config_params["embedding_cache_max_entries"])
+        return embedding_cache.CachedEmbedder(embedder, cache)
+
+
+    def cache_stats(self):
+        """Returns the hit rates of the completion, paper, robots.txt, embedding and query caches."""
+        stats = {
+            'completions': self.completion_cache.stats(),
+            'papers': self.paper_cache.stats(),
+            'robots': self.robots_cache.stats(),
+        }
+        #embedders that were not loaded yet have no cache statistics
+        for name, embedder in [('search_embeddings', self._components.get('search_embedder')), ('cluster_embeddings', self._components.get('cluster_embedder'))]:
+            if isinstance(embedder, embedding_cache.CachedEmbedder):
+                stats[name] = embedder.cache.stats()
+        if self._components.get('query_cache') is not None:
+            stats['queries'] = self._components['query_cache'].stats()
+        return stats
+
+
+    def write_metrics(self):
+        """Writes the metrics recorded so far to the configured JSON (and Prometheus) files and returns the summary."""
+        metrics.write_summary(config_params["metrics_path"], config_params["metrics_prometheus_path"])
+        return metrics.summary()
 
 
     def load_feedback(self, feedback, source_column, text_column, cross_dataset_preprocess):
@@ -50,31 +256,75 @@ class SuggestionEngine:
             self.feedback = resource_preprocessing.cross_dataset_preprocessing(self.feedback, 'feedback_text', 'feedback_id')
 
 
-    def _zero_shot_response(self, user_prompt, system_prompt):
+    def _request_body(self, messages):
+        return {
+            "model": self.generative_model,
+            "response_format": { "type": "json_object" },
+            "messages": messages,
+            "temperature": 0,
+        }
+
+
+    def _request_key(self, body):
+        return llm_cache.completion_key(body["model"], body["messages"], body["response_format"])
+
+
+    def _chat_completion(self, messages):
+        body = self._request_body(messages)
+
+        #all requests use temperature=0, so identical requests can be answered from the cache
+        cache_key = self._request_key(body)
+        content = self.completion_cache.get(cache_key)
+        if self.completion_cache.enabled:
+            metrics.cache_access('completions', content is not None)
+        if content is not None:
+            return content
+
+        response = self.llm_executor.call(lambda: self.openAI_client.chat.completions.create(**body), messages)
+        content = response.choices[0].message.content
+        self.completion_cache.put(cache_key, content)
+        return content
+
+
+    def _zero_shot_messages(self, user_prompt, system_prompt):
         messages = []
         messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": user_prompt})
-        
-        response = self.openAI_client.chat.completions.create(
-            model=self.generative_model,
-            response_format={ "type": "json_object" },
-            messages=messages,
-            temperature=0,
-        )
-        return response
-    
+        return messages
 
-    def _few_shot_response(self, user_prompt, few_shot_prompts):
+
+    def _few_shot_messages(self, user_prompt, few_shot_prompts):
         messages = list(few_shot_prompts)
         messages.append({"role": "user", "content": user_prompt})
-        
-        response = self.openAI_client.chat.completions.create(
-            model=self.generative_model,
-            response_format={ "type": "json_object" },
-            messages=messages,
-            temperature=0,
-        )
-        return response
+        return messages
+
+
+    def _zero_shot_response(self, user_prompt, system_prompt):
+        return self._chat_completion(self._zero_shot_messages(user_prompt, system_prompt))
+    
+
+    def _few_shot_response(self, user_prompt, few_shot_prompts):
+        return self._chat_completion(self._few_shot_messages(user_prompt, few_shot_prompts))
+
+
+    def _response_field(self, response, field, default):
+        #failed requests are returned as exceptions by the executor and end up here as well
+        try:
+            value = json.loads(response)[field]
+        except:
+            #failed requests were already counted by the executor
+            if not isinstance(response, Exception):
+                metrics.failure('llm_response')
+            return default
+        #a parseable response can still hold a value of the wrong type, e.g. null; lists must hold strings
+        if isinstance(default, list):
+            valid = isinstance(value, list) and all(isinstance(value_i, str) for value_i in value)
+        else:
+            valid = isinstance(value, str)
+        if not valid:
+            metrics.failure('llm_response')
+            return default
+        return value
 
 
     def _format_context(self, context):
@@ -82,184 +332,516 @@ class SuggestionEngine:
         return context
 
 
-    def weaknesses_identification(self):
-        """Identifies the process weaknesses described in the provided feedback."""
-
-        corpus_feedback_batch = self.feedback.values.tolist()
+    def _weakness_packs(self, corpus_feedback_batch):
+        #consecutive feedback is packed until the pack size or the token budget is reached; ids must be unique within a pack
+        packs = []
+        pack = []
+        pack_ids = set()
+        pack_tokens = 0
+        for idx, feedback_i in enumerate(corpus_feedback_batch):
+            tokens = llm_executor.estimate_tokens([{"content": feedback_i[1]}])
+            if pack != [] and (len(pack) == self.weakness_pack_size or pack_tokens + tokens > self.weakness_pack_max_tokens or str(feedback_i[0]) in pack_ids):
+                packs.append(pack)
+                pack = []
+                pack_ids = set()
+                pack_tokens = 0
+            pack.append(idx)
+            pack_ids.add(str(feedback_i[0]))
+            pack_tokens += tokens
+        if pack != []:
+            packs.append(pack)
+        return packs
+
+
+    def _packed_weaknesses(self, response, feedback_ids):
+        #weaknesses per feedback_id of the pack; ids that are missing or malformed in the response are left out
+        try:
+            answered = json.loads(response)['process_weaknesses']
+        except:
+            if not isinstance(response, Exception):
+                metrics.failure('llm_response')
+            return {}
+        if not isinstance(answered, dict):
+            metrics.failure('llm_response')
+            return {}
+
+        weaknesses = {}
+        for feedback_id in feedback_ids:
+            weaknesses_i = answered.get(str(feedback_id))
+            if isinstance(weaknesses_i, list) and all(isinstance(weakness_i, str) for weakness_i in weaknesses_i):
+                weaknesses[str(feedback_id)] = weaknesses_i
+        return weaknesses
+
+
+    def _feedback_representatives(self, corpus_feedback_batch):
+        #index of the feedback whose weaknesses each feedback shares, itself unless it is a near duplicate of earlier feedback
+        #fewer than two feedbacks have no duplicates (and an empty text column would not be a string column)
+        if self.feedback_dedup_threshold is None or len(corpus_feedback_batch) < 2:
+            return np.arange(len(corpus_feedback_batch))
+        texts = resource_preprocessing.rm_links_handles(pd.DataFrame({'text': [feedback_i[1] for feedback_i in corpus_feedback_batch]}), 'text')['text_clean'].to_list()
+        representatives = deduplication.near_duplicate_groups(texts, self.feedback_dedup_threshold)
+        metrics.increment('feedback_near_duplicates_total', int(np.sum(representatives != np.arange(len(representatives)))))
+        return representatives
+
+
+    def _fan_out_weaknesses(self, representatives, representative_idxs, representative_weaknesses):
+        weaknesses_by_representative = dict(zip(representative_idxs, representative_weaknesses))
+        return [list(weaknesses_by_representative[representative]) for representative in representatives]
+
+
+    def _identify_weaknesses(self, feedback):
+        #does not modify the engine, so that the streaming runner can identify the weaknesses of the next micro-batch meanwhile
+        corpus_feedback_batch = feedback.values.tolist()
+
+        #Near-duplicate feedback (retweets, copy-pasted complaints) is identified once, through its group's representative
+        representatives = self._feedback_representatives(corpus_feedback_batch)
+        representative_idxs = np.unique(representatives)
+        representative_weaknesses = self._identify_process_weaknesses([corpus_feedback_batch[idx] for idx in representative_idxs])
+
+        process_weaknesses = self._fan_out_weaknesses(representatives, representative_idxs, representative_weaknesses)
+        return self._assemble_weaknesses(corpus_feedback_batch, process_weaknesses)
+
+
+    def _identify_process_weaknesses(self, corpus_feedback_batch):
+        process_weaknesses = [None for _ in corpus_feedback_batch]
+
+        #Packed requests: the system prompt, schema and few-shot examples are sent once for several tweets
+        if self.weakness_pack_size > 1:
+            packs = [pack for pack in self._weakness_packs(corpus_feedback_batch) if len(pack) > 1]
+            packed_user_prompt_template = weakness_identification_template.get_packed_user_prompt_template()
+            packed_system_few_shot_prompts = weakness_identification_template.get_packed_system_few_shot_prompts()
+            packed_user_prompts = []
+            for pack in packs:
+                prompt_feedback = weakness_identification_template.format_packed_feedback([corpus_feedback_batch[idx][0] for idx in pack], [corpus_feedback_batch[idx][1] for idx in pack])
+                packed_user_prompts.append(packed_user_prompt_template.format(prompt_feedback = prompt_feedback))
+
+            responses = self.llm_executor.map(lambda user_prompt_i: self._few_shot_response(user_prompt_i, packed_system_few_shot_prompts), packed_user_prompts)
+            for pack, response in zip(packs, responses):
+                answered = self._packed_weaknesses(response, [corpus_feedback_batch[idx][0] for idx in pack])
+                for idx in pack:
+                    process_weaknesses[idx] = answered.get(str(corpus_feedback_batch[idx][0]))
+                metrics.increment('weakness_pack_fallbacks_total', len(pack) - len(answered))
+
+        #Single requests: all feedback if packing is off, feedback left alone in its pack and feedback the packed responses missed
+        single_idxs = [idx for idx, process_weaknesses_i in enumerate(process_weaknesses) if process_weaknesses_i is None]
+        responses = self.llm_executor.map(self._chat_completion, self._weakness_requests(corpus_feedback_batch, single_idxs))
+        for idx, response in zip(single_idxs, responses):
+            process_weaknesses[idx] = self._response_field(response, 'process_weaknesses', [])
+
+        return process_weaknesses
+
+
+    def _weakness_requests(self, corpus_feedback_batch, idxs):
         user_prompt_template = weakness_identification_template.get_user_prompt_template()
-        user_prompts = [user_prompt_template.format(prompt_feedback = feedback_i[1]) for feedback_i in corpus_feedback_batch]
         system_few_shot_prompts = weakness_identification_template.get_system_few_shot_prompts()
+        return [self._few_shot_messages(user_prompt_template.format(prompt_feedback = corpus_feedback_batch[idx][1]), system_few_shot_prompts) for idx in idxs]
 
+
+    def _assemble_weaknesses(self, corpus_feedback_batch, process_weaknesses):
         weaknesses_batch = []
-        for idx, user_prompt_i in enumerate(user_prompts):
-            try:
-                response = self._few_shot_response(user_prompt_i, system_few_shot_prompts)
-                response = json.loads(response.choices[0].message.content)
-                process_weaknesses = response['process_weaknesses']
-                for process_weakness_i in process_weaknesses:
-                    weaknesses_batch.append([corpus_feedback_batch[idx][0], process_weakness_i])
-                corpus_feedback_batch[idx].append(process_weaknesses)
-            except:
-                corpus_feedback_batch[idx].append([])
-
-        self.feedback_weakness_batch = pd.DataFrame(corpus_feedback_batch, columns=['feedback_id', 'feedback_text', 'weaknesses'])
-        self.weakness_cluster_batch = pd.DataFrame(weaknesses_batch, columns=['feedback_id', 'weakness'])
+        for idx, process_weaknesses_i in enumerate(process_weaknesses):
+            for process_weakness_i in process_weaknesses_i:
+                weaknesses_batch.append([corpus_feedback_batch[idx][0], process_weakness_i])
+            corpus_feedback_batch[idx].append(process_weaknesses_i)
+
+        feedback_weakness_batch = pd.DataFrame(corpus_feedback_batch, columns=['feedback_id', 'feedback_text', 'weaknesses'])
+        weakness_cluster_batch = pd.DataFrame(weaknesses_batch, columns=['feedback_id', 'weakness'])
+        return feedback_weakness_batch, weakness_cluster_batch
+
+
+    @metrics.timed('stage_seconds', stage='weaknesses_identification')
+    def weaknesses_identification(self):
+        """Identifies the process weaknesses described in the provided feedback."""
+
+        self.feedback_weakness_batch, self.weakness_cluster_batch = self._identify_weaknesses(self.feedback)
         return self.feedback_weakness_batch, self.weakness_cluster_batch
 
 
+    def _detect_clusters(self, corpus_weakness_embeddings, cluster_min_size, cluster_threshold):
+        if self.clustering_backend == 'community_detection':
+            import torch
+            from sentence_transformers import util
+            corpus_weakness_embeddings = torch.from_numpy(corpus_weakness_embeddings).to(self.cluster_embedder.device)
+            return util.community_detection(corpus_weakness_embeddings, min_community_size=cluster_min_size, threshold=cluster_threshold)
+        #same threshold/min-size semantics without the dense n x n similarity matrix
+        return clustering.community_detection(corpus_weakness_embeddings, threshold=cluster_threshold, min_community_size=cluster_min_size, max_neighbours=self.clustering_max_neighbours, backend=self.clustering_backend)
+
+
+    @metrics.timed('stage_seconds', stage='weaknesses_clustering')
     def weaknesses_clustering(self, cluster_min_size = 1, cluster_threshold=0.75):
-        """Clusters the identified process weaknesses."""
+        """Clusters the identified process weaknesses.
+
+        In incremental mode, weaknesses are first assigned to the stored clusters of previous runs. Only the remaining weaknesses are clustered into new clusters.
+        """
 
         self.weakness_cluster_batch['cluster'] = [-1 for _ in range(self.weakness_cluster_batch.shape[0])]
         corpus_weaknesses = self.weakness_cluster_batch["weakness"].tolist()
         self.weakness_cluster_batch = self.weakness_cluster_batch.values.tolist()
 
-        corpus_weakness_embeddings = self.cluster_embedder.encode(corpus_weaknesses, convert_to_tensor=True)
-        clusters = util.community_detection(corpus_weakness_embeddings, min_community_size=cluster_min_size, threshold=cluster_threshold)
+        embedding_dimension = self.cluster_embedder.get_sentence_embedding_dimension()
+        if corpus_weaknesses != []:
+            with metrics.timer('encode_seconds', model='cluster_embedder', purpose='weaknesses'):
+                self.weakness_embeddings = clustering.normalize_embeddings(self.cluster_embedder.encode(corpus_weaknesses, convert_to_numpy=True))
+        else:
+            self.weakness_embeddings = np.empty((0, embedding_dimension), dtype=np.float32)
+
+        self.known_clusters = {}
+        new_weakness_ids = np.arange(len(corpus_weaknesses))
+        first_cluster_id = 0
+
+        if self.incremental_clustering == True:
+            cluster_store.ensure_cluster_collection(self.qdrantdb_client, self.cluster_collection_name, embedding_dimension)
+            cluster_ids, self.known_clusters = cluster_store.assign_to_clusters(self.qdrantdb_client, self.cluster_collection_name, self.weakness_embeddings, cluster_threshold)
+            for weakness_id, cluster_id in enumerate(cluster_ids):
+                self.weakness_cluster_batch[weakness_id][2] = int(cluster_id)
+            new_weakness_ids = np.flatnonzero(cluster_ids == -1)
+            first_cluster_id = cluster_store.next_cluster_id(self.qdrantdb_client, self.cluster_collection_name)
+
+        clusters = self._detect_clusters(self.weakness_embeddings[new_weakness_ids], cluster_min_size, cluster_threshold) if len(new_weakness_ids) > 0 else []
 
         for idx, cluster_i in enumerate(clusters):
             for weakness_id in cluster_i:
-                self.weakness_cluster_batch[weakness_id][2] = idx
+                self.weakness_cluster_batch[new_weakness_ids[weakness_id]][2] = first_cluster_id + idx
 
         self.weakness_cluster_batch = pd.DataFrame(self.weakness_cluster_batch, columns=['feedback_id', 'weakness', 'cluster'])
         return self.weakness_cluster_batch
     
 
-    def cluster_query_generation(self, cluster_max_examples = 10):
-        """Generates, for each cluster, a search query aimed at finding improvement suggestions"""
-
+    def _query_requests(self, cluster_max_examples):
         system_prompt = query_generation_template.get_system_prompt()
         user_prompt_template = query_generation_template.get_user_prompt_template()
 
         clusters = set(self.weakness_cluster_batch['cluster'].to_list())
         clusters = sorted(list(clusters))
 
+        #clusters stored by previous runs keep their query
+        query_clusters = [cluster_i for cluster_i in clusters if cluster_i != -1 and cluster_i not in self.known_clusters]
+        requests = []
+        for cluster_i in query_clusters:
+            context = self._format_context(self.weakness_cluster_batch[self.weakness_cluster_batch['cluster']==cluster_i]['weakness'].to_list()[:cluster_max_examples])
+            requests.append(self._zero_shot_messages(user_prompt_template.format(texts=context), system_prompt))
+        return clusters, query_clusters, requests
+
+
+    @metrics.timed('stage_seconds', stage='cluster_query_generation')
+    def cluster_query_generation(self, cluster_max_examples = 10):
+        """Generates, for each cluster, a search query aimed at finding improvement suggestions"""
+
+        clusters, query_clusters, requests = self._query_requests(cluster_max_examples)
+
         #Generate search queries
-        self.cluster_queries_batch = []
-
-        for cluster_i in clusters:
-            if cluster_i != -1:
-                context = self._format_context(self.weakness_cluster_batch[self.weakness_cluster_batch['cluster']==cluster_i]['weakness'].to_list()[:cluster_max_examples])
-                response = self._zero_shot_response(user_prompt_template.format(texts=context), system_prompt)
-                try:
-                    self.cluster_queries_batch.append([cluster_i, json.loads(response.choices[0].message.content)['search_query']])
-                except:
-                    self.cluster_queries_batch.append([cluster_i, ''])
-            else:
-                self.cluster_queries_batch.append([cluster_i, ''])
+        responses = self.llm_executor.map(self._chat_completion, requests)
+        return self._assemble_queries(clusters, query_clusters, responses)
+
+
+    def _assemble_queries(self, clusters, query_clusters, responses):
+        search_queries = dict(zip(query_clusters, [self._response_field(response, 'search_query', '') for response in responses]))
+        search_queries.update({cluster_i: known_cluster['payload']['search_query'] for cluster_i, known_cluster in self.known_clusters.items()})
+
+        self.cluster_queries_batch = [[cluster_i, search_queries.get(cluster_i, '')] for cluster_i in clusters]
 
         self.cluster_queries_batch = pd.DataFrame(self.cluster_queries_batch, columns=['cluster', 'search_query'])
         return self.cluster_queries_batch
     
     
-    def _retrieve(self, query, limit_results_retrieve):
-        tweet_search_results = retrieval_processing.get_tweet_documents(query, self.qdrantdb_client, self.tweet_collection_name, self.search_embedder, limit_results_retrieve)
-        paper_search_results = retrieval_processing.get_paper_documents(query, self.qdrantdb_client, self.abstract_collection_name, self.search_embedder, self.grobid_url_setting, self.scholar_x_api_key, limit_results_retrieve)
-        web_search_results = retrieval_processing.get_web_documents(query, self.websearch_service, self.GOOGLE_CSE_ID, self.search_embedder, limit_results_retrieve)
-        
-        query_results = [tweet_search_results, paper_search_results, web_search_results]
-        query_results = list(chain(*query_results))
+    def _retrieve_sources(self, query, sources, limit_results_retrieve, tweet_search_results=None, abstract_search_results=None):
+        #The sources are retrieved concurrently. A source that fails or exceeds its timeout returns None.
+        #The lazy components are created in the workers, so that a component that cannot be created fails only its source.
+        start = time.monotonic()
+        retrievers = {
+            'tweets': lambda: retrieval_processing.get_tweet_documents(query, self.qdrantdb_client, self.tweet_collection_name, self.search_embedder, limit_results_retrieve, tweet_search_results, self.collection_profile),
+            'abstracts': lambda: retrieval_processing.get_abstract_documents(query, self.qdrantdb_client, self.abstract_collection_name, self.search_embedder, limit_results_retrieve, abstract_search_results, self.collection_profile),
+            'papers': lambda: retrieval_processing.get_paper_documents(query, self.qdrantdb_client, self.abstract_collection_name, self.search_embedder, self.grobid_url_setting, self.scholar_x_api_key, limit_results_retrieve, self.paper_cache, self.paper_max_workers, abstract_search_results, self.scholar_url, self.split_overlap, self.collection_profile),
+            'web': lambda: retrieval_processing.get_web_documents(query, self.websearch_service, self.GOOGLE_CSE_ID, self.search_embedder, limit_results_retrieve, self.split_overlap),
+        }
+        source_futures = {source: self.retrieval_pool.submit(retrievers[source]) for source in sources}
+
+        source_results = {}
+        for source, future in source_futures.items():
+            remaining_time = max(0, start + self.retrieval_timeouts[source] - time.monotonic())
+            try:
+                source_results[source] = future.result(timeout=remaining_time)
+            except FutureTimeoutError:
+                #a source that has not started yet is dropped; a running one keeps its worker until it returns
+                future.cancel()
+                metrics.failure(f'{source}_retrieval_timeout')
+                source_results[source] = None
+            except Exception:
+                metrics.failure(f'{source}_retrieval')
+                source_results[source] = None
+        return source_results
+
+
+    def _retrieve(self, query, limit_results_retrieve, tweet_search_results=None, abstract_search_results=None):
+        source_results = self._retrieve_sources(query, ('tweets', 'papers', 'web'), limit_results_retrieve, tweet_search_results, abstract_search_results)
+        query_results = list(chain(*[results for results in source_results.values() if results is not None]))
         return query_results
 
 
-    def _rerank(self, query, query_results, limit_results_rerank):
-        corpus = [query_result[0] for query_result in query_results]
-        query_corpus_combinations = [[query, document] for document in corpus]
+    def _retrieve_adaptive(self, query, limit_results_retrieve, limit_results_rerank, tweet_search_results=None, abstract_search_results=None):
+        """Retrieves and reranks tier by tier (see RETRIEVAL_TIERS) until enough reranked results are relevant.
 
-        #print('Reranking')
-        # Compute the similarity scores for these combinations
-        similarity_scores = self.cross_encoder.predict(query_corpus_combinations)
+        Every tier adds its sources to the candidates of the previous tiers, which are reranked again (their scores are
+        cached). The escalation ends when at least adaptive_retrieval_min_results reranked results score
+        adaptive_retrieval_min_score or more. Returns the reranked results and the names of the tiers used.
+        """
+        min_results = self.adaptive_retrieval_min_results if self.adaptive_retrieval_min_results is not None else limit_results_rerank
+        min_results = min(min_results, limit_results_rerank)
 
-        # Sort the scores in decreasing order
-        sim_scores_argsort = reversed(np.argsort(similarity_scores))
+        candidates = {}
+        tiers = []
+        for tier, sources in RETRIEVAL_TIERS:
+            tiers.append(tier)
+            for source, results in self._retrieve_sources(query, sources, limit_results_retrieve, tweet_search_results, abstract_search_results).items():
+                if results is None:
+                    continue
+                #the paper documents contain the abstracts of the papers without a full text
+                if source == 'papers':
+                    candidates.pop('abstracts', None)
+                candidates[source] = results
 
-        reranked_results = []
-        for idx in sim_scores_argsort:
-            reranked_results.append(query_results[idx])
-        return reranked_results[0:limit_results_rerank]
+            reranked, scores = self.reranker.rerank_with_scores(query, list(chain(*candidates.values())), limit_results_rerank)
+            if sum(score >= self.adaptive_retrieval_min_score for score in scores) >= min_results:
+                break
 
+        metrics.increment('retrieval_exit_total', tier=tiers[-1])
+        return reranked, tiers
 
-    def _suggestions_identification(self, query, reranked_query_results):
+
+    def _rerank(self, query, query_results, limit_results_rerank):
+        return self.reranker.rerank(query, query_results, limit_results_rerank)
+
+
+    def _suggestions_identification(self, queries, reranked_query_results):
         system_prompt = suggestion_identification_template.get_system_prompt()
         user_prompt_template = suggestion_identification_template.get_user_prompt_template()
 
-        context = [reranked_query_result[0] for reranked_query_result in reranked_query_results]
+        user_prompts = []
+        for query, reranked_query_results_i in zip(queries, reranked_query_results):
+            context = [reranked_query_result[0] for reranked_query_result in reranked_query_results_i]
+            context = self._format_context(context)
+            user_prompts.append(user_prompt_template.format(context=context, query=query))
 
         #Generate suggestions
-        context = self._format_context(context)
-        response = self._zero_shot_response(user_prompt_template.format(context=context, query=query), system_prompt)
-        try:
-            improvement_suggestions = json.loads(response.choices[0].message.content)['improvement_suggestion']
-        except:
-            improvement_suggestions = 'N/A'
+        responses = self.llm_executor.map(lambda user_prompt_i: self._zero_shot_response(user_prompt_i, system_prompt), user_prompts)
+        improvement_suggestions = [self._response_field(response, 'improvement_suggestion', 'N/A') for response in responses]
         return improvement_suggestions
 
 
     def _suggestions_postprocessing(self):
-        self.weakness_cluster_batch = self.weakness_cluster_batch.values.tolist()
-        self.cluster_queries_batch = self.cluster_queries_batch.values.tolist()
-
-        for idx, weakness_cluster_i in enumerate(self.weakness_cluster_batch):
-            self.weakness_cluster_batch[idx].append([])
-            for cluster_query_i in self.cluster_queries_batch:
-                if weakness_cluster_i[2] == cluster_query_i[0]:
-                    self.weakness_cluster_batch[idx][3] = cluster_query_i[2]
-
-        self.cluster_queries_batch = pd.DataFrame(self.cluster_queries_batch, columns=['cluster', 'search_query', 'suggestions', 'reranked'])
-
-        self.feedback_weakness_batch = self.feedback_weakness_batch.values.tolist()
-        for idx, feedback_weakness_i in enumerate(self.feedback_weakness_batch):
-            self.feedback_weakness_batch[idx].append([])
-            suggestions_i = []
-            for weakness_cluster_i in self.weakness_cluster_batch:
-                if feedback_weakness_i[0] == weakness_cluster_i[0]:
-                    suggestions_i.append(weakness_cluster_i[3])
-            self.feedback_weakness_batch[idx][3] = list(set(suggestions_i))
+        self.feedback_weakness_batch, self.weakness_cluster_batch = postprocessing.attach_suggestions(self.feedback_weakness_batch, self.weakness_cluster_batch, self.cluster_queries_batch)
+
+
+    def _save_clusters(self):
+        #stores the centroids, queries and suggestions of the clusters of this run for later runs
+        embedding_dimension = self.weakness_embeddings.shape[1]
+        cluster_weakness_ids = pd.Series(range(self.weakness_cluster_batch.shape[0])).groupby(self.weakness_cluster_batch['cluster'].to_list()).indices
+
+        clusters = []
+        for cluster_i, search_query, suggestions, reranked in self.cluster_queries_batch[['cluster', 'search_query', 'suggestions', 'reranked']].values.tolist():
+            if cluster_i == -1:
+                continue
+            member_embeddings = self.weakness_embeddings[cluster_weakness_ids[cluster_i]]
+            if cluster_i in self.known_clusters:
+                known_cluster = self.known_clusters[cluster_i]
+                member_sum, centroid = cluster_store.update_centroid(cluster_store.stored_member_sum(known_cluster), member_embeddings)
+                size = known_cluster['payload']['size'] + len(member_embeddings)
+            elif search_query == '' or suggestions == 'N/A':
+                #failed generations are not stored, so that the cluster is generated again in a later run
+                continue
+            else:
+                member_sum, centroid = cluster_store.update_centroid(np.zeros(embedding_dimension), member_embeddings)
+                size = len(member_embeddings)
+            clusters.append({'cluster': cluster_i, 'centroid': centroid, 'size': size, 'member_sum': member_sum, 'search_query': search_query, 'suggestions': suggestions, 'reranked': reranked})
 
-        self.feedback_weakness_batch = pd.DataFrame(self.feedback_weakness_batch, columns=['feedback_id', 'feedback_text', 'weaknesses', 'suggestions'])
-        self.weakness_cluster_batch = pd.DataFrame(self.weakness_cluster_batch, columns=['feedback_id', 'weakness', 'cluster', 'suggestions'])
+        cluster_store.save_clusters(self.qdrantdb_client, self.cluster_collection_name, clusters)
 
 
+    @metrics.timed('stage_seconds', stage='cluster_suggestion_generation')
     def cluster_suggestion_generation(self, limit_results_retrieve, limit_results_rerank):
         """Generates improvement suggestions for each cluster using knowledge resources"""
         
+        all_queries = self.cluster_queries_batch['search_query'].to_list()
+        all_clusters = self.cluster_queries_batch['cluster'].to_list()
+        if self.query_cache_enabled == True:
+            #expired entries would still be searched on every lookup before being filtered out
+            self.query_cache.purge_expired()
+
+        #clusters stored by previous runs reuse their suggestions
+        pending_idxs = [idx for idx, cluster_i in enumerate(all_clusters) if cluster_i not in self.known_clusters]
+        pending_queries = [all_queries[idx] for idx in pending_idxs]
+        with metrics.timer('encode_seconds', model='search_embedder', purpose='queries'):
+            pending_vectors = self.search_embedder.encode(pending_queries) if pending_queries != [] else np.empty((0, 0), dtype=np.float32)
+
+        #Queries close to a cached query or to an earlier query of this run reuse its reranked context and suggestion
+        cached = [None for _ in pending_queries]
+        leaders = np.arange(len(pending_queries))
+        if self.query_cache_enabled == True and pending_queries != []:
+            cached = self.query_cache.lookup(pending_vectors)
+            uncached_idxs = np.array([idx for idx, cached_i in enumerate(cached) if cached_i is None], dtype=np.int64)
+            if len(uncached_idxs) > 0:
+                leaders[uncached_idxs] = uncached_idxs[query_cache.follow_similar(pending_vectors[uncached_idxs], self.query_cache_threshold)]
+        retrieve_idxs = [idx for idx in range(len(pending_queries)) if cached[idx] is None and leaders[idx] == idx]
+        metrics.increment('query_reuse_total', len(pending_queries) - len(retrieve_idxs))
+        queries = [pending_queries[idx] for idx in retrieve_idxs]
+        query_vectors = pending_vectors[retrieve_idxs]
         reranked_query_results = []
-        improvement_suggestions = []
-
-        for idx, query in enumerate(self.cluster_queries_batch['search_query'].to_list()):
-            query_results = self._retrieve(query, limit_results_retrieve)
-            reranked_query_results.append(self._rerank(query, query_results, limit_results_rerank))
-            improvement_suggestions.append(self._suggestions_identification(query, reranked_query_results[idx]))
-
-        self.cluster_queries_batch['suggestions'] = improvement_suggestions
-        self.cluster_queries_batch['reranked'] = reranked_query_results
+        retrieval_tiers = []
+
+        #The knowledge base collections are searched for all queries at once
+        tweet_search_results = vector_db.search_kb_batch(queries, self.qdrantdb_client, self.tweet_collection_name, self.search_embedder, limit_results_retrieve, query_vectors, profile=self.collection_profile)
+        abstract_search_results = vector_db.search_kb_batch(queries, self.qdrantdb_client, self.abstract_collection_name, self.search_embedder, limit_results_retrieve, query_vectors, profile=self.collection_profile)
+
+        #Retrieval for the next cluster runs while the current cluster is reranked; adaptive retrieval reranks while it retrieves
+        if self.adaptive_retrieval == True:
+            prefetch = lambda idx: self.prefetch_pool.submit(self._retrieve_adaptive, queries[idx], limit_results_retrieve, limit_results_rerank, tweet_search_results[idx], abstract_search_results[idx])
+        else:
+            prefetch = lambda idx: self.prefetch_pool.submit(self._retrieve, queries[idx], limit_results_retrieve, tweet_search_results[idx], abstract_search_results[idx])
+        next_query_results = prefetch(0) if queries != [] else None
+        for idx, query in enumerate(queries):
+            query_results = next_query_results.result()
+            if idx + 1 < len(queries):
+                next_query_results = prefetch(idx + 1)
+            if self.adaptive_retrieval == True:
+                reranked_query_results.append(query_results[0])
+                retrieval_tiers.append(query_results[1])
+            else:
+                reranked_query_results.append(self._rerank(query, query_results, limit_results_rerank))
+                retrieval_tiers.append([tier for tier, _ in RETRIEVAL_TIERS])
+
+        improvement_suggestions = self._suggestions_identification(queries, reranked_query_results)
+
+        #failed generations and empty contexts are not cached
+        if self.query_cache_enabled == True:
+            cacheable = [idx for idx, (suggestion_i, reranked_i) in enumerate(zip(improvement_suggestions, reranked_query_results)) if suggestion_i != 'N/A' and reranked_i != []]
+            self.query_cache.put([queries[idx] for idx in cacheable], query_vectors[cacheable], [reranked_query_results[idx] for idx in cacheable], [improvement_suggestions[idx] for idx in cacheable])
+
+        pending_results = dict(zip(retrieve_idxs, zip(improvement_suggestions, reranked_query_results, retrieval_tiers)))
+        for idx, cached_i in enumerate(cached):
+            if cached_i is not None:
+                pending_results[idx] = (cached_i['suggestions'], cached_i['reranked'], [])
+        for idx, leader in enumerate(leaders):
+            if cached[idx] is None and leader != idx:
+                pending_results[idx] = pending_results[leader][:2] + ([],)
+
+        all_suggestions = [self.known_clusters[cluster_i]['payload']['suggestions'] if cluster_i in self.known_clusters else None for cluster_i in all_clusters]
+        all_reranked = [self.known_clusters[cluster_i]['payload']['reranked'] if cluster_i in self.known_clusters else None for cluster_i in all_clusters]
+        #retrieval_tiers lists the tiers retrieved for a cluster in this run, none for reused suggestions
+        all_retrieval_tiers = [[] for _ in all_clusters]
+        for pending_idx, idx in enumerate(pending_idxs):
+            all_suggestions[idx], all_reranked[idx], all_retrieval_tiers[idx] = pending_results[pending_idx]
+
+        self.cluster_queries_batch['suggestions'] = all_suggestions
+        self.cluster_queries_batch['reranked'] = all_reranked
+        self.cluster_queries_batch['retrieval_tiers'] = all_retrieval_tiers
+        if self.incremental_clustering == True:
+            self._save_clusters()
         self._suggestions_postprocessing()
         return self.cluster_queries_batch, self.weakness_cluster_batch, self.feedback_weakness_batch
 
 
-    def feedback_answer_generation(self):
-        """Generates, for each feedback, an answer that merges the suggestions relevant for the feedback"""
-        
+    def _answer_requests(self):
         system_prompt = answer_generation_template.get_system_prompt()
         user_prompt_template = answer_generation_template.get_user_prompt_template()
 
         feedback_texts = self.feedback_weakness_batch["feedback_text"].to_list()
         suggestions = self.feedback_weakness_batch["suggestions"].to_list()
-        improvement_suggestions_texts = []
-
-        for idx, feedback_i in enumerate(feedback_texts):
-            if suggestions[idx] != []:
-                context = self._format_context(suggestions[idx])
-
-                #Generate answers
-                response = self._zero_shot_response(user_prompt_template.format(context=context, prompt_feedback=feedback_i), system_prompt)
-                try:
-                    improvement_suggestions_texts.append(json.loads(response.choices[0].message.content)['improvement_suggestions_text'])
-                except:
-                    improvement_suggestions_texts.append('N/A')
-            else:
-                improvement_suggestions_texts.append('N/A')
+
+        answer_idxs = [idx for idx in range(len(feedback_texts)) if suggestions[idx] != []]
+        requests = [self._zero_shot_messages(user_prompt_template.format(context=self._format_context(suggestions[idx]), prompt_feedback=feedback_texts[idx]), system_prompt) for idx in answer_idxs]
+        return answer_idxs, requests
+
+
+    @metrics.timed('stage_seconds', stage='feedback_answer_generation')
+    def feedback_answer_generation(self):
+        """Generates, for each feedback, an answer that merges the suggestions relevant for the feedback"""
+        
+        answer_idxs, requests = self._answer_requests()
+
+        #Generate answers
+        responses = self.llm_executor.map(self._chat_completion, requests)
+        return self._assemble_answers(answer_idxs, responses)
+
+
+    def _assemble_answers(self, answer_idxs, responses):
+        improvement_suggestions_texts = ['N/A' for _ in range(self.feedback_weakness_batch.shape[0])]
+        for idx, response in zip(answer_idxs, responses):
+            improvement_suggestions_texts[idx] = self._response_field(response, 'improvement_suggestions_text', 'N/A')
 
         self.feedback_weakness_batch["answer"] = improvement_suggestions_texts
         
         return self.feedback_weakness_batch
+
+
+    def _batch_stage(self, stage, cluster_max_examples):
+        #the requests of a stage and the function that assembles its DataFrames from the responses, in request order
+        if stage == 'weaknesses_identification':
+            corpus_feedback_batch = self.feedback.values.tolist()
+            representatives = self._feedback_representatives(corpus_feedback_batch)
+            representative_idxs = np.unique(representatives)
+            requests = self._weakness_requests(corpus_feedback_batch, representative_idxs)
+            def assemble(responses):
+                representative_weaknesses = [self._response_field(response, 'process_weaknesses', []) for response in responses]
+                process_weaknesses = self._fan_out_weaknesses(representatives, representative_idxs, representative_weaknesses)
+                self.feedback_weakness_batch, self.weakness_cluster_batch = self._assemble_weaknesses(corpus_feedback_batch, process_weaknesses)
+                return self.feedback_weakness_batch, self.weakness_cluster_batch
+        elif stage == 'cluster_query_generation':
+            clusters, query_clusters, requests = self._query_requests(cluster_max_examples)
+            assemble = lambda responses: self._assemble_queries(clusters, query_clusters, responses)
+        elif stage == 'feedback_answer_generation':
+            answer_idxs, requests = self._answer_requests()
+            assemble = lambda responses: self._assemble_answers(answer_idxs, responses)
+        else:
+            raise ValueError(f"{stage} cannot run as a batch job, use one of {', '.join(BATCH_STAGES)}")
+
+        bodies = [self._request_body(messages) for messages in requests]
+        #the request hash keeps results of a job built from other inputs from being assigned to the wrong rows
+        custom_ids = [f'{stage}-{idx}-{self._request_key(body)[:16]}' for idx, body in enumerate(bodies)]
+        return custom_ids, bodies, assemble
+
+
+    def write_batch_requests(self, stage, request_path, cluster_max_examples = 10):
+        """Writes the LLM requests of a stage to batch input files in the format of the OpenAI batch API instead of sending them.
+
+        The requests are split into files of at most batch_max_requests requests and batch_max_file_mb MB, named after
+        request_path (requests.jsonl -> requests-00000.jsonl, ...), and one batch job is submitted per file. Returns the
+        paths of the files. The results are ingested with ingest_batch_results, which needs the engine in
+        the same state (e.g., the same feedback loaded for weaknesses_identification). weaknesses_identification sends
+        one request per tweet in this mode, regardless of the configured pack size.
+        """
+
+        custom_ids, bodies, _ = self._batch_stage(stage, cluster_max_examples)
+        request_lines = [batch_jobs.request_line(custom_id, body) for custom_id, body in zip(custom_ids, bodies)]
+        return batch_jobs.write_jsonl_shards(request_path, request_lines, self.batch_max_requests, self.batch_max_bytes)
+
+
+    def ingest_batch_results(self, stage, result_paths, resubmission_path = None, cluster_max_examples = 10):
+        """Assembles the DataFrames of a stage from the output and error files of its batch jobs and returns them like the stage method.
+
+        result_paths can hold the files of all jobs of the stage and of any resubmissions. Requests without a successful
+        result get the default of a failed request; with resubmission_path, they are written to new batch input files
+        named after it, like in write_batch_requests. Successful results are added to the completion cache.
+        """
+
+        custom_ids, bodies, assemble = self._batch_stage(stage, cluster_max_examples)
+        contents, errors = batch_jobs.read_results(result_paths)
+
+        responses = []
+        missing = []
+        for custom_id, body in zip(custom_ids, bodies):
+            if custom_id in contents:
+                self.completion_cache.put(self._request_key(body), contents[custom_id])
+                responses.append(contents[custom_id])
+            else:
+                responses.append(batch_jobs.MissingResult(errors.get(custom_id, 'no result')))
+                missing.append(batch_jobs.request_line(custom_id, body))
+
+        metrics.increment('batch_results_total', len(custom_ids) - len(missing), stage=stage, result='success')
+        metrics.increment('batch_results_total', len(missing), stage=stage, result='missing')
+        if missing != []:
+            print(f'{stage}: {len(missing)} of {len(custom_ids)} batch requests without result ({len([line for line in missing if line["custom_id"] in errors])} failed)')
+            if resubmission_path is not None:
+                resubmission_paths = batch_jobs.write_jsonl_shards(resubmission_path, missing, self.batch_max_requests, self.batch_max_bytes)
+                print(f'{stage}: resubmit {", ".join(resubmission_paths)}')
+
+        return assemble(responses)
@@ -0,0 +1,24 @@
+import os
+import pytest
+import sys
+
+#the modules import each other relative to the suggestion_generation directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """A SuggestionEngine with its caches in tmp_path and the OpenAI stub of the benchmarks."""
+    from benchmarks import fakes
+    from config import config_params
+    from suggestion_engine import SuggestionEngine
+
+    monkeypatch.setitem(config_params, 'llm_cache_path', str(tmp_path / 'llm_completions.sqlite'))
+    monkeypatch.setitem(config_params, 'paper_cache_path', str(tmp_path / 'papers.sqlite'))
+    monkeypatch.setitem(config_params, 'robots_cache_path', str(tmp_path / 'robots.sqlite'))
+    monkeypatch.setitem(config_params, 'embedding_cache_path', str(tmp_path / 'embeddings'))
+    engine = SuggestionEngine()
+    engine.openAI_client = fakes.FakeOpenAI(latency=0, jitter=0)
+    yield engine
+    engine.retrieval_pool.shutdown()
+    engine.prefetch_pool.shutdown()
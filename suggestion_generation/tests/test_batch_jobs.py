@@ -0,0 +1,55 @@
+import glob
+import os
+import pandas as pd
+from benchmarks import fakes
+from benchmarks import synthetic
+from processing_utils import batch_jobs
+from processing_utils import llm_cache
+
+
+def test_shards_respect_line_and_byte_limits(tmp_path):
+    lines = [{'custom_id': str(idx), 'text': 'x' * (idx % 7)} for idx in range(23)]
+    paths = batch_jobs.write_jsonl_shards(str(tmp_path / 'requests.jsonl'), lines, max_lines=5, max_bytes=120)
+
+    assert [os.path.basename(path) for path in paths][:2] == ['requests-00000.jsonl', 'requests-00001.jsonl']
+    assert [line for path in paths for line in batch_jobs.read_jsonl(path)] == lines
+    for path in paths:
+        assert len(batch_jobs.read_jsonl(path)) <= 5
+        assert os.path.getsize(path) <= 120
+
+
+def test_write_run_ingest_and_resubmit(engine, tmp_path):
+    feedback = pd.DataFrame(synthetic.synthetic_tweets(40, seed=41), columns=['id', 'text'])
+    engine.load_feedback(feedback, 'id', 'text', False)
+    expected = engine.weaknesses_identification()[0]['weaknesses'].to_list()
+
+    #ingested results go to the completion cache
+    engine.completion_cache = llm_cache.CompletionCache(str(tmp_path / 'llm_completions.sqlite'))
+    engine.batch_max_requests = 15
+    request_paths = engine.write_batch_requests('weaknesses_identification', str(tmp_path / 'requests.jsonl'))
+    assert len(request_paths) == 3
+
+    #a third of the requests fail in the first jobs and are resubmitted
+    runner = batch_jobs.LocalBatchRunner(fakes.FakeOpenAI(latency=0, jitter=0), failure_rate=0.3)
+    result_paths = []
+    for idx, request_path in enumerate(request_paths):
+        result_paths.append(str(tmp_path / f'output-{idx}.jsonl'))
+        runner.run(request_path, result_paths[-1], str(tmp_path / f'errors-{idx}.jsonl'))
+        result_paths.append(str(tmp_path / f'errors-{idx}.jsonl'))
+    partial = engine.ingest_batch_results('weaknesses_identification', result_paths, str(tmp_path / 'resubmission.jsonl'))[0]['weaknesses'].to_list()
+    assert partial != expected
+
+    #only the requests without a result are resubmitted
+    succeeded = set(batch_jobs.read_results(result_paths)[0])
+    resubmission_paths = sorted(glob.glob(str(tmp_path / 'resubmission-*.jsonl')))
+    resubmitted = [line['custom_id'] for path in resubmission_paths for line in batch_jobs.read_jsonl(path)]
+    assert resubmitted != [] and succeeded.isdisjoint(resubmitted)
+    assert succeeded | set(resubmitted) == set(line['custom_id'] for path in request_paths for line in batch_jobs.read_jsonl(path))
+    for idx, resubmission_path in enumerate(resubmission_paths):
+        result_paths.append(str(tmp_path / f'resubmission-output-{idx}.jsonl'))
+        batch_jobs.LocalBatchRunner(fakes.FakeOpenAI(latency=0, jitter=0)).run(resubmission_path, result_paths[-1])
+    assert engine.ingest_batch_results('weaknesses_identification', result_paths)[0]['weaknesses'].to_list() == expected
+
+    #the synchronous stage is now answered from the completion cache alone
+    engine.openAI_client = None
+    assert engine.weaknesses_identification()[0]['weaknesses'].to_list() == expected
@@ -0,0 +1,34 @@
+import numpy as np
+from processing_utils import cluster_store
+from processing_utils import clustering
+
+
+def members(rng, n, dimension=8):
+    #normalized embeddings spread around one direction, so that their mean is clearly shorter than 1
+    return clustering.normalize_embeddings(np.ones(dimension, dtype=np.float32) + rng.normal(scale=1.0, size=(n, dimension)).astype(np.float32))
+
+
+def save(client, member_sum, centroid, size):
+    cluster_store.save_clusters(client, 'clusters', [{'cluster': 0, 'centroid': centroid, 'size': size, 'member_sum': member_sum, 'search_query': 'q', 'suggestions': 's', 'reranked': []}])
+
+
+def test_incremental_updates_match_a_single_update():
+    from qdrant_client import QdrantClient
+    client = QdrantClient(':memory:')
+    cluster_store.ensure_cluster_collection(client, 'clusters', 8)
+    rng = np.random.default_rng(41)
+    batches = [members(rng, 5), members(rng, 40), members(rng, 3)]
+
+    member_sum, centroid = cluster_store.update_centroid(np.zeros(8), batches[0])
+    save(client, member_sum, centroid, len(batches[0]))
+    size = len(batches[0])
+    for batch in batches[1:]:
+        _, stored_clusters = cluster_store.assign_to_clusters(client, 'clusters', batch, threshold=-1.0)
+        member_sum, centroid = cluster_store.update_centroid(cluster_store.stored_member_sum(stored_clusters[0]), batch)
+        size += len(batch)
+        save(client, member_sum, centroid, size)
+
+    _, expected = cluster_store.update_centroid(np.zeros(8), np.concatenate(batches))
+    _, stored_clusters = cluster_store.assign_to_clusters(client, 'clusters', batches[0][:1], threshold=-1.0)
+    np.testing.assert_allclose(stored_clusters[0]['centroid'], expected, atol=1e-6)
+    np.testing.assert_allclose(centroid, expected, atol=1e-6)
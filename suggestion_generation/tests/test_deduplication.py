@@ -0,0 +1,11 @@
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize('n_feedback', [0, 1])
+def test_dedup_of_batches_without_pairs(engine, n_feedback):
+    engine.feedback_dedup_threshold = 0.8
+    feedback = pd.DataFrame({'id': list(range(n_feedback)), 'text': ['the boarding was late'] * n_feedback})
+    engine.load_feedback(feedback, 'id', 'text', False)
+    assert engine.weaknesses_identification()[0].shape[0] == n_feedback
+    assert list(engine._feedback_representatives(engine.feedback.values.tolist())) == list(range(n_feedback))
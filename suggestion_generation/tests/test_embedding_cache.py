@@ -0,0 +1,19 @@
+import numpy as np
+from benchmarks import fakes
+from processing_utils import embedding_cache
+
+
+def test_misses_are_looked_up_once_per_encode(tmp_path, monkeypatch):
+    cache = embedding_cache.EmbeddingCache(str(tmp_path), 'fake', 16, max_entries=1000)
+    lookups = []
+    lookup = cache._lookup
+    monkeypatch.setattr(cache, '_lookup', lambda keys: lookups.append(len(keys)) or lookup(keys))
+
+    texts = [f'weakness {idx}' for idx in range(500)]
+    embeddings = cache.encode(fakes.FakeEmbedder(dimension=16), texts)
+
+    #one lookup of the requested keys and one of the misses before they are stored
+    assert lookups == [500, 500]
+    assert cache.stats()['entries'] == 500
+    np.testing.assert_allclose(cache.encode(fakes.FakeEmbedder(dimension=16), texts), embeddings, atol=1e-2)
+    assert cache.stats()['hits'] == 500
@@ -0,0 +1,27 @@
+import json
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize('value', [None, 'late boarding', {'1': ['late boarding']}, ['late boarding', None]])
+def test_malformed_weaknesses_fall_back_to_default(engine, value):
+    assert engine._response_field(json.dumps({'process_weaknesses': value}), 'process_weaknesses', []) == []
+
+
+@pytest.mark.parametrize('value', [None, ['a suggestion'], {'text': 'a suggestion'}])
+def test_malformed_suggestions_fall_back_to_default(engine, value):
+    assert engine._response_field(json.dumps({'improvement_suggestion': value}), 'improvement_suggestion', 'N/A') == 'N/A'
+
+
+def test_well_formed_fields_are_returned(engine):
+    assert engine._response_field(json.dumps({'process_weaknesses': ['late boarding']}), 'process_weaknesses', []) == ['late boarding']
+    assert engine._response_field(json.dumps({'search_query': 'boarding'}), 'search_query', '') == 'boarding'
+
+
+@pytest.mark.parametrize('value', [None, 'late boarding', {'1': ['late boarding']}])
+def test_weaknesses_identification_survives_malformed_responses(engine, value):
+    engine.openAI_client.respond = lambda messages: {'process_weaknesses': value}
+    engine.load_feedback(pd.DataFrame({'id': [1, 2], 'text': ['the boarding was late', 'my bag got lost']}), 'id', 'text', False)
+    engine.weaknesses_identification()
+    assert engine.feedback_weakness_batch['weaknesses'].to_list() == [[], []]
+    assert engine.weakness_cluster_batch.shape[0] == 0
@@ -0,0 +1,49 @@
+import json
+import os
+import pytest
+from benchmarks import fakes
+from processing_utils import vector_db
+
+
+def write_tweets(path, ids, mode='w'):
+    with open(path, mode) as f:
+        for idx in ids:
+            f.write(json.dumps({'id': idx, 'text': f'tweet number {idx} about a delayed flight'}) + '\n')
+
+
+@pytest.fixture
+def client():
+    from qdrant_client import QdrantClient
+    return QdrantClient(':memory:')
+
+
+def ingest(resource_path, client, checkpoint_path):
+    vector_db.create_db_collection(resource_path, 'id', 'text', client, 'tweets', fakes.FakeEmbedder(dimension=16), False, incremental=True, checkpoint_path=checkpoint_path)
+
+
+@pytest.mark.parametrize('mode', ['rewrite', 'append'])
+def test_changed_file_with_the_same_name_is_ingested_again(tmp_path, client, mode):
+    resource_path = str(tmp_path / 'tweets')
+    os.makedirs(resource_path)
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    write_tweets(os.path.join(resource_path, 'tweets.jsonl'), range(40))
+    ingest(resource_path, client, checkpoint_path)
+    assert client.count('tweets').count == 40
+    assert not os.path.exists(checkpoint_path)
+
+    write_tweets(os.path.join(resource_path, 'tweets.jsonl'), range(40, 80), 'w' if mode == 'rewrite' else 'a')
+    ingest(resource_path, client, checkpoint_path)
+    assert client.count('tweets').count == 80
+    assert vector_db.existing_sources(client, 'tweets', list(range(40, 80))) == set(range(40, 80))
+
+
+def test_checkpoint_of_a_changed_file_is_ignored(tmp_path):
+    resource_file = tmp_path / 'tweets.jsonl'
+    write_tweets(str(resource_file), range(10))
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    checkpoint = vector_db.IngestCheckpoint(checkpoint_path, 'tweets', 5, {'tweets.jsonl': vector_db.file_signature(str(resource_file))})
+    checkpoint.mark_done('tweets.jsonl', 1)
+    assert vector_db.IngestCheckpoint(checkpoint_path, 'tweets', 5, {'tweets.jsonl': vector_db.file_signature(str(resource_file))}).is_done('tweets.jsonl', 1)
+
+    write_tweets(str(resource_file), range(10, 12), 'a')
+    assert not vector_db.IngestCheckpoint(checkpoint_path, 'tweets', 5, {'tweets.jsonl': vector_db.file_signature(str(resource_file))}).is_done('tweets.jsonl', 0)